@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, send_file, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from flask_caching import Cache
 from flask_limiter import Limiter
@@ -14,9 +14,12 @@ import redis
 
 from config import config
 from sqlalchemy import or_, text
-from models import db, User, Server, Task, Content, Backup, CustomField, CustomFieldValue, SecurityProject, Notification, Credential, Bookmark, Attachment, ActivityLog, Person, LookupItem, FreeIPAServer, FreeIPAUser, FreeIPAGroup, FreeIPAUserGroup, UserPassword, SMSTemplate, SMSLog
+from models import db, User, Server, Task, Content, Backup, CustomField, CustomFieldValue, SecurityProject, Notification, Credential, Bookmark, Attachment, ActivityLog, Person, LookupItem, ServerImportJob, ServerStatusCheck, FreeIPAServer, FreeIPAUser, FreeIPAGroup, FreeIPAUserGroup, UserPassword, SMSTemplate, SMSLog
 from app_custom_fields import custom_fields_bp
+from server_import import enqueue_import_job, recover_stale_jobs, ALLOWED_IMPORT_EXTENSIONS
+from server_export import generate_csv, generate_xlsx
 from freeipa_service import freeipa_service
+from freeipa_provision import recover_stale_provision_jobs
 from freeipa_routes import freeipa_bp
 from forms import (LoginForm, UserForm, EditUserForm, ChangePasswordForm, 
                   ServerForm, TaskForm, ContentForm, BackupForm,
@@ -30,6 +33,7 @@ from functools import wraps
 import hashlib
 from cryptography.fernet import Fernet
 from utils.crypto import encrypt_text, decrypt_text, is_crypto_ready
+from utils.ipaddr import cidr_bounds, ip_sort_key, subnet_for
 
 def create_app(config_name='default'):
     app = Flask(__name__)
@@ -73,6 +77,17 @@ def create_app(config_name='default'):
     except Exception:
         pass
 
+    # Server import jobs left running/pending by a previous (restarted) worker (stale heartbeat)
+    try:
+        with app.app_context():
+            job_columns = {col['name'] for col in db.inspect(db.engine).get_columns('server_import_job')}
+            if 'updated_at' not in job_columns:
+                with db.engine.begin() as conn:
+                    conn.execute(text("ALTER TABLE server_import_job ADD COLUMN updated_at TIMESTAMP"))
+            recover_stale_jobs()
+    except Exception:
+        pass
+
     # Setup logging
     setup_logging(app)
     
@@ -201,6 +216,91 @@ def create_app(config_name='default'):
     except Exception:
         pass
     
+    # Ensure Server numeric IP columns exist and are backfilled (CIDR range queries)
+    try:
+        with app.app_context():
+            engine = db.engine
+            inspector = db.inspect(engine)
+            server_columns = {col['name'] for col in inspector.get_columns('server')}
+            with engine.begin() as conn:
+                if 'ip_version' not in server_columns:
+                    conn.execute(text("ALTER TABLE server ADD COLUMN ip_version SMALLINT"))
+                if 'ip_value' not in server_columns:
+                    conn.execute(text("ALTER TABLE server ADD COLUMN ip_value VARCHAR(32)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_server_ip_version_value ON server (ip_version, ip_value)"))
+                # پیوند با host entryهای FreeIPA (freeipa_hosts.py)
+                if 'freeipa_fqdn' not in server_columns:
+                    conn.execute(text("ALTER TABLE server ADD COLUMN freeipa_fqdn VARCHAR(255)"))
+                if 'freeipa_missing' not in server_columns:
+                    conn.execute(text("ALTER TABLE server ADD COLUMN freeipa_missing BOOLEAN DEFAULT FALSE"))
+                if 'freeipa_missing_since' not in server_columns:
+                    conn.execute(text("ALTER TABLE server ADD COLUMN freeipa_missing_since TIMESTAMP"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_server_freeipa_fqdn ON server (freeipa_fqdn)"))
+            # پرکردن مقادیر خالی به صورت chunk (ردیف‌های با IP نامعتبر NULL می‌مانند)
+            last_id = 0
+            while True:
+                with engine.begin() as conn:
+                    rows = conn.execute(text(
+                        "SELECT id, ip_address FROM server WHERE ip_value IS NULL AND id > :last_id ORDER BY id LIMIT 1000"
+                    ), {'last_id': last_id}).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    params = []
+                    for row_id, ip in rows:
+                        version, value = ip_sort_key(ip)
+                        if value is not None:
+                            params.append({'id': row_id, 'v': version, 'val': value})
+                    if params:
+                        conn.execute(text("UPDATE server SET ip_version = :v, ip_value = :val WHERE id = :id"), params)
+    except Exception:
+        pass
+
+    # Index for FreeIPA mirror membership lookups by group, sync-state details and user is_deleted columns (freeipa_sync.py)
+    try:
+        with app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_freeipausergroup_group_id ON freeipausergroup (group_id)"))
+            sync_columns = {col['name'] for col in db.inspect(db.engine).get_columns('freeipa_sync_state')}
+            if 'details' not in sync_columns:
+                with db.engine.begin() as conn:
+                    conn.execute(text("ALTER TABLE freeipa_sync_state ADD COLUMN details TEXT"))
+            user_columns = {col['name'] for col in db.inspect(db.engine).get_columns('freeipauser')}
+            if 'is_deleted' not in user_columns:
+                with db.engine.begin() as conn:
+                    # ردیف‌های حذف‌شده قبلی در همگام‌سازی کامل بعدی علامت می‌خورند
+                    conn.execute(text("ALTER TABLE freeipauser ADD COLUMN is_deleted BOOLEAN DEFAULT FALSE"))
+            job_columns = {col['name'] for col in db.inspect(db.engine).get_columns('freeipa_provision_job')}
+            if 'updated_at' not in job_columns:
+                with db.engine.begin() as conn:
+                    conn.execute(text("ALTER TABLE freeipa_provision_job ADD COLUMN updated_at TIMESTAMP"))
+    except Exception:
+        pass
+
+    # FreeIPA provision jobs left running/pending by a previous (restarted) worker
+    try:
+        with app.app_context():
+            recover_stale_provision_jobs()
+    except Exception:
+        pass
+
+    # SMS outbound queue columns on smslog (sms_queue.py)
+    try:
+        with app.app_context():
+            sms_columns = {col['name'] for col in db.inspect(db.engine).get_columns('smslog')}
+            with db.engine.begin() as conn:
+                if 'attempts' not in sms_columns:
+                    conn.execute(text("ALTER TABLE smslog ADD COLUMN attempts INTEGER DEFAULT 0"))
+                if 'next_attempt_at' not in sms_columns:
+                    conn.execute(text("ALTER TABLE smslog ADD COLUMN next_attempt_at TIMESTAMP"))
+                if 'locked_at' not in sms_columns:
+                    conn.execute(text("ALTER TABLE smslog ADD COLUMN locked_at TIMESTAMP"))
+                if 'locked_by' not in sms_columns:
+                    conn.execute(text("ALTER TABLE smslog ADD COLUMN locked_by VARCHAR(64)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_smslog_status_next_attempt ON smslog (status, next_attempt_at)"))
+    except Exception:
+        pass
+
     # Vault helpers (uses Redis if available)
     def _get_redis_client():
         try:
@@ -272,6 +372,8 @@ def create_app(config_name='default'):
     
     # Make log_activity available globally
     app.log_activity = log_activity
+    # Shared cache (FreeIPA lookups, ...)
+    app.cache = cache
 
     # Admin-only decorator
     def admin_required(view_func):
@@ -598,16 +700,16 @@ def create_app(config_name='default'):
         return redirect(url_for('users'))
     
     # Server management routes
-    @app.route('/servers')
-    @login_required
-    def servers():
-        page = request.args.get('page', 1, type=int)
-        query = request.args.get('query', '')
-        os_type = request.args.get('os_type', '')
-        status = request.args.get('status', '')
+    def _filter_servers_query(args):
+        """اعمال فیلترهای لیست سرورها؛ خروجی (query, پیام خطا یا None)"""
+        query = args.get('query', '')
+        os_type = args.get('os_type', '')
+        status = args.get('status', '')
+        cidr = args.get('cidr', '').strip()
         
         # ساخت کوئری پایه
         servers_query = Server.query
+        error = None
         
         # اعمال فیلترها
         if query:
@@ -622,13 +724,110 @@ def create_app(config_name='default'):
         if status:
             servers_query = servers_query.filter_by(status=status)
         
+        if cidr:
+            # جستجوی بازه‌ای روی ایندکس (ip_version, ip_value) به جای substring
+            try:
+                version, low, high = cidr_bounds(cidr)
+                servers_query = servers_query.filter(
+                    Server.ip_version == version,
+                    Server.ip_value >= low,
+                    Server.ip_value <= high
+                )
+            except ValueError:
+                error = f'محدوده CIDR نامعتبر است: {cidr}'
+        
+        return servers_query, error
+    
+    def _subnet_summary(servers_query, prefix, limit=256):
+        """گروه‌بندی سرورهای فیلترشده بر اساس زیرشبکه /prefix"""
+        counts = {}
+        rows = servers_query.with_entities(Server.ip_version, Server.ip_value).filter(
+            Server.ip_value.isnot(None)
+        ).order_by(None).yield_per(5000)
+        for version, value in rows:
+            subnet = subnet_for(version, value, prefix)
+            counts[subnet] = counts.get(subnet, 0) + 1
+        ordered = sorted(counts.items(), key=lambda item: ip_sort_key(item[0]))
+        return [{'subnet': subnet, 'count': count} for subnet, count in ordered[:limit]]
+    
+    @app.route('/servers')
+    @login_required
+    def servers():
+        page = request.args.get('page', 1, type=int)
+        group_prefix = request.args.get('group_prefix', type=int)
+        
+        servers_query, error = _filter_servers_query(request.args)
+        if error:
+            flash(error, 'error')
+        
+        subnets = _subnet_summary(servers_query, group_prefix) if group_prefix else []
+        
         servers = servers_query.paginate(page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False)
         
         # دریافت فیلدهای سفارشی برای سرورها
         custom_fields_data = get_custom_fields_for_records(servers.items, 'Server')
         custom_fields_structure = get_custom_fields_structure(custom_fields_data)
         
-        return render_template('servers.html', servers=servers, custom_fields_data=custom_fields_data, custom_fields_structure=custom_fields_structure)
+        return render_template('servers.html', servers=servers, subnets=subnets, custom_fields_data=custom_fields_data, custom_fields_structure=custom_fields_structure)
+    
+    @app.route('/api/servers')
+    @login_required
+    def api_servers():
+        page = request.args.get('page', 1, type=int)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+        group_prefix = request.args.get('group_prefix', type=int)
+        
+        servers_query, error = _filter_servers_query(request.args)
+        if error:
+            return jsonify({'success': False, 'message': error}), 400
+        
+        servers = servers_query.order_by(Server.id).paginate(page=page, per_page=per_page, error_out=False)
+        result = {
+            'success': True,
+            'page': servers.page,
+            'per_page': per_page,
+            'total': servers.total,
+            'pages': servers.pages,
+            'servers': [{
+                'id': srv.id,
+                'name': srv.name,
+                'ip_address': srv.ip_address,
+                'ip_version': srv.ip_version,
+                'os_type': srv.os_type,
+                'status': srv.status,
+                'description': srv.description,
+                'freeipa_fqdn': srv.freeipa_fqdn,
+                'freeipa_missing': bool(srv.freeipa_missing),
+                'updated_at': srv.updated_at.isoformat() if srv.updated_at else None
+            } for srv in servers.items]
+        }
+        if group_prefix:
+            result['subnets'] = _subnet_summary(servers_query, group_prefix)
+        return jsonify(result)
+    
+    @app.route('/servers/export/<fmt>')
+    @login_required
+    def export_servers(fmt):
+        if fmt not in ('csv', 'xlsx'):
+            abort(404)
+        servers_query, error = _filter_servers_query(request.args)
+        if error:
+            flash(error, 'error')
+            return redirect(url_for('servers', **request.args))
+        app.log_activity('export', 'server', None, 200, f'Server export ({fmt})')
+        filename = f"servers_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        if fmt == 'csv':
+            body = generate_csv(servers_query)
+            mimetype = 'text/csv'
+        else:
+            body = generate_xlsx(servers_query)
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        resp = Response(stream_with_context(body), mimetype=mimetype)
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        # جلوگیری از بافر شدن پاسخ در nginx تا اولین بایت‌ها فوراً ارسال شوند
+        resp.headers['X-Accel-Buffering'] = 'no'
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
     
     @app.route('/servers/add', methods=['GET', 'POST'])
     @login_required
@@ -723,6 +922,92 @@ def create_app(config_name='default'):
         flash('سرور با موفقیت حذف شد.', 'success')
         return redirect(url_for('servers'))
     
+    # Server import (background job)
+    @app.route('/servers/import', methods=['GET', 'POST'])
+    @login_required
+    @admin_required
+    def import_servers():
+        if request.method == 'POST':
+            file = request.files.get('file')
+            if not file or file.filename == '':
+                flash('فایل انتخاب نشده است.', 'error')
+                return redirect(url_for('import_servers'))
+            ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+            if ext not in ALLOWED_IMPORT_EXTENSIONS:
+                flash('فقط فایل‌های xlsx، xls و csv مجاز هستند.', 'error')
+                return redirect(url_for('import_servers'))
+            try:
+                filename = secure_filename(file.filename)
+                if not filename.lower().endswith('.' + ext):
+                    filename = f'servers.{ext}'
+                target_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'imports')
+                os.makedirs(target_dir, exist_ok=True)
+                file_path = os.path.join(target_dir, f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{filename}")
+                file.save(file_path)
+                job = ServerImportJob(
+                    file_name=filename,
+                    file_path=file_path,
+                    sheet_name=(request.form.get('sheet_name') or '').strip() or None,
+                    dry_run=request.form.get('dry_run') in ['1', 'true', 'on'],
+                    update_on_conflict=request.form.get('update_on_conflict') in ['1', 'true', 'on'],
+                    created_by=current_user.id
+                )
+                db.session.add(job)
+                db.session.commit()
+                enqueue_import_job(app, job.id)
+                app.log_activity('import', 'server', None, 200, f'Server import job #{job.id}: {filename}')
+                flash('فایل دریافت شد و ایمپورت در پس‌زمینه آغاز شد.', 'success')
+                return redirect(url_for('server_import_job', job_id=job.id))
+            except Exception:
+                db.session.rollback()
+                flash('خطا در ثبت کار ایمپورت.', 'error')
+                return redirect(url_for('import_servers'))
+        
+        recover_stale_jobs()
+        jobs = ServerImportJob.query.order_by(ServerImportJob.created_at.desc()).limit(20).all()
+        return render_template('import_servers.html', jobs=jobs, job=None)
+    
+    @app.route('/servers/import/<int:job_id>')
+    @login_required
+    @admin_required
+    def server_import_job(job_id):
+        recover_stale_jobs()
+        job = ServerImportJob.query.get_or_404(job_id)
+        jobs = ServerImportJob.query.order_by(ServerImportJob.created_at.desc()).limit(20).all()
+        return render_template('import_servers.html', jobs=jobs, job=job)
+    
+    @app.route('/api/servers/import/<int:job_id>')
+    @limiter.exempt
+    @login_required
+    @admin_required
+    def api_server_import_job(job_id):
+        job = ServerImportJob.query.get_or_404(job_id)
+        if job.status in ('pending', 'running') and recover_stale_jobs():
+            db.session.refresh(job)
+        resp = jsonify({'success': True, 'job': job.to_dict()})
+        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+        return resp
+    
+    @app.route('/api/servers/<int:id>/status-history')
+    @login_required
+    def api_server_status_history(id):
+        server = Server.query.get_or_404(id)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        checks = ServerStatusCheck.query.filter_by(server_id=server.id).order_by(
+            ServerStatusCheck.checked_at.desc()).limit(limit).all()
+        return jsonify({
+            'success': True,
+            'server_id': server.id,
+            'status': server.status,
+            'checks': [{
+                'checked_at': c.checked_at.isoformat(),
+                'is_up': c.is_up,
+                'method': c.method,
+                'port': c.port,
+                'latency_ms': c.latency_ms
+            } for c in checks]
+        })
+    
     # Task management routes
     @app.route('/tasks')
     @login_required
@@ -1380,6 +1665,23 @@ def create_app(config_name='default'):
         logs = logs_q.paginate(page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False)
         return render_template('activity_logs.html', logs=logs)
 
+    # Admin: credential key rotation (re-encrypt stored secrets with the primary key, key_rotation.py)
+    @app.route('/api/admin/key-rotation', methods=['GET', 'POST'])
+    @login_required
+    def api_key_rotation():
+        if current_user.role != 'admin':
+            return jsonify({'success': False, 'error': 'دسترسی غیرمجاز'}), 403
+        from key_rotation import enqueue_reencryption, rotation_status
+        if request.method == 'POST':
+            status = rotation_status()
+            if not status['ready'] or not status['primary_key_id']:
+                return jsonify({'success': False, 'error': 'حلقه کلید (CREDENTIALS_KEYS) تنظیم نشده است'}), 400
+            restart = bool((request.get_json(silent=True) or request.form).get('restart'))
+            enqueue_reencryption(app, restart=restart)
+            app.log_activity('key_rotation', 'Credential', None, 202, f"Re-encryption to key {status['primary_key_id']} started")
+            return jsonify({'success': True, 'message': 'بازرمزنگاری در پس‌زمینه شروع شد'}), 202
+        return jsonify({'success': True, **rotation_status()})
+
     # API: recent activity logs for dashboard live refresh
     @app.route('/api/activity-logs/recent')
     @login_required
@@ -66,6 +66,15 @@ class Config:
     # تنظیمات Rate Limiter: در dev حافظه‌ای، در prod قابل override با REDIS
     RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
     
+    # پایش دسترس‌پذیری سرورها (server_monitor.py)
+    SERVER_MONITOR_PORTS = os.environ.get('SERVER_MONITOR_PORTS', '22,3389,443,80')
+    SERVER_MONITOR_USE_ICMP = os.environ.get('SERVER_MONITOR_USE_ICMP', 'true').lower() in ['true', 'on', '1']
+    SERVER_MONITOR_CONCURRENCY = int(os.environ.get('SERVER_MONITOR_CONCURRENCY', 512))
+    SERVER_MONITOR_TIMEOUT = float(os.environ.get('SERVER_MONITOR_TIMEOUT', 1.5))
+    SERVER_MONITOR_INTERVAL = int(os.environ.get('SERVER_MONITOR_INTERVAL', 300))
+    SERVER_MONITOR_BATCH_SIZE = int(os.environ.get('SERVER_MONITOR_BATCH_SIZE', 1000))
+    SERVER_MONITOR_HISTORY_DAYS = int(os.environ.get('SERVER_MONITOR_HISTORY_DAYS', 30))
+    
     # تنظیمات FreeIPA
     FREEIPA_HOST = os.environ.get('FREEIPA_HOST', '192.168.0.34')
     FREEIPA_PORT = int(os.environ.get('FREEIPA_PORT', 389))
@@ -73,9 +82,83 @@ class Config:
     FREEIPA_BASE_DN = os.environ.get('FREEIPA_BASE_DN', 'dc=mci,dc=local')
     FREEIPA_BIND_DN = os.environ.get('FREEIPA_BIND_DN', 'uid=admin,cn=users,cn=accounts,dc=mci,dc=local')
     FREEIPA_BIND_PASSWORD = os.environ.get('FREEIPA_BIND_PASSWORD', '')
+    # Pool اتصال‌های ادمین (freeipa_pool.py)؛ FREEIPA_HOST می‌تواند چند میزبان با کاما باشد (failover)
+    FREEIPA_START_TLS = os.environ.get('FREEIPA_START_TLS', 'true').lower() in ['true', 'on', '1']
+    FREEIPA_POOL_SIZE = int(os.environ.get('FREEIPA_POOL_SIZE', 8))
+    FREEIPA_POOL_MAX_IDLE = int(os.environ.get('FREEIPA_POOL_MAX_IDLE', 300))
+    FREEIPA_POOL_CHECK_INTERVAL = int(os.environ.get('FREEIPA_POOL_CHECK_INTERVAL', 60))
+    FREEIPA_POOL_WAIT_TIMEOUT = float(os.environ.get('FREEIPA_POOL_WAIT_TIMEOUT', 10))
+    FREEIPA_CONNECT_TIMEOUT = float(os.environ.get('FREEIPA_CONNECT_TIMEOUT', 5))
+    FREEIPA_RECEIVE_TIMEOUT = float(os.environ.get('FREEIPA_RECEIVE_TIMEOUT', 15))
+    # اندازه‌گیری عملیات LDAP (freeipa_metrics.py): histogram در /freeipa/api/metrics، عملیات کندتر از SLOW_MS با WARNING لاگ می‌شود
+    FREEIPA_LDAP_METRICS = os.environ.get('FREEIPA_LDAP_METRICS', 'true').lower() in ['true', 'on', '1']
+    FREEIPA_LDAP_SLOW_MS = float(os.environ.get('FREEIPA_LDAP_SLOW_MS', 500))
+    FREEIPA_LDAP_LOG_LEVEL = os.environ.get('FREEIPA_LDAP_LOG_LEVEL', 'INFO')  # DEBUG: هر عملیات در logs/ldap.log
+    # snapshot محلی schema/DSA هر میزبان (freeipa_schema.py)؛ خالی = خواندن از سرور در هر پروسه
+    FREEIPA_SCHEMA_CACHE_DIR = os.environ.get('FREEIPA_SCHEMA_CACHE_DIR', os.path.join(BASE_DIR, 'instance', 'ldap_schema'))
+    FREEIPA_SCHEMA_MAX_AGE_HOURS = float(os.environ.get('FREEIPA_SCHEMA_MAX_AGE_HOURS', 24))
+    FREEIPA_SCHEMA_CHECK_INTERVAL = int(os.environ.get('FREEIPA_SCHEMA_CHECK_INTERVAL', 3600))
+    # اندازه صفحه در جستجوی paged (Simple Paged Results) و تعداد ردیف هر صفحه در لیست‌ها
+    FREEIPA_PAGE_SIZE = int(os.environ.get('FREEIPA_PAGE_SIZE', 500))
+    FREEIPA_LIST_PER_PAGE = int(os.environ.get('FREEIPA_LIST_PER_PAGE', 50))
+    # راستی‌آزمایی رمز پس از ریست با bind کاربر: sync، async (فقط لاگ) یا off
+    FREEIPA_PASSWORD_VERIFY = os.environ.get('FREEIPA_PASSWORD_VERIFY', 'sync')
+    # TTL کش خواندن‌های FreeIPA (ثانیه، 0 = غیرفعال)؛ برای invalidation بین workerها CACHE_TYPE=redis
+    FREEIPA_CACHE_TTL = int(os.environ.get('FREEIPA_CACHE_TTL', 60))
+    # ایندکس عضویت گروه‌ها در حافظه (freeipa_membership.py): فاصله به‌روزرسانی افزایشی و بازسازی کامل (ثانیه)
+    FREEIPA_MEMBERSHIP_REFRESH = int(os.environ.get('FREEIPA_MEMBERSHIP_REFRESH', 60))
+    FREEIPA_MEMBERSHIP_FULL_INTERVAL = int(os.environ.get('FREEIPA_MEMBERSHIP_FULL_INTERVAL', 3600))
+    # پس از به‌روزرسانی ناموفق ایندکس، تا این مدت (ثانیه) دوباره تلاش نمی‌شود
+    FREEIPA_MEMBERSHIP_RETRY = int(os.environ.get('FREEIPA_MEMBERSHIP_RETRY', 30))
+    # آینه محلی دایرکتوری (freeipa_sync.py): خواندن لیست‌ها از دیتابیس پس از اولین sync کامل
+    FREEIPA_MIRROR_READS = os.environ.get('FREEIPA_MIRROR_READS', 'true').lower() in ['true', 'on', '1']
+    FREEIPA_SYNC_BATCH_SIZE = int(os.environ.get('FREEIPA_SYNC_BATCH_SIZE', 500))
+    FREEIPA_SYNC_FULL_INTERVAL_HOURS = float(os.environ.get('FREEIPA_SYNC_FULL_INTERVAL_HOURS', 24))
+    FREEIPA_SYNC_INTERVAL = int(os.environ.get('FREEIPA_SYNC_INTERVAL', 300))
+    # همگام‌سازی hostهای FreeIPA با جدول Server (freeipa_hosts.py): ایجاد سرور برای host جدید و resolve DNS در نبود ipHostNumber
+    FREEIPA_HOST_SYNC_CREATE = os.environ.get('FREEIPA_HOST_SYNC_CREATE', 'true').lower() in ['true', 'on', '1']
+    FREEIPA_HOST_SYNC_RESOLVE = os.environ.get('FREEIPA_HOST_SYNC_RESOLVE', 'false').lower() in ['true', 'on', '1']
+    # ماتریس دسترسی HBAC/sudo (freeipa_access.py): بازه بررسی نسخه جدید در هر worker و بازه همگام‌سازی پس‌زمینه (ثانیه)
+    FREEIPA_ACCESS_CHECK_INTERVAL = int(os.environ.get('FREEIPA_ACCESS_CHECK_INTERVAL', 30))
+    FREEIPA_ACCESS_REFRESH_INTERVAL = int(os.environ.get('FREEIPA_ACCESS_REFRESH_INTERVAL', 300))
+    # ایجاد گروهی کاربران (freeipa_provision.py): تعداد کارگر همزمان (حداکثر FREEIPA_POOL_SIZE)
+    FREEIPA_PROVISION_WORKERS = int(os.environ.get('FREEIPA_PROVISION_WORKERS', 4))
+    FREEIPA_PROVISION_MAX_ROWS = int(os.environ.get('FREEIPA_PROVISION_MAX_ROWS', 5000))
+    # گزارش سلامت حساب‌ها (freeipa_health.py): عمر گزارش پیش از scan پس‌زمینه (ثانیه) و بازه هشدار انقضای principal (روز)
+    FREEIPA_HEALTH_MAX_AGE = int(os.environ.get('FREEIPA_HEALTH_MAX_AGE', 300))
+    FREEIPA_HEALTH_WARN_DAYS = int(os.environ.get('FREEIPA_HEALTH_WARN_DAYS', 14))
+    
+    # ارسال پیامک (sms_service.py)؛ SMS_<PROVIDER>_API_KEY / SMS_<PROVIDER>_SENDER برای هر ارائه‌دهنده
+    SMS_PROVIDER = os.environ.get('SMS_PROVIDER', 'kavenegar')
+    SMS_API_KEY = os.environ.get('SMS_API_KEY')
+    SMS_SENDER = os.environ.get('SMS_SENDER')
+    # آدرس پایه API هر ارائه‌دهنده (خالی: آدرس رسمی)؛ مثلاً stand-in محلی scripts/bench_sms.py --serve
+    SMS_KAVENEGAR_BASE_URL = os.environ.get('SMS_KAVENEGAR_BASE_URL')
+    SMS_MELIPAYAMAK_BASE_URL = os.environ.get('SMS_MELIPAYAMAK_BASE_URL')
+    SMS_SMS_IR_BASE_URL = os.environ.get('SMS_SMS_IR_BASE_URL')
+    # HTTP ارائه‌دهنده‌ها: یک Session با keep-alive برای هر ارائه‌دهنده؛ timeout اتصال و پاسخ (ثانیه)
+    SMS_CONNECT_TIMEOUT = float(os.environ.get('SMS_CONNECT_TIMEOUT', 5))
+    SMS_READ_TIMEOUT = float(os.environ.get('SMS_READ_TIMEOUT', 30))
+    # صف ارسال پیامک (sms_queue.py): کارگرها، تلاش مجدد با backoff نمایی و نرخ هر ارائه‌دهنده (پیام در ثانیه، در هر پروسه)
+    SMS_WORKERS = int(os.environ.get('SMS_WORKERS', 4))
+    SMS_MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', 5))
+    SMS_RETRY_BASE_SECONDS = float(os.environ.get('SMS_RETRY_BASE_SECONDS', 5))
+    SMS_RETRY_MAX_SECONDS = float(os.environ.get('SMS_RETRY_MAX_SECONDS', 600))
+    SMS_RATE_LIMITS = os.environ.get('SMS_RATE_LIMITS', 'kavenegar=5,melipayamak=3,sms_ir=5')
+    SMS_SENDING_TIMEOUT = int(os.environ.get('SMS_SENDING_TIMEOUT', 120))
+    SMS_QUEUE_POLL_INTERVAL = float(os.environ.get('SMS_QUEUE_POLL_INTERVAL', 2))
+    SMS_QUEUE_AUTOSTART = os.environ.get('SMS_QUEUE_AUTOSTART', 'true').lower() in ['true', 'on', '1']
+    # ارسال گروهی (sms_queue.deliver_batch): درخواست همزمان برای ارائه‌دهنده بدون endpoint گروهی و حداکثر گیرنده هر درخواست API
+    SMS_BULK_WORKERS = int(os.environ.get('SMS_BULK_WORKERS', 8))
+    SMS_BULK_MAX = int(os.environ.get('SMS_BULK_MAX', 1000))
     
     # کلید رمزنگاری Credential ها (Fernet key base64)
     CREDENTIALS_KEY = os.environ.get('CREDENTIALS_KEY')
+    # حلقه کلید برای چرخش: "kid2:<key>,kid1:<key>" (اولی کلید اصلی؛ utils/crypto.py از env می‌خواند)
+    CREDENTIALS_KEYS = os.environ.get('CREDENTIALS_KEYS')
+    # بازرمزنگاری با کلید اصلی جدید (key_rotation.py): ردیف در هر دسته/checkpoint و مکث بین دسته‌ها
+    KEY_ROTATION_BATCH_SIZE = int(os.environ.get('KEY_ROTATION_BATCH_SIZE', 500))
+    KEY_ROTATION_PAUSE_MS = int(os.environ.get('KEY_ROTATION_PAUSE_MS', 0))
     
     # Vault session TTL (seconds)
     VAULT_SESSION_TTL_SECONDS = int(os.environ.get('VAULT_SESSION_TTL_SECONDS', 300))
@@ -0,0 +1,386 @@
+"""
+ماتریس دسترسی HBAC/sudo FreeIPA: چه کاربرانی به کدام host دسترسی دارند
+
+قوانین HBAC (cn=hbac) و sudo (cn=sudorules,cn=sudo) و hostgroupها با paged search
+خوانده می‌شوند و با ایندکس عضویت گروه‌های کاربری (freeipa_membership.py) به فهرست uid و
+fqdn باز می‌شوند. نتیجه در جدول FreeIPAAccessRule ذخیره می‌شود (فقط ردیف‌های تغییرکرده
+نوشته می‌شوند) تا همه workerها بدون LDAP از آن بخوانند.
+
+به‌روزرسانی افزایشی: ابتدا یک fingerprint ارزان (تعداد و بیشترین modifyTimestamp قوانین و
+hostgroupها به همراه watermark ایندکس عضویت) گرفته می‌شود و اگر تغییری نباشد چیزی باز
+نمی‌شود. userCategory/hostCategory=all به صورت پرچم نگه داشته می‌شود تا ماتریس فشرده بماند.
+در حافظه هر worker: host → قوانین، و برای هر host پس از اولین پرسش مجموعه کاربران (O(1)).
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from models import db, FreeIPAAccessRule
+from freeipa_membership import _split_member
+from freeipa_sync import _chunks, _claim, _raw, get_state
+
+logger = logging.getLogger(__name__)
+
+SCOPE = 'access'
+KINDS = ('hbac', 'sudo')
+RULE_SOURCES = {
+    'hbac': ('cn=hbac', '(objectClass=ipahbacrule)'),
+    'sudo': ('cn=sudorules,cn=sudo', '(objectClass=ipasudorule)'),
+}
+RULE_ATTRIBUTES = ['cn', 'ipaEnabledFlag', 'userCategory', 'hostCategory', 'serviceCategory',
+                   'memberUser', 'memberHost', 'memberService', 'modifyTimestamp']
+HOSTGROUP_ATTRIBUTES = ['cn', 'member', 'modifyTimestamp']
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freeipa-access')
+
+
+def _rdn(dn: str) -> Tuple[str, str, str]:
+    """'fqdn=web1.local,cn=computers,...' → ('fqdn', 'web1.local', 'cn=computers,...')"""
+    head, _, rest = dn.partition(',')
+    key, _, value = head.partition('=')
+    return key.strip().lower(), value.strip().lower(), rest.strip().lower()
+
+
+def _closure(start: str, children: Dict[str, Set[str]]) -> Set[str]:
+    """همه زیرگروه‌های یک گروه (شامل خودش)؛ حلقه‌ها مشکلی ایجاد نمی‌کنند"""
+    seen = {start}
+    stack = [start]
+    while stack:
+        for child in children.get(stack.pop(), ()):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return seen
+
+
+class _Expander:
+    """باز کردن memberUser/memberHost قوانین به uid و fqdn"""
+
+    def __init__(self, snapshot, hostgroups: Dict[str, Tuple[Set[str], Set[str]]]):
+        self.users_by_group: Dict[str, Set[str]] = {}
+        for uid, groups in snapshot.groups_by_user.items():
+            for group in groups:
+                self.users_by_group.setdefault(group, set()).add(uid)
+        self.hostgroup_hosts = {cn: hosts for cn, (hosts, _) in hostgroups.items()}
+        self.hostgroup_children = {cn: subgroups for cn, (_, subgroups) in hostgroups.items()}
+        self._hostgroup_cache: Dict[str, Set[str]] = {}
+
+    def users(self, dns: Iterable[str]) -> Set[str]:
+        result: Set[str] = set()
+        for dn in dns:
+            kind, name = _split_member(dn)
+            if kind == 'user':
+                result.add(name)
+            elif kind == 'group':
+                # groups_by_user از قبل عضویت تو در تو را resolve کرده است
+                result.update(self.users_by_group.get(name, ()))
+        return result
+
+    def hostgroup(self, cn: str) -> Set[str]:
+        cached = self._hostgroup_cache.get(cn)
+        if cached is None:
+            cached = set()
+            for group in _closure(cn, self.hostgroup_children):
+                cached.update(self.hostgroup_hosts.get(group, ()))
+            self._hostgroup_cache[cn] = cached
+        return cached
+
+    def hosts(self, dns: Iterable[str]) -> Set[str]:
+        result: Set[str] = set()
+        for dn in dns:
+            key, value, rest = _rdn(dn)
+            if key == 'fqdn':
+                result.add(value)
+            elif key == 'cn' and rest.startswith('cn=hostgroups,'):
+                result.update(self.hostgroup(value))
+        return result
+
+
+def _scan_hostgroups(service, base_dn: str) -> Dict[str, Tuple[Set[str], Set[str]]]:
+    hostgroups: Dict[str, Tuple[Set[str], Set[str]]] = {}
+    for entry in service.paged_search(f"cn=hostgroups,cn=accounts,{base_dn}", '(objectClass=ipahostgroup)',
+                                      HOSTGROUP_ATTRIBUTES):
+        cns = _raw(entry, 'cn')
+        if not cns:
+            continue
+        hosts, subgroups = set(), set()
+        for dn in _raw(entry, 'member'):
+            key, value, rest = _rdn(dn)
+            if key == 'fqdn':
+                hosts.add(value)
+            elif key == 'cn' and rest.startswith('cn=hostgroups,'):
+                subgroups.add(value)
+        hostgroups[cns[0].lower()] = (hosts, subgroups)
+    return hostgroups
+
+
+def _fingerprint(service, base_dn: str, snapshot) -> Dict:
+    """تعداد و بیشترین modifyTimestamp قوانین و hostgroupها (فقط ویژگی modifyTimestamp خوانده می‌شود)"""
+    sources = {kind: (f"{base},{base_dn}", search_filter) for kind, (base, search_filter) in RULE_SOURCES.items()}
+    sources['hostgroups'] = (f"cn=hostgroups,cn=accounts,{base_dn}", '(objectClass=ipahostgroup)')
+    result = {}
+    for name, (search_base, search_filter) in sources.items():
+        count, latest = 0, ''
+        for entry in service.paged_search(search_base, search_filter, ['modifyTimestamp']):
+            count += 1
+            stamps = _raw(entry, 'modifyTimestamp')
+            if stamps and stamps[0] > latest:
+                latest = stamps[0]
+        result[name] = [count, latest]
+    result['groups'] = [len(snapshot.names), snapshot.watermark]
+    return result
+
+
+def _rule_mapping(kind: str, entry: Dict, expander: _Expander) -> Optional[Dict]:
+    cns = _raw(entry, 'cn')
+    if not cns:
+        return None
+    one = lambda name: ((_raw(entry, name) or [''])[0]).lower()
+    all_users = one('userCategory') == 'all'
+    all_hosts = one('hostCategory') == 'all'
+    if kind == 'hbac':
+        services = ['all'] if one('serviceCategory') == 'all' else sorted(
+            _rdn(dn)[1] for dn in _raw(entry, 'memberService'))
+    else:
+        services = []
+    stamps = _raw(entry, 'modifyTimestamp')
+    return {
+        'kind': kind,
+        'cn': cns[0],
+        'enabled': one('ipaEnabledFlag') != 'false',
+        'all_users': all_users,
+        'all_hosts': all_hosts,
+        'users': json.dumps([] if all_users else sorted(expander.users(_raw(entry, 'memberUser')))),
+        'hosts': json.dumps([] if all_hosts else sorted(expander.hosts(_raw(entry, 'memberHost')))),
+        'services': json.dumps(services),
+        'modify_timestamp': stamps[0] if stamps else None,
+    }
+
+
+COMPARED_FIELDS = ('enabled', 'all_users', 'all_hosts', 'users', 'hosts', 'services', 'modify_timestamp')
+
+
+def run_access_sync(app, full: Optional[bool] = None, service=None) -> Dict:
+    """بازسازی ماتریس دسترسی در صورت تغییر (full=True بدون بررسی fingerprint)"""
+    if service is None:
+        from freeipa_service import freeipa_service as service
+    if not hasattr(service, 'paged_search'):
+        raise RuntimeError('سرویس FreeIPA فعلی از paged search پشتیبانی نمی‌کند (حالت Mock)')
+    full_every = timedelta(hours=float(app.config.get('FREEIPA_SYNC_FULL_INTERVAL_HOURS', 24)))
+    state = get_state(SCOPE)
+    if full is None:
+        full = not state.last_full_sync or datetime.utcnow() - state.last_full_sync > full_every
+    mode = 'full' if full else 'incremental'
+    if not _claim(state, mode):
+        return {'skipped': True, 'reason': 'access sync already running'}
+
+    started = datetime.utcnow()
+    clock = time.perf_counter()
+    try:
+        snapshot = service.membership()
+        if snapshot is None:
+            raise RuntimeError('ایندکس عضویت گروه‌ها در دسترس نیست')
+        base_dn = service._get_config()['base_dn']
+        fingerprint = _fingerprint(service, base_dn, snapshot)
+        state = get_state(SCOPE)
+        previous = state.get_details()
+        if not full and previous.get('fingerprint') == fingerprint:
+            state.status = 'completed'
+            state.finished_at = datetime.utcnow()
+            state.last_incremental_sync = state.finished_at
+            db.session.commit()
+            return {'mode': mode, 'unchanged': True, 'duration_ms': int((time.perf_counter() - clock) * 1000)}
+
+        expander = _Expander(snapshot, _scan_hostgroups(service, base_dn))
+        mappings: Dict[Tuple[str, str], Dict] = {}
+        for kind, (base, search_filter) in RULE_SOURCES.items():
+            for entry in service.paged_search(f"{base},{base_dn}", search_filter, RULE_ATTRIBUTES):
+                mapping = _rule_mapping(kind, entry, expander)
+                if mapping:
+                    mappings[(kind, mapping['cn'])] = mapping
+
+        existing = {(row.kind, row.cn): row for row in FreeIPAAccessRule.query.all()}
+        inserts, updates = [], []
+        for key, mapping in mappings.items():
+            row = existing.get(key)
+            if row is None:
+                inserts.append(dict(mapping, last_sync=started))
+            elif any(getattr(row, field) != mapping[field] for field in COMPARED_FIELDS):
+                updates.append(dict(mapping, id=row.id, last_sync=started))
+        removed = [row.id for key, row in existing.items() if key not in mappings]
+        if inserts:
+            db.session.bulk_insert_mappings(FreeIPAAccessRule, inserts)
+        if updates:
+            db.session.bulk_update_mappings(FreeIPAAccessRule, updates)
+        for chunk in _chunks(removed):
+            FreeIPAAccessRule.query.filter(FreeIPAAccessRule.id.in_(chunk)).delete(synchronize_session=False)
+
+        finished = datetime.utcnow()
+        summary = {
+            'mode': mode,
+            'rules': len(mappings),
+            'hbac': sum(1 for kind, _ in mappings if kind == 'hbac'),
+            'sudo': sum(1 for kind, _ in mappings if kind == 'sudo'),
+            'inserted': len(inserts),
+            'updated': len(updates),
+            'removed': len(removed),
+            'duration_ms': int((time.perf_counter() - clock) * 1000),
+        }
+        state = get_state(SCOPE)
+        state.status = 'completed'
+        changed = inserts or updates or removed or not previous.get('changed_at')
+        state.details = json.dumps(dict(summary, fingerprint=fingerprint,
+                                        changed_at=finished.isoformat() if changed else previous['changed_at']))
+        state.finished_at = finished
+        if full:
+            state.last_full_sync = finished
+        else:
+            state.last_incremental_sync = finished
+        db.session.commit()
+        logger.info(f"FreeIPA access matrix: {summary}")
+        return summary
+    except Exception as e:
+        db.session.rollback()
+        state = get_state(SCOPE)
+        state.status = 'failed'
+        state.error_message = str(e)
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+
+def enqueue_access_sync(app, full: Optional[bool] = None):
+    """اجرای همگام‌سازی ماتریس دسترسی در worker پس‌زمینه"""
+    return _executor.submit(_run_access_sync_job, app, full)
+
+
+def _run_access_sync_job(app, full: Optional[bool]):
+    with app.app_context():
+        try:
+            run_access_sync(app, full=full)
+        except Exception as e:
+            logger.error(f"FreeIPA access sync failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def get_access_state():
+    return get_state(SCOPE)
+
+
+class AccessMatrix:
+    """نمای حافظه‌ای جدول FreeIPAAccessRule (فقط قوانین فعال)"""
+
+    def __init__(self, rows: Iterable[FreeIPAAccessRule], version: Optional[str]):
+        self.version = version
+        self.rules: Dict[int, Dict] = {}
+        self.host_rules: Dict[str, List[int]] = {}
+        self.all_host_rules: List[int] = []
+        self.rule_hosts: Dict[int, List[str]] = {}
+        for row in rows:
+            if not row.enabled:
+                continue
+            self.rules[row.id] = {
+                'kind': row.kind,
+                'cn': row.cn,
+                'all_users': bool(row.all_users),
+                'all_hosts': bool(row.all_hosts),
+                'users': frozenset(row.get_users()),
+                'services': row.get_services(),
+            }
+            if row.all_hosts:
+                self.all_host_rules.append(row.id)
+            else:
+                self.rule_hosts[row.id] = row.get_hosts()
+                for fqdn in self.rule_hosts[row.id]:
+                    self.host_rules.setdefault(fqdn, []).append(row.id)
+        self._host_access: Dict[Tuple[str, str], Tuple[bool, FrozenSet[str], List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _access(self, fqdn: str, kind: str) -> Tuple[bool, FrozenSet[str], List[str]]:
+        key = (fqdn, kind)
+        cached = self._host_access.get(key)
+        if cached is None:
+            rule_ids = [r for r in self.host_rules.get(fqdn, []) + self.all_host_rules if self.rules[r]['kind'] == kind]
+            rules = [self.rules[r] for r in rule_ids]
+            cached = (any(r['all_users'] for r in rules),
+                      frozenset().union(*(r['users'] for r in rules)) if rules else frozenset(),
+                      sorted(r['cn'] for r in rules))
+            with self._lock:
+                self._host_access[key] = cached
+        return cached
+
+    def can_access(self, uid: str, fqdn: str, kind: str = 'hbac') -> bool:
+        all_users, users, _ = self._access((fqdn or '').lower(), kind)
+        return all_users or (uid or '').lower() in users
+
+    def for_host(self, fqdn: str) -> Dict:
+        fqdn = (fqdn or '').lower()
+        result = {}
+        for kind in KINDS:
+            all_users, users, rules = self._access(fqdn, kind)
+            result[kind] = {'all_users': all_users, 'users': sorted(users), 'rules': rules}
+        return result
+
+    def for_user(self, uid: str) -> Dict:
+        uid = (uid or '').lower()
+        result = {kind: {'all_hosts': False, 'hosts': set(), 'rules': []} for kind in KINDS}
+        for rule_id, rule in self.rules.items():
+            if not (rule['all_users'] or uid in rule['users']):
+                continue
+            item = result[rule['kind']]
+            item['rules'].append(rule['cn'])
+            if rule['all_hosts']:
+                item['all_hosts'] = True
+            else:
+                item['hosts'].update(self.rule_hosts.get(rule_id, ()))
+        for item in result.values():
+            item['hosts'] = sorted(item['hosts'])
+            item['rules'].sort()
+        return result
+
+    def stats(self) -> Dict:
+        return {'version': self.version, 'rules': len(self.rules), 'hosts': len(self.host_rules),
+                'all_host_rules': len(self.all_host_rules)}
+
+
+class AccessIndex:
+    """بارگذاری مجدد AccessMatrix وقتی همگام‌سازی ردیف‌های تغییرکرده‌ای در دیتابیس نوشته باشد"""
+
+    def __init__(self):
+        self._matrix: Optional[AccessMatrix] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        self._matrix = None
+        self._checked_at = 0.0
+
+    def get(self, app, check_interval: float = 30, refresh_interval: float = 300) -> Optional[AccessMatrix]:
+        """ماتریس فعلی؛ در صورت کهنگی همگام‌سازی در پس‌زمینه شروع می‌شود"""
+        now = time.time()
+        matrix = self._matrix
+        if matrix is not None and now - self._checked_at < check_interval:
+            return matrix
+        with self._lock:
+            if self._matrix is not None and now - self._checked_at < check_interval:
+                return self._matrix
+            self._checked_at = now
+            state = get_state(SCOPE)
+            # نسخه فقط با تغییر واقعی ردیف‌ها عوض می‌شود (دور بدون تغییر بارگذاری مجدد ندارد)
+            version = state.get_details().get('changed_at')
+            if self._matrix is None or self._matrix.version != version:
+                self._matrix = AccessMatrix(FreeIPAAccessRule.query.all(), version)
+            # finished_at دور ناموفق را هم شامل می‌شود تا خطای LDAP باعث تکرار پشت‌سرهم نشود
+            last = state.finished_at
+            if state.status != 'running' and (last is None or datetime.utcnow() - last > timedelta(seconds=refresh_interval)):
+                enqueue_access_sync(app)
+            return self._matrix
+
+
+access_index = AccessIndex()
@@ -1,6 +1,8 @@
 # FreeIPA Client
-from ldap3 import Server, Connection, ALL, SUBTREE, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3 import Server, ALL, SUBTREE, MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
 from ldap3.core.exceptions import LDAPException, LDAPBindError, LDAPSocketOpenError
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import escape_rdn
 import json
 import logging
 from typing import List, Dict, Optional, Tuple
@@ -8,19 +10,44 @@ from datetime import datetime
 import secrets
 import string
 
+from freeipa_metrics import InstrumentedConnection as Connection
+from freeipa_schema import ensure_server_info
+
 logger = logging.getLogger(__name__)
 
+
+def _schema_options(schema_dir: Optional[str]) -> Dict:
+    """تنظیمات snapshot schema از Flask app (مثل FreeIPAService._pool_options)؛ بیرون از app از محیط"""
+    try:
+        from flask import current_app
+        cfg = current_app.config
+    except Exception:
+        from config import Config
+        cfg = {key: getattr(Config, key) for key in dir(Config) if key.startswith('FREEIPA_SCHEMA_')}
+    if schema_dir is None:
+        schema_dir = cfg.get('FREEIPA_SCHEMA_CACHE_DIR')
+    return {
+        'directory': schema_dir or None,
+        'max_age': float(cfg.get('FREEIPA_SCHEMA_MAX_AGE_HOURS', 24)) * 3600,
+        'check_interval': float(cfg.get('FREEIPA_SCHEMA_CHECK_INTERVAL', 3600)),
+    }
+
+
 class FreeIPAClient:
     """کلاینت برای اتصال و مدیریت FreeIPA"""
     
     def __init__(self, hostname: str, port: int = 389, use_ssl: bool = True, 
-                 base_dn: str = "", bind_dn: str = "", bind_password: str = ""):
+                 base_dn: str = "", bind_dn: str = "", bind_password: str = "",
+                 schema_dir: Optional[str] = None):
         self.hostname = hostname
         self.port = port
         self.use_ssl = use_ssl
         self.base_dn = base_dn
         self.bind_dn = bind_dn
         self.bind_password = bind_password
+        # snapshot محلی schema (freeipa_schema.py)؛ None یعنی FREEIPA_SCHEMA_CACHE_DIR و '' یعنی غیرفعال
+        self.schema_options = _schema_options(schema_dir)
+        self.schema_dir = self.schema_options['directory']
         self.connection = None
         
     def connect(self) -> bool:
@@ -34,13 +61,17 @@ class FreeIPAClient:
                 get_info=ALL
             )
             
-            # ایجاد اتصال
-            self.connection = Connection(
+            # ایجاد اتصال؛ DSE/schema به جای هر bind از snapshot محلی خوانده می‌شود
+            connection = Connection(
                 server=server,
                 user=self.bind_dn,
-                password=self.bind_password,
-                auto_bind=True
+                password=self.bind_password
             )
+            connection.open(read_server_info=False)
+            if not connection.bind(read_server_info=False):
+                raise LDAPBindError(connection.result.get('description') if connection.result else 'bind failed')
+            ensure_server_info(connection, **self.schema_options)
+            self.connection = connection
             
             logger.info(f"Successfully connected to FreeIPA server: {self.hostname}")
             return True
@@ -206,24 +237,37 @@ class FreeIPAClient:
             search_base = f"cn=users,cn=accounts,{self.base_dn}"
             search_filter = "(objectClass=inetUser)"
             
-            success = self.connection.search(
+            # paged search: فقط به اندازه limit از سرور خوانده می‌شود
+            entries = self.connection.extend.standard.paged_search(
                 search_base=search_base,
-                search_scope=SUBTREE,
                 search_filter=search_filter,
-                attributes=['uid', 'cn', 'sn', 'givenName', 'mail', 'mobile']
+                search_scope=SUBTREE,
+                attributes=['uid', 'cn', 'sn', 'givenName', 'mail', 'mobile'],
+                paged_size=max(1, min(limit, 500)),
+                generator=True
             )
             
+            def first(attrs, name):
+                value = attrs.get(name)
+                if isinstance(value, (list, tuple)):
+                    value = value[0] if value else None
+                return str(value) if value is not None else None
+            
             users = []
-            if success and self.connection.entries:
-                for entry in self.connection.entries[:limit]:
-                    users.append({
-                        'uid': str(entry.uid) if hasattr(entry, 'uid') else '',
-                        'cn': str(entry.cn) if hasattr(entry, 'cn') else '',
-                        'sn': str(entry.sn) if hasattr(entry, 'sn') else '',
-                        'givenName': str(entry.givenName) if hasattr(entry, 'givenName') else '',
-                        'mail': str(entry.mail) if hasattr(entry, 'mail') else '',
-                        'mobile': str(entry.mobile) if hasattr(entry, 'mobile') else None,
-                    })
+            for entry in entries:
+                if entry.get('type') != 'searchResEntry':
+                    continue
+                attrs = entry['attributes']
+                users.append({
+                    'uid': first(attrs, 'uid') or '',
+                    'cn': first(attrs, 'cn') or '',
+                    'sn': first(attrs, 'sn') or '',
+                    'givenName': first(attrs, 'givenName') or '',
+                    'mail': first(attrs, 'mail') or '',
+                    'mobile': first(attrs, 'mobile'),
+                })
+                if len(users) >= limit:
+                    break
             
             return users
             
@@ -382,30 +426,30 @@ class FreeIPAClient:
             logger.error(f"Failed to delete user {uid}: {e}")
             return False, str(e)
     
+    def iter_group_members(self, group_cn: str, page_size: int = 500):
+        """uid اعضای گروه به صورت generator؛ paged search روی memberOf به جای خواندن کل ویژگی member"""
+        if not self.connection:
+            if not self.connect():
+                raise LDAPException("Failed to connect to FreeIPA")
+        group_dn = f"cn={escape_rdn(group_cn)},cn=groups,cn=accounts,{self.base_dn}"
+        for entry in self.connection.extend.standard.paged_search(
+            f"cn=users,cn=accounts,{self.base_dn}",
+            f"(memberOf={escape_filter_chars(group_dn)})",
+            attributes=['uid'],
+            paged_size=page_size,
+            generator=True
+        ):
+            if entry.get('type') != 'searchResEntry':
+                continue
+            uid = (entry.get('raw_attributes') or {}).get('uid')
+            if uid:
+                yield uid[0].decode() if isinstance(uid[0], bytes) else str(uid[0])
+
     def get_group_members(self, group_cn: str) -> Tuple[bool, List[str], str]:
-        """دریافت اعضای گروه"""
+        """دریافت اعضای گروه (uid کاربران، شامل عضویت تو در تو)"""
         try:
-            if not self.connection:
-                if not self.connect():
-                    return False, [], "Failed to connect to FreeIPA"
-            
-            group_dn = f"cn={group_cn},cn=groups,cn=accounts,{self.base_dn}"
-            
-            success = self.connection.search(
-                group_dn,
-                '(objectClass=groupOfNames)',
-                attributes=['member']
-            )
-            
-            if success and self.connection.entries:
-                members = []
-                for entry in self.connection.entries:
-                    if hasattr(entry, 'member'):
-                        for member in entry.member.values:
-                            # استخراج uid از DN
-                            if 'uid=' in member:
-                                uid = member.split('uid=')[1].split(',')[0]
-                                members.append(uid)
+            members = list(self.iter_group_members(group_cn))
+            if members:
                 return True, members, "Group members retrieved successfully"
             else:
                 return False, [], "No members found or group doesn't exist"
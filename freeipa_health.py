@@ -0,0 +1,181 @@
+"""
+گزارش سلامت حساب‌های FreeIPA (قفل، انقضای رمز/principal، تلاش‌های ناموفق ورود)
+
+همه کاربران با یک paged search و فقط با ویژگی‌های لازم خوانده می‌شوند و گزارش در
+حافظه worker با زمان تولید نگه داشته می‌شود. درخواست‌ها همیشه آخرین گزارش موجود را
+می‌گیرند؛ اگر گزارش قدیمی‌تر از max_age باشد به‌روزرسانی در پس‌زمینه انجام می‌شود.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+HEALTH_ATTRIBUTES = ['uid', 'cn', 'nsAccountLock', 'krbPasswordExpiration',
+                     'krbPrincipalExpiration', 'krbLoginFailedCount']
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freeipa-health')
+
+
+def _raw(entry: Dict, name: str) -> List[str]:
+    values = (entry.get('raw_attributes') or {}).get(name) or []
+    return [v.decode('utf-8', 'replace') if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _one(entry: Dict, name: str) -> Optional[str]:
+    values = _raw(entry, name)
+    return values[0] if values else None
+
+
+def parse_generalized_time(value: Optional[str]) -> Optional[datetime]:
+    """'20250101120000Z' → datetime (UTC، بدون tzinfo)؛ مقدار نامعتبر → None"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.strip()[:14], '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
+
+def _account(entry: Dict, now: datetime) -> Optional[Dict]:
+    uid = _one(entry, 'uid')
+    if not uid:
+        return None
+    password_exp = parse_generalized_time(_one(entry, 'krbPasswordExpiration'))
+    principal_exp = parse_generalized_time(_one(entry, 'krbPrincipalExpiration'))
+    try:
+        failed = int(_one(entry, 'krbLoginFailedCount') or 0)
+    except ValueError:
+        failed = 0
+    return {
+        'username': uid,
+        'full_name': _one(entry, 'cn') or '',
+        'locked': (_one(entry, 'nsAccountLock') or '').upper() == 'TRUE',
+        'password_expiration': password_exp.isoformat() if password_exp else None,
+        'principal_expiration': principal_exp.isoformat() if principal_exp else None,
+        'principal_days_left': round((principal_exp - now).total_seconds() / 86400, 1) if principal_exp else None,
+        'failed_logins': failed,
+        '_password_exp': password_exp,
+        '_principal_exp': principal_exp,
+    }
+
+
+def build_report(entries: Iterable[Dict], warn_days: int = 14, now: Optional[datetime] = None) -> Dict:
+    """محاسبه گزارش از ورودی‌های جستجو (raw_attributes) در یک گذر"""
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    warn_until = now + timedelta(days=warn_days)
+    total = 0
+    locked, password_expired, principal_expired, principal_expiring, failed = [], [], [], [], []
+    for entry in entries:
+        account = _account(entry, now)
+        if account is None:
+            continue
+        total += 1
+        if account['locked']:
+            locked.append(account)
+        if account['_password_exp'] and account['_password_exp'] <= now:
+            password_expired.append(account)
+        principal_exp = account['_principal_exp']
+        if principal_exp:
+            if principal_exp <= now:
+                principal_expired.append(account)
+            elif principal_exp <= warn_until:
+                principal_expiring.append(account)
+        if account['failed_logins'] > 0:
+            failed.append(account)
+
+    def clean(items: List[Dict]) -> List[Dict]:
+        return [{k: v for k, v in item.items() if not k.startswith('_')} for item in items]
+
+    by_name = lambda a: a['username']
+    return {
+        'generated_at': now.isoformat(),
+        'warn_days': warn_days,
+        'scan_ms': round((time.perf_counter() - started) * 1000, 1),
+        'totals': {
+            'users': total,
+            'locked': len(locked),
+            'password_expired': len(password_expired),
+            'principal_expired': len(principal_expired),
+            'principal_expiring': len(principal_expiring),
+            'failed_logins': len(failed),
+            'failed_login_attempts': sum(a['failed_logins'] for a in failed),
+        },
+        'locked': clean(sorted(locked, key=by_name)),
+        'password_expired': clean(sorted(password_expired, key=lambda a: a['_password_exp'])),
+        'principal_expired': clean(sorted(principal_expired, key=lambda a: a['_principal_exp'])),
+        'principal_expiring': clean(sorted(principal_expiring, key=lambda a: a['_principal_exp'])),
+        'failed_logins': clean(sorted(failed, key=lambda a: (-a['failed_logins'], a['username']))),
+    }
+
+
+def scan_account_health(service, warn_days: int = 14) -> Dict:
+    """یک paged search روی cn=users فقط با HEALTH_ATTRIBUTES"""
+    config = service._get_config()
+    base_users = f"cn=users,cn=accounts,{config['base_dn']}"
+    started = time.perf_counter()
+    entries = service.paged_search(base_users, '(objectClass=person)', HEALTH_ATTRIBUTES)
+    report = build_report(entries, warn_days)
+    report['scan_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"FreeIPA account health: {report['totals']['users']} users scanned ({report['scan_ms']}ms)")
+    return report
+
+
+class HealthReportCache:
+    """آخرین گزارش سلامت و به‌روزرسانی پس‌زمینه آن (یک scan همزمان در هر worker)"""
+
+    def __init__(self):
+        self._report: Optional[Dict] = None
+        self._built_at = 0.0
+        self._error: Optional[str] = None
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def _run(self, app, warn_days: int):
+        with app.app_context():
+            from freeipa_service import freeipa_service
+            try:
+                report = scan_account_health(freeipa_service, warn_days)
+            except Exception as e:
+                self._error = str(e)
+                logger.warning(f"FreeIPA account health scan failed: {e}")
+                return
+            self._report, self._built_at, self._error = report, time.time(), None
+
+    def refresh(self, app, warn_days: int = 14) -> Future:
+        """شروع scan در پس‌زمینه (اگر scan دیگری در جریان باشد همان برگردانده می‌شود)"""
+        with self._lock:
+            if self._future is None or self._future.done():
+                self._future = _executor.submit(self._run, app, warn_days)
+            return self._future
+
+    def refreshing(self) -> bool:
+        future = self._future
+        return future is not None and not future.done()
+
+    def get(self, app, max_age: float = 300, warn_days: int = 14, wait: float = 30) -> Optional[Dict]:
+        """آخرین گزارش؛ بار اول تا wait ثانیه منتظر scan می‌ماند، در بقیه موارد گزارش قبلی فوراً برمی‌گردد"""
+        if self._report is None:
+            future = self.refresh(app, warn_days)
+            try:
+                future.result(timeout=wait)
+            except Exception:
+                pass
+        elif time.time() - self._built_at >= max_age or self._report.get('warn_days') != warn_days:
+            self.refresh(app, warn_days)
+        return self._report
+
+    def status(self) -> Dict:
+        return {
+            'age_seconds': round(time.time() - self._built_at, 1) if self._report else None,
+            'refreshing': self.refreshing(),
+            'error': self._error,
+        }
+
+
+health_report = HealthReportCache()
@@ -0,0 +1,232 @@
+"""
+همگام‌سازی host entryهای FreeIPA (cn=computers,cn=accounts) با جدول Server
+
+همه hostها با یک paged search و فقط با ویژگی‌های لازم خوانده می‌شوند. سرورهای موجود
+یک بار (فقط ستون‌های لازم) در نگاشت‌های حافظه‌ای بر اساس FQDN پیوندشده، نام و IP عددی
+قرار می‌گیرند و برای هر host فقط تفاوت محاسبه می‌شود؛ درج و به‌روزرسانی‌ها دسته‌ای اعمال
+می‌شوند و ردیف‌های بدون تغییر نوشته نمی‌شوند. سرور پیوندشده‌ای که host آن در دور
+کامل دیده نشود با freeipa_missing علامت‌گذاری می‌شود (حذف نمی‌شود).
+"""
+
+import json
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from models import db, Server
+from freeipa_sync import _chunks, _claim, _raw, get_state
+from utils.ipaddr import ip_sort_key
+
+logger = logging.getLogger(__name__)
+
+SCOPE = 'hosts'
+HOST_ATTRIBUTES = ['fqdn', 'ipHostNumber', 'nsOsVersion']
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freeipa-hosts')
+
+
+def _os_type(os_version: str) -> str:
+    """nsOsVersion (مثلاً 'Rocky Linux 9.3') → مقادیر os_type فرم سرور"""
+    value = (os_version or '').lower()
+    if 'windows' in value:
+        return 'windows'
+    if 'mac' in value or 'darwin' in value:
+        return 'macos'
+    return 'linux'
+
+
+def _resolve(fqdns: List[str], workers: int = 16) -> Dict[str, str]:
+    """IP hostهای جدیدی که ipHostNumber ندارند (DNS، موازی)"""
+    def lookup(name):
+        try:
+            return name, socket.gethostbyname(name)
+        except OSError:
+            return name, None
+    if not fqdns:
+        return {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='freeipa-hosts-dns') as pool:
+        return {name: ip for name, ip in pool.map(lookup, fqdns) if ip}
+
+
+class _Inventory:
+    """نگاشت‌های حافظه‌ای سرورهای موجود برای تطبیق O(1)"""
+
+    def __init__(self):
+        self.rows: Dict[int, Tuple] = {}
+        self.by_fqdn: Dict[str, int] = {}
+        self.by_name: Dict[str, int] = {}
+        self.by_short: Dict[str, Optional[int]] = {}
+        self.by_ip: Dict[Tuple[int, str], Optional[int]] = {}
+        query = db.session.query(Server.id, Server.name, Server.ip_version, Server.ip_value,
+                                 Server.freeipa_fqdn, Server.freeipa_missing)
+        for row in query.yield_per(2000):
+            row_id, name, ip_version, ip_value, fqdn, _ = row
+            self.rows[row_id] = row
+            if fqdn:
+                self.by_fqdn[fqdn.lower()] = row_id
+            name = (name or '').strip().lower()
+            if name:
+                self.by_name.setdefault(name, row_id)
+                short = name.split('.', 1)[0]
+                # نام کوتاه تکراری قابل اتکا نیست
+                self.by_short[short] = row_id if short not in self.by_short else None
+            if ip_value:
+                key = (ip_version, ip_value)
+                self.by_ip[key] = row_id if key not in self.by_ip else None
+
+    def match(self, fqdn: str, ip_key: Optional[Tuple[int, str]]) -> Optional[int]:
+        row_id = self.by_fqdn.get(fqdn) or self.by_name.get(fqdn)
+        if row_id is None and ip_key:
+            row_id = self.by_ip.get(ip_key)
+        if row_id is None:
+            row_id = self.by_short.get(fqdn.split('.', 1)[0])
+        if row_id is not None:
+            # سروری که به host دیگری پیوند خورده دوباره تطبیق داده نمی‌شود
+            linked = self.rows[row_id][4]
+            if linked and linked.lower() != fqdn:
+                return None
+        return row_id
+
+
+def run_host_sync(app, service=None, create: Optional[bool] = None, resolve: Optional[bool] = None) -> Dict:
+    """یک دور کامل همگام‌سازی hostها (نیازمند app context)"""
+    if service is None:
+        from freeipa_service import freeipa_service as service
+    if not hasattr(service, 'paged_search'):
+        raise RuntimeError('سرویس FreeIPA فعلی از paged search پشتیبانی نمی‌کند (حالت Mock)')
+    if create is None:
+        create = bool(app.config.get('FREEIPA_HOST_SYNC_CREATE', True))
+    if resolve is None:
+        resolve = bool(app.config.get('FREEIPA_HOST_SYNC_RESOLVE', False))
+    batch_size = int(app.config.get('FREEIPA_SYNC_BATCH_SIZE', 500))
+
+    state = get_state(SCOPE)
+    if not _claim(state, 'full'):
+        return {'skipped': True, 'reason': 'host sync already running'}
+    started = datetime.utcnow()
+    clock = time.perf_counter()
+    ok, message = service.test_connection()
+    if not ok:
+        state = get_state(SCOPE)
+        state.status = 'failed'
+        state.error_message = message
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise RuntimeError(f'اتصال به FreeIPA برقرار نشد: {message}')
+
+    summary = {'hosts': 0, 'matched': 0, 'linked': 0, 'restored': 0, 'created': 0,
+               'flagged_missing': 0, 'skipped_no_ip': 0, 'unchanged': 0}
+    try:
+        inventory = _Inventory()
+        timings = {'load_ms': round((time.perf_counter() - clock) * 1000, 1)}
+        mark = time.perf_counter()
+        base_dn = service._get_config()['base_dn']
+        seen: set = set()
+        updates: List[Dict] = []
+        new_hosts: Dict[str, Dict] = {}
+        for entry in service.paged_search(f"cn=computers,cn=accounts,{base_dn}", '(fqdn=*)', HOST_ATTRIBUTES, batch_size):
+            fqdns = _raw(entry, 'fqdn')
+            if not fqdns:
+                continue
+            fqdn = fqdns[0].strip().lower()
+            summary['hosts'] += 1
+            ips = _raw(entry, 'ipHostNumber')
+            ip = ips[0].strip() if ips else None
+            ip_version, ip_value = ip_sort_key(ip)
+            row_id = inventory.match(fqdn, (ip_version, ip_value) if ip_value else None)
+            if row_id is None or row_id in seen:
+                if fqdn not in new_hosts:
+                    os_versions = _raw(entry, 'nsOsVersion')
+                    new_hosts[fqdn] = {'ip': ip if ip_value else None,
+                                       'os_type': _os_type(os_versions[0] if os_versions else '')}
+                continue
+            seen.add(row_id)
+            summary['matched'] += 1
+            _, _, _, _, linked, missing = inventory.rows[row_id]
+            changes = {}
+            if (linked or '').lower() != fqdn:
+                changes['freeipa_fqdn'] = fqdn
+                summary['linked'] += 1
+            if missing:
+                changes.update(freeipa_missing=False, freeipa_missing_since=None)
+                summary['restored'] += 1
+            if changes:
+                updates.append(dict(changes, id=row_id, updated_at=started))
+            else:
+                summary['unchanged'] += 1
+        timings['scan_ms'] = round((time.perf_counter() - mark) * 1000, 1)
+
+        inserts: List[Dict] = []
+        if create and new_hosts:
+            unresolved = [name for name, host in new_hosts.items() if not host['ip']]
+            resolved = _resolve(unresolved) if resolve else {}
+            for fqdn, host in new_hosts.items():
+                ip = host['ip'] or resolved.get(fqdn)
+                ip_version, ip_value = ip_sort_key(ip)
+                if ip_value is None:
+                    summary['skipped_no_ip'] += 1
+                    continue
+                inserts.append({
+                    'name': fqdn, 'ip_address': ip, 'ip_version': ip_version, 'ip_value': ip_value,
+                    'os_type': host['os_type'], 'status': 'active', 'description': 'FreeIPA host',
+                    'freeipa_fqdn': fqdn, 'freeipa_missing': False,
+                    'created_at': started, 'updated_at': started,
+                })
+
+        # فقط اگر scan نتیجه داشته: نتیجه خالی به احتمال زیاد خطای اتصال/دسترسی است
+        if summary['hosts']:
+            for row_id, row in inventory.rows.items():
+                if row[4] and not row[5] and row_id not in seen:
+                    updates.append({'id': row_id, 'freeipa_missing': True, 'freeipa_missing_since': started,
+                                    'updated_at': started})
+                    summary['flagged_missing'] += 1
+
+        mark = time.perf_counter()
+        for chunk in _chunks(inserts, batch_size):
+            db.session.bulk_insert_mappings(Server, chunk)
+        for chunk in _chunks(updates, batch_size):
+            db.session.bulk_update_mappings(Server, chunk)
+        summary['created'] = len(inserts)
+        timings['write_ms'] = round((time.perf_counter() - mark) * 1000, 1)
+
+        finished = datetime.utcnow()
+        summary['duration_ms'] = int((time.perf_counter() - clock) * 1000)
+        summary['timings'] = timings
+        state = get_state(SCOPE)
+        state.status = 'completed'
+        state.details = json.dumps(summary)
+        state.finished_at = finished
+        state.last_full_sync = finished
+        db.session.commit()
+        logger.info(f"FreeIPA host sync: {summary}")
+        return summary
+    except Exception as e:
+        db.session.rollback()
+        state = get_state(SCOPE)
+        state.status = 'failed'
+        state.error_message = str(e)
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+
+def enqueue_host_sync(app):
+    """اجرای همگام‌سازی hostها در worker پس‌زمینه"""
+    return _executor.submit(_run_host_sync_job, app)
+
+
+def _run_host_sync_job(app):
+    with app.app_context():
+        try:
+            run_host_sync(app)
+        except Exception as e:
+            logger.error(f"FreeIPA host sync failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def get_host_sync_state():
+    return get_state(SCOPE)
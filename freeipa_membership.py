@@ -0,0 +1,228 @@
+"""
+ایندکس عضویت گروه‌های FreeIPA در حافظه (به ازای هر worker)
+
+با یک paged search روی cn=groups,cn=accounts عضویت مستقیم (member) همه گروه‌ها خوانده
+و عضویت تو در تو (گروه عضو گروه) به طور کامل resolve می‌شود؛ نتیجه نگاشت
+uid → مجموعه cn گروه‌هاست و بررسی عضویت یک جستجوی O(1) در set است.
+به‌روزرسانی افزایشی فقط گروه‌هایی را می‌خواند که modifyTimestamp آن‌ها از watermark قبلی
+بزرگ‌تر یا مساوی است؛ حذف/تغییر نام گروه فقط در بازسازی کامل دوره‌ای دیده می‌شود.
+پس از به‌روزرسانی ناموفق تا retry_interval ثانیه دوباره به LDAP سر زده نمی‌شود و snapshot
+قبلی (یا None) برگردانده می‌شود تا قطعی FreeIPA هر درخواست را معطل timeout نکند.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+GROUP_ATTRIBUTES = ['cn', 'member', 'modifyTimestamp']
+
+
+def _raw(entry: Dict, name: str) -> List[str]:
+    values = (entry.get('raw_attributes') or {}).get(name) or []
+    return [v.decode('utf-8', 'replace') if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _split_member(dn: str):
+    """uid=jdoe,cn=users,... → ('user', 'jdoe') و cn=admins,cn=groups,... → ('group', 'admins')"""
+    head, _, rest = dn.partition(',')
+    key, _, value = head.partition('=')
+    key, rest = key.strip().lower(), rest.lower()
+    if key == 'uid' and rest.startswith('cn=users,cn=accounts,'):
+        return 'user', value.strip().lower()
+    if key == 'cn' and rest.startswith('cn=groups,cn=accounts,'):
+        return 'group', value.strip().lower()
+    return None, None
+
+
+class MembershipSnapshot:
+    """نتیجه غیرقابل تغییر یک بار ساخت ایندکس (بین threadها بدون قفل خوانده می‌شود)"""
+
+    def __init__(self, direct_users: Dict[str, Set[str]], direct_groups: Dict[str, Set[str]],
+                 names: Dict[str, str], watermark: Optional[str], built_at: float, full_at: float):
+        self.direct_users = direct_users
+        self.direct_groups = direct_groups
+        self.names = names  # cn کوچک‌شده → cn اصلی
+        self.watermark = watermark
+        self.built_at = built_at
+        self.full_at = full_at
+        self._resolve()
+
+    def _resolve(self):
+        # parents[g]: گروه‌هایی که g مستقیماً عضو آن‌هاست
+        parents: Dict[str, Set[str]] = {}
+        for group, subgroups in self.direct_groups.items():
+            for sub in subgroups:
+                parents.setdefault(sub, set()).add(group)
+        ancestors: Dict[str, FrozenSet[str]] = {}
+
+        def closure(group: str) -> FrozenSet[str]:
+            cached = ancestors.get(group)
+            if cached is not None:
+                return cached
+            seen = {group}
+            stack = [group]
+            while stack:  # BFS/DFS با seen؛ حلقه‌های عضویت مشکلی ایجاد نمی‌کنند
+                for parent in parents.get(stack.pop(), ()):
+                    if parent not in seen:
+                        seen.add(parent)
+                        stack.append(parent)
+            ancestors[group] = result = frozenset(seen)
+            return result
+
+        direct_by_user: Dict[str, Set[str]] = {}
+        for group, uids in self.direct_users.items():
+            for uid in uids:
+                direct_by_user.setdefault(uid, set()).add(group)
+        by_direct_set: Dict[FrozenSet[str], FrozenSet[str]] = {}
+        groups_by_user: Dict[str, FrozenSet[str]] = {}
+        for uid, direct in direct_by_user.items():
+            key = frozenset(direct)
+            resolved = by_direct_set.get(key)
+            if resolved is None:
+                resolved = frozenset().union(*(closure(g) for g in key))
+                by_direct_set[key] = resolved
+            groups_by_user[uid] = resolved
+        self.direct_by_user = {uid: frozenset(groups) for uid, groups in direct_by_user.items()}
+        self.groups_by_user = groups_by_user
+
+    def groups_of(self, uid: str) -> FrozenSet[str]:
+        """همه گروه‌های کاربر (مستقیم و تو در تو، cn کوچک‌شده)"""
+        return self.groups_by_user.get((uid or '').lower(), frozenset())
+
+    def is_member(self, uid: str, group_cn: str) -> bool:
+        return (group_cn or '').lower() in self.groups_of(uid)
+
+    def member_count(self, group_cn: str) -> Optional[int]:
+        """تعداد اعضای مستقیم گروه (کاربر و زیرگروه)؛ None برای گروه ناشناخته"""
+        key = (group_cn or '').lower()
+        if key not in self.names:
+            return None
+        return len(self.direct_users.get(key, ())) + len(self.direct_groups.get(key, ()))
+
+    def display_names(self, groups: Iterable[str]) -> List[str]:
+        return sorted(self.names.get(g, g) for g in groups)
+
+    def stats(self) -> Dict:
+        return {
+            'groups': len(self.names),
+            'users': len(self.groups_by_user),
+            'nested_links': sum(len(v) for v in self.direct_groups.values()),
+            'watermark': self.watermark,
+            'age_seconds': round(time.time() - self.built_at, 1),
+            'full_age_seconds': round(time.time() - self.full_at, 1),
+        }
+
+
+class MembershipIndex:
+    """نگهدارنده snapshot فعلی و منطق به‌روزرسانی کامل/افزایشی"""
+
+    def __init__(self):
+        self._snapshot: Optional[MembershipSnapshot] = None
+        self._stale = False
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+
+    def mark_stale(self):
+        """پس از تغییر عضویت‌ها: دسترسی بعدی یک به‌روزرسانی افزایشی انجام می‌دهد"""
+        self._stale = True
+
+    def clear(self):
+        self._snapshot = None
+
+    def _scan(self, service, search_filter: str):
+        config = service._get_config()
+        base_groups = f"cn=groups,cn=accounts,{config['base_dn']}"
+        for entry in service.paged_search(base_groups, search_filter, GROUP_ATTRIBUTES):
+            cns = _raw(entry, 'cn')
+            if not cns:
+                continue
+            users: Set[str] = set()
+            groups: Set[str] = set()
+            for dn in _raw(entry, 'member'):
+                kind, name = _split_member(dn)
+                if kind == 'user':
+                    users.add(name)
+                elif kind == 'group':
+                    groups.add(name)
+            stamps = _raw(entry, 'modifyTimestamp')
+            yield cns[0], users, groups, (stamps[0] if stamps else None)
+
+    def _build(self, service, previous: Optional[MembershipSnapshot], full: bool) -> MembershipSnapshot:
+        started = time.perf_counter()
+        now = time.time()
+        if full or previous is None:
+            direct_users: Dict[str, Set[str]] = {}
+            direct_groups: Dict[str, Set[str]] = {}
+            names: Dict[str, str] = {}
+            watermark = None
+            search_filter = '(objectClass=groupOfNames)'
+            full_at = now
+        else:
+            # کپی سطحی: setهای گروه‌های تغییرکرده جایگزین می‌شوند، نه ویرایش
+            direct_users = dict(previous.direct_users)
+            direct_groups = dict(previous.direct_groups)
+            names = dict(previous.names)
+            watermark = previous.watermark
+            search_filter = (f"(&(objectClass=groupOfNames)(modifyTimestamp>={watermark}))"
+                             if watermark else '(objectClass=groupOfNames)')
+            full_at = previous.full_at
+        changed = 0
+        for cn, users, groups, stamp in self._scan(service, search_filter):
+            key = cn.lower()
+            names[key] = cn
+            direct_users[key] = users
+            direct_groups[key] = groups
+            if stamp and (watermark is None or stamp > watermark):
+                watermark = stamp
+            changed += 1
+        snapshot = MembershipSnapshot(direct_users, direct_groups, names, watermark, now, full_at)
+        logger.info(f"FreeIPA membership index {'full' if full or previous is None else 'incremental'}: "
+                    f"{changed} groups read, {len(snapshot.groups_by_user)} users "
+                    f"({round((time.perf_counter() - started) * 1000, 1)}ms)")
+        return snapshot
+
+    def _refresh_locked(self, service, full: bool) -> Optional[MembershipSnapshot]:
+        try:
+            self._stale = False
+            self._snapshot = self._build(service, self._snapshot, full)
+            self._failed_at = 0.0
+        except Exception as e:
+            self._stale = True
+            self._failed_at = time.time()
+            logger.warning(f"FreeIPA membership index refresh failed: {e}")
+        return self._snapshot
+
+    def refresh(self, service, full: bool = False) -> Optional[MembershipSnapshot]:
+        with self._lock:
+            return self._refresh_locked(service, full)
+
+    def _backing_off(self, retry_interval: float) -> bool:
+        return time.time() - self._failed_at < retry_interval
+
+    def get(self, service, refresh_interval: float = 60, full_interval: float = 3600,
+            retry_interval: float = 30) -> Optional[MembershipSnapshot]:
+        """snapshot معتبر؛ در صورت کهنگی به‌روزرسانی می‌شود (در حین به‌روزرسانی، بقیه از snapshot قبلی می‌خوانند)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            if self._backing_off(retry_interval):
+                return None
+            with self._lock:
+                if self._snapshot is None and not self._backing_off(retry_interval):
+                    self._refresh_locked(service, full=True)
+                return self._snapshot
+        if self._backing_off(retry_interval):
+            return snapshot
+        now = time.time()
+        full_due = now - snapshot.full_at >= full_interval
+        if (full_due or self._stale or now - snapshot.built_at >= refresh_interval) and self._lock.acquire(blocking=False):
+            try:
+                return self._refresh_locked(service, full=full_due)
+            finally:
+                self._lock.release()
+        return snapshot
+
+
+membership_index = MembershipIndex()
@@ -0,0 +1,281 @@
+"""
+اندازه‌گیری عملیات LDAP (open، StartTLS، bind، search، modify، extended و ...)
+
+InstrumentedConnection جایگزین ldap3.Connection در freeipa_pool/freeipa_service/freeipa_client
+است و برای هر عملیات زمان، کد نتیجه و تعداد ورودی‌های برگشتی را ثبت می‌کند:
+- histogram هر نوع عملیات در حافظه همان worker (ldap_metrics، API /freeipa/api/metrics)
+- لاگ ساخت‌یافته JSON روی logger 'freeipa.ldap' / logs/ldap.log (هر عملیات DEBUG، عملیات کند WARNING)
+- جمع عملیات هر درخواست در flask.g تا هزینه LDAP هر صفحه /freeipa/* در لاگ و هدر
+  Server-Timing همان درخواست دیده شود.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from flask import g, has_request_context
+from ldap3 import Connection
+
+logger = logging.getLogger('freeipa.ldap')
+
+# مرزهای histogram بر حسب میلی‌ثانیه (آخرین bucket: +Inf)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# کدهای نتیجه‌ای که خطا شمرده نمی‌شوند (success، compareFalse، compareTrue)
+OK_CODES = (0, 5, 6)
+# عملیات سطح اتصال: در لاگ به جای DN هدف، کاربر bind ثبت می‌شود
+SESSION_OPERATIONS = ('open', 'start_tls', 'bind', 'unbind')
+
+_settings = {'enabled': True, 'slow_ms': 500.0}
+_local = threading.local()
+
+
+def configure(enabled: bool = True, slow_ms: float = 500):
+    _settings['enabled'] = bool(enabled)
+    _settings['slow_ms'] = float(slow_ms)
+
+
+class _Histogram:
+    __slots__ = ('count', 'errors', 'entries', 'total_ms', 'max_ms', 'buckets', 'codes')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.entries = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.codes: Dict[str, int] = {}
+
+    def add(self, ms: float, ok: bool = True, code: Optional[str] = None, entries: int = 0):
+        self.count += 1
+        self.total_ms += ms
+        self.entries += entries
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if not ok:
+            self.errors += 1
+        if code is not None:
+            self.codes[code] = self.codes.get(code, 0) + 1
+        for index, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """تخمین صدک از روی bucketها (مرز بالای bucket)"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bound in enumerate(BUCKETS_MS):
+            seen += self.buckets[index]
+            if seen >= target:
+                return float(bound)
+        return round(self.max_ms, 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'entries': self.entries,
+            'total_ms': round(self.total_ms, 1),
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else None,
+            'max_ms': round(self.max_ms, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': {('+Inf' if index == len(BUCKETS_MS) else str(BUCKETS_MS[index])): n
+                        for index, n in enumerate(self.buckets)},
+            'codes': dict(self.codes),
+        }
+
+
+class LDAPMetrics:
+    """histogram عملیات LDAP و هزینه LDAP هر endpoint در این worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._operations: Dict[str, _Histogram] = {}
+            self._endpoints: Dict[str, _Histogram] = {}
+            self.since = time.time()
+
+    def record(self, operation: str, ms: float, ok: bool = True, code: Optional[str] = None, entries: int = 0):
+        with self._lock:
+            histogram = self._operations.get(operation)
+            if histogram is None:
+                histogram = self._operations[operation] = _Histogram()
+            histogram.add(ms, ok, code, entries)
+
+    def record_request(self, endpoint: str, ms: float, operations: int):
+        with self._lock:
+            histogram = self._endpoints.get(endpoint)
+            if histogram is None:
+                histogram = self._endpoints[endpoint] = _Histogram()
+            histogram.add(ms, entries=operations)
+
+    @contextmanager
+    def timed(self, operation: str):
+        """اندازه‌گیری یک مرحله غیر LDAP (مثلاً انتظار برای اتصال pool)"""
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            self.record(operation, ms, ok)
+            _add_to_request(operation, ms)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'since': self.since,
+                'uptime_s': round(time.time() - self.since, 1),
+                'operations': {name: h.to_dict() for name, h in sorted(self._operations.items())},
+                # برای endpointها entries = تعداد عملیات LDAP درخواست‌ها
+                'endpoints': {name: h.to_dict() for name, h in sorted(self._endpoints.items())},
+            }
+
+    def prometheus(self) -> str:
+        """قالب متنی Prometheus برای histogram عملیات"""
+        lines = ['# TYPE freeipa_ldap_operation_ms histogram']
+        with self._lock:
+            items = sorted(self._operations.items())
+            for name, h in items:
+                cumulative = 0
+                for index, n in enumerate(h.buckets):
+                    cumulative += n
+                    bound = '+Inf' if index == len(BUCKETS_MS) else str(BUCKETS_MS[index])
+                    lines.append(f'freeipa_ldap_operation_ms_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'freeipa_ldap_operation_ms_sum{{operation="{name}"}} {round(h.total_ms, 3)}')
+                lines.append(f'freeipa_ldap_operation_ms_count{{operation="{name}"}} {h.count}')
+            lines.append('# TYPE freeipa_ldap_operation_errors_total counter')
+            lines.extend(f'freeipa_ldap_operation_errors_total{{operation="{name}"}} {h.errors}' for name, h in items)
+            lines.append('# TYPE freeipa_ldap_entries_total counter')
+            lines.extend(f'freeipa_ldap_entries_total{{operation="{name}"}} {h.entries}' for name, h in items)
+        return '\n'.join(lines) + '\n'
+
+
+ldap_metrics = LDAPMetrics()
+
+
+def _add_to_request(operation: str, ms: float):
+    if not has_request_context():
+        return
+    totals = g.setdefault('ldap_operations', {})
+    item = totals.get(operation)
+    if item is None:
+        totals[operation] = [1, ms]
+    else:
+        item[0] += 1
+        item[1] += ms
+
+
+def request_summary() -> Optional[Dict]:
+    """جمع عملیات LDAP درخواست جاری: {'ms', 'count', 'operations': {op: {count, ms}}}"""
+    totals = g.get('ldap_operations') if has_request_context() else None
+    if not totals:
+        return None
+    operations = {op: {'count': count, 'ms': round(ms, 1)} for op, (count, ms) in sorted(totals.items())}
+    # زمان acquire شامل open/bind اتصال تازه است و در جمع کل دوبار شمرده نمی‌شود
+    return {
+        'ms': round(sum(ms for op, (_, ms) in totals.items() if op != 'pool_acquire'), 1),
+        'count': sum(count for op, (count, _) in totals.items() if op != 'pool_acquire'),
+        'operations': operations,
+    }
+
+
+def _target(args, kwargs) -> str:
+    value = args[0] if args else kwargs.get('search_base') or kwargs.get('dn') or kwargs.get('user') or ''
+    return str(value)[:200]
+
+
+class InstrumentedConnection(Connection):
+    """ldap3.Connection با ثبت زمان/نتیجه هر عملیات (رابط بدون تغییر)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ldap3 در __init__ متد open نمونه را مستقیماً به strategy.open وصل می‌کند (auto_bind داخل
+        # همان __init__ اندازه‌گیری نمی‌شود؛ اتصال‌های این پروژه auto_bind ندارند)
+        strategy_open = self.open
+        self.open = lambda *a, **k: self._measure('open', strategy_open, a, k)
+
+    def _measure(self, operation: str, func, args, kwargs):
+        if not _settings['enabled'] or getattr(_local, 'suppress', False):
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        code = None
+        ok = False
+        entries = 0
+        try:
+            if operation == 'start_tls':
+                # StartTLS داخلی یک extended است؛ فقط یک بار به عنوان start_tls شمرده شود
+                _local.suppress = True
+            result = func(*args, **kwargs)
+            if operation == 'open':
+                ok = not self.closed
+            elif operation == 'unbind':
+                ok = True
+            else:
+                outcome = self.result if isinstance(self.result, dict) else {}
+                code = outcome.get('result')
+                ok = code in OK_CODES if code is not None else bool(result)
+                if operation == 'bind':
+                    ok = bool(result)
+                if operation == 'search':
+                    entries = sum(1 for r in (self.response or []) if r.get('type') == 'searchResEntry')
+            return result
+        except Exception as e:
+            code = type(e).__name__
+            raise
+        finally:
+            if operation == 'start_tls':
+                _local.suppress = False
+            ms = (time.perf_counter() - started) * 1000
+            label = str(code) if code is not None else None
+            ldap_metrics.record(operation, ms, ok, label, entries)
+            _add_to_request(operation, ms)
+            slow = ms >= _settings['slow_ms']
+            if slow or logger.isEnabledFor(logging.DEBUG):
+                record = {'ts': round(time.time(), 3), 'event': 'ldap_op', 'op': operation, 'ms': round(ms, 2), 'ok': ok, 'code': label,
+                          'entries': entries, 'server': str(self.server),
+                          'target': str(self.user or '') if operation in SESSION_OPERATIONS else _target(args, kwargs)}
+                (logger.warning if slow else logger.debug)(json.dumps(record, ensure_ascii=False))
+
+    def start_tls(self, *args, **kwargs):
+        return self._measure('start_tls', super().start_tls, args, kwargs)
+
+    def bind(self, *args, **kwargs):
+        return self._measure('bind', super().bind, args, kwargs)
+
+    def unbind(self, *args, **kwargs):
+        return self._measure('unbind', super().unbind, args, kwargs)
+
+    def search(self, *args, **kwargs):
+        return self._measure('search', super().search, args, kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._measure('add', super().add, args, kwargs)
+
+    def modify(self, *args, **kwargs):
+        return self._measure('modify', super().modify, args, kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._measure('delete', super().delete, args, kwargs)
+
+    def modify_dn(self, *args, **kwargs):
+        return self._measure('modify_dn', super().modify_dn, args, kwargs)
+
+    def compare(self, *args, **kwargs):
+        return self._measure('compare', super().compare, args, kwargs)
+
+    def extended(self, *args, **kwargs):
+        return self._measure('extended', super().extended, args, kwargs)
@@ -1,7 +1,32 @@
 """
 FreeIPA Mock Service برای تست
+
+FreeIPAMockService: جایگزین ساده FreeIPAService برای FREEIPA_USE_MOCK (بدون LDAP).
+MockLDAPDirectory: دایرکتوری درون‌پروسه‌ای با استراتژی MOCK_SYNC در ldap3 که می‌تواند با ده‌ها هزار
+کاربر/گروه به شکل FreeIPA پر شود؛ با install() اتصال‌های freeipa_pool و freeipa_client به جای
+سرور واقعی به آن وصل می‌شوند تا مسیرهای واقعی FreeIPAService/FreeIPAClient بدون سرور اجرا
+و اندازه‌گیری شوند (scripts/bench_freeipa.py). پلاگین memberOf شبیه‌سازی نمی‌شود: memberOf فقط
+هنگام seed ساخته می‌شود و با تغییر عضویت‌ها به‌روز نمی‌شود.
 """
 
+import json
+import random
+import types
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from ldap3 import Server, Connection, MOCK_SYNC, NONE
+from ldap3.protocol.rfc4512 import DsaInfo
+from ldap3.utils.conv import to_raw
+
+from freeipa_metrics import InstrumentedConnection
+
+PASSWORD_MODIFY_OID = '1.3.6.1.4.1.4203.1.11.1'
+WHO_AM_I_OID = '1.3.6.1.4.1.4203.1.11.3'
+USER_OBJECT_CLASSES = ['top', 'person', 'organizationalPerson', 'inetOrgPerson', 'inetUser', 'posixAccount',
+                       'krbPrincipalAux', 'krbTicketPolicyAux', 'ipaObject', 'ipaSshGroupOfPubKeys']
+GROUP_OBJECT_CLASSES = ['top', 'groupOfNames', 'nestedGroup', 'ipaUserGroup', 'ipaObject', 'posixGroup']
+
 class FreeIPAMockService:
     """سرویس Mock FreeIPA برای تست"""
     
@@ -52,6 +77,32 @@ class FreeIPAMockService:
         """دریافت لیست تمام کاربران (Mock)"""
         return self.mock_users
     
+    def search_users(self, query=None, page=1, per_page=50):
+        """یک صفحه از کاربران (Mock)"""
+        q = (query or '').lower()
+        users = [u for u in self.mock_users
+                 if not q or q in u['username'].lower() or q in u['full_name'].lower() or q in u['email'].lower()]
+        start = (max(1, page) - 1) * per_page
+        return {
+            'items': users[start:start + per_page],
+            'page': max(1, page),
+            'per_page': per_page,
+            'has_prev': page > 1,
+            'has_next': len(users) > start + per_page,
+        }
+    
+    def search_groups(self, query=None, page=1, per_page=50):
+        """گروه‌ها (Mock)"""
+        return {'items': [], 'page': max(1, page), 'per_page': per_page, 'has_prev': page > 1, 'has_next': False}
+    
+    def get_group(self, group_cn):
+        """اطلاعات گروه (Mock)"""
+        return None
+    
+    def search_group_members(self, group_cn, page=1, per_page=50):
+        """اعضای گروه (Mock)"""
+        return {'items': [], 'page': max(1, page), 'per_page': per_page, 'has_prev': page > 1, 'has_next': False}
+    
     def get_user_groups(self, username):
         """دریافت گروه‌های کاربر (Mock)"""
         user = self.get_user_info(username)
@@ -64,9 +115,187 @@ class FreeIPAMockService:
         groups = self.get_user_groups(username)
         return group_name in groups
     
+    def get_user_group_names(self, username):
+        """نام گروه‌های کاربر (Mock)"""
+        return sorted(self.get_user_groups(username))
+    
+    def membership(self):
+        """ایندکس عضویت در حالت Mock وجود ندارد"""
+        return None
+    
     def test_connection(self):
         """تست اتصال (Mock)"""
         return True, "اتصال Mock موفق - FreeIPA در حالت تست"
 
 # ایجاد instance سراسری
 freeipa_mock_service = FreeIPAMockService()
+
+
+def _mock_extended(strategy, request_message, controls):
+    """Password Modify (RFC 3062) علاوه بر عملیات‌های توسعه‌یافته‌ای که MOCK_SYNC خودش پاسخ می‌دهد"""
+    from ldap3.operation.extended import extended_request_to_dict
+    request = extended_request_to_dict(request_message)
+    if request['name'] != PASSWORD_MODIFY_OID:
+        return strategy._base_mock_extended(request_message, controls)
+    from pyasn1.codec.ber import decoder
+    from ldap3.protocol.rfc3062 import PasswdModifyRequestValue
+    value, _ = decoder.decode(request['value'], asn1Spec=PasswdModifyRequestValue())
+    user = str(value['userIdentity']) if value['userIdentity'].hasValue() else strategy.bound
+    result = {'resultCode': 32, 'matchedDN': '', 'diagnosticMessage': 'no such object',
+              'referral': None, 'responseName': None, 'responseValue': None}
+    with strategy.connection.server.dit_lock:
+        entry = strategy.connection.server.dit.get(user)
+        if entry is not None:
+            if value['oldPasswd'].hasValue() and to_raw(str(value['oldPasswd'])) not in entry.get('userPassword', []):
+                result.update(resultCode=49, diagnosticMessage='invalid credentials')
+            else:
+                entry['userPassword'] = [to_raw(str(value['newPasswd']))]
+                result.update(resultCode=0, diagnosticMessage='')
+    return result
+
+
+class MockLDAPDirectory:
+    """دایرکتوری FreeIPA درون‌پروسه‌ای (MOCK_SYNC) برای تست و بنچمارک بدون سرور"""
+
+    def __init__(self, base_dn: str = 'dc=mci,dc=local', host: str = 'mock-ipa', admin_password: str = 'Secret123'):
+        self.base_dn = base_dn
+        self.host = host
+        self.admin_password = admin_password
+        # بدون schema: MOCK_SYNC فقط objectClassهای schema را می‌پذیرد و schema آفلاین 389 کلاس‌های FreeIPA را ندارد
+        self.server = Server(host, get_info=NONE)
+        self.server.attach_dsa_info(DsaInfo({
+            'supportedExtension': [PASSWORD_MODIFY_OID, WHO_AM_I_OID],
+            'namingContexts': [base_dn],
+            'vendorName': ['ldap3 MOCK_SYNC (FreeIPA stand-in)'],
+        }, {}))
+        self._loader = self.connection()
+        self._patched = []
+        self.users: Dict[str, str] = {}  # uid → رمز اولیه
+        self.groups: Dict[str, int] = {}  # cn → تعداد اعضای مستقیم
+        self._loader.strategy.add_entry(self.bind_dn, {
+            'uid': 'admin', 'cn': 'Administrator', 'sn': 'Administrator',
+            'objectClass': USER_OBJECT_CLASSES, 'userPassword': admin_password,
+        })
+
+    @property
+    def bind_dn(self) -> str:
+        return self.user_dn('admin')
+
+    def user_dn(self, uid: str) -> str:
+        return f"uid={uid},cn=users,cn=accounts,{self.base_dn}"
+
+    def group_dn(self, cn: str) -> str:
+        return f"cn={cn},cn=groups,cn=accounts,{self.base_dn}"
+
+    def connection(self, server=None, user=None, password=None, **kwargs) -> Connection:
+        """جایگزین ldap3.Connection: server/ServerPool ورودی نادیده گرفته و به دایرکتوری mock وصل می‌شود"""
+        kwargs.pop('client_strategy', None)
+        conn = InstrumentedConnection(self.server, user=user, password=password, client_strategy=MOCK_SYNC, **kwargs)
+        conn.strategy._base_mock_extended = conn.strategy.mock_extended
+        conn.strategy.mock_extended = types.MethodType(_mock_extended, conn.strategy)
+        return conn
+
+    def add_entries(self, entries: Iterable[Tuple[str, Dict]]) -> int:
+        added = 0
+        for dn, attributes in entries:
+            added += bool(self._loader.strategy.add_entry(dn, attributes, validate=False))
+        return added
+
+    def load_json(self, path: str) -> int:
+        """بارگذاری ورودی‌ها از خروجی JSON ldap3 (Connection.response_to_file یا entries_to_json)"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return self.add_entries((e['dn'], e.get('raw') or e['attributes']) for e in data['entries'])
+
+    def seed(self, users: int = 1000, groups: int = 50, members_per_group: int = 100,
+             nested_every: int = 10, password: str = 'Passw0rd!', seed: int = 1) -> Dict:
+        """کاربران u000001... و گروه‌های g0001... به شکل FreeIPA؛ admins و ipausers همیشه ساخته می‌شوند.
+
+        هر nested_every گروه، گروه قبلی را به عنوان زیرگروه دارد. حدود ۲٪ کاربران قفل، ۵٪ با رمز منقضی،
+        ۵٪ با principal نزدیک به انقضا و ۳٪ با تلاش ناموفق ورود هستند (برای گزارش سلامت).
+        """
+        rnd = random.Random(seed)
+        now = datetime.utcnow()
+        stamp = now.strftime('%Y%m%d%H%M%SZ')
+        uids = [f"u{i:06d}" for i in range(1, users + 1)]
+        members: Dict[str, list] = {'admins': [self.bind_dn], 'ipausers': [self.user_dn(u) for u in uids]}
+        member_of: Dict[str, list] = {u: [self.group_dn('ipausers')] for u in uids}
+        member_of['admin'] = [self.group_dn('admins')]
+        names = [f"g{i:04d}" for i in range(1, groups + 1)]
+        for index, cn in enumerate(names):
+            chosen = rnd.sample(uids, min(members_per_group, len(uids)))
+            members[cn] = [self.user_dn(u) for u in chosen]
+            for u in chosen:
+                member_of[u].append(self.group_dn(cn))
+            if nested_every and index and index % nested_every == 0:
+                members[cn].append(self.group_dn(names[index - 1]))
+
+        def user_entries():
+            for n, uid in enumerate(uids, 1):
+                roll = rnd.random()
+                attrs = {
+                    'uid': uid, 'cn': f"User {n}", 'givenName': 'User', 'sn': str(n),
+                    'mail': f"{uid}@{self.host}", 'mobile': f"0912{n:07d}"[:11],
+                    'uidNumber': str(100000 + n), 'gidNumber': str(100000 + n),
+                    'homeDirectory': f"/home/{uid}", 'loginShell': '/bin/bash',
+                    'objectClass': USER_OBJECT_CLASSES, 'userPassword': password,
+                    'krbPrincipalName': f"{uid}@{self.base_dn.upper()}",
+                    'krbPasswordExpiration': (now + timedelta(days=-3 if roll < 0.05 else 90)).strftime('%Y%m%d%H%M%SZ'),
+                    'nsAccountLock': 'TRUE' if roll > 0.98 else 'FALSE',
+                    'memberOf': member_of[uid], 'modifyTimestamp': stamp,
+                }
+                if 0.05 <= roll < 0.10:
+                    attrs['krbPrincipalExpiration'] = (now + timedelta(days=rnd.randint(1, 10))).strftime('%Y%m%d%H%M%SZ')
+                if 0.10 <= roll < 0.13:
+                    attrs['krbLoginFailedCount'] = str(rnd.randint(1, 6))
+                yield self.user_dn(uid), attrs
+
+        def group_entries():
+            for n, cn in enumerate(['admins', 'ipausers'] + names, 1):
+                yield self.group_dn(cn), {
+                    'cn': cn, 'description': f"Group {cn}", 'gidNumber': str(200000 + n),
+                    'objectClass': GROUP_OBJECT_CLASSES, 'member': members[cn], 'modifyTimestamp': stamp,
+                }
+
+        created_users = self.add_entries(user_entries())
+        created_groups = self.add_entries(group_entries())
+        self.users.update({u: password for u in uids})
+        self.groups.update({cn: len(dns) for cn, dns in members.items()})
+        return {'users': created_users, 'groups': created_groups}
+
+    def app_config(self) -> Dict:
+        """تنظیمات Flask برای اتصال FreeIPAService به این دایرکتوری"""
+        return {
+            'FREEIPA_HOST': self.host,
+            'FREEIPA_PORT': 389,
+            'FREEIPA_USE_SSL': False,
+            'FREEIPA_START_TLS': False,
+            'FREEIPA_BASE_DN': self.base_dn,
+            'FREEIPA_BIND_DN': self.bind_dn,
+            'FREEIPA_BIND_PASSWORD': self.admin_password,
+            'FREEIPA_SCHEMA_CACHE_DIR': '',
+        }
+
+    def install(self):
+        """اتصال‌های freeipa_pool و freeipa_client از این پس به دایرکتوری mock ساخته می‌شوند"""
+        import freeipa_client
+        import freeipa_pool
+        from freeipa_pool import close_pools
+        close_pools()
+        for module in (freeipa_pool, freeipa_client):
+            self._patched.append((module, module.Connection))
+            module.Connection = self.connection
+        return self
+
+    def uninstall(self):
+        from freeipa_pool import close_pools
+        while self._patched:
+            module, original = self._patched.pop()
+            module.Connection = original
+        close_pools()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
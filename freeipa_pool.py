@@ -0,0 +1,233 @@
+"""
+Pool اتصال‌های LDAP ادمین برای سرویس FreeIPA
+
+هر worker برای هر مجموعه تنظیمات یک pool از اتصال‌های bind‌شده نگه می‌دارد تا هر
+عملیات به جای ساخت Server، handshake (TCP/TLS) و bind جدید، اتصال آماده را امانت بگیرد.
+میزبان‌ها در یک ServerPool قرار می‌گیرند؛ اگر یکی در دسترس نباشد اتصال بعدی به
+میزبان دیگر برقرار می‌شود. اتصال‌های بیکار قدیمی دور ریخته و قبل از استفاده مجدد
+با Who Am I بررسی می‌شوند؛ اتصالی که حین عملیات خطا داده باشد دوباره bind می‌شود.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from ldap3 import Server, ServerPool, ALL, FIRST, NONE
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.config import set_config_parameter
+
+from freeipa_metrics import InstrumentedConnection as Connection
+from freeipa_schema import ensure_server_info
+
+logger = logging.getLogger(__name__)
+
+# با active=1 فقط یک دور میزبان‌ها بررسی می‌شوند؛ انتظار پیش‌فرض 10 ثانیه‌ای ldap3
+# بعد از دور ناموفق فقط پاسخ خطا را به تأخیر می‌اندازد
+set_config_parameter('POOLING_LOOP_TIMEOUT', 0)
+
+
+class LDAPPoolError(Exception):
+    """عدم امکان دریافت اتصال از pool (bind ناموفق یا پر بودن pool)"""
+
+
+def split_hosts(value) -> List[str]:
+    """'ipa1.local, ipa2.local' → ['ipa1.local', 'ipa2.local']"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = str(value or '').split(',')
+    return [h.strip() for h in items if h and h.strip()]
+
+
+class LDAPConnectionPool:
+    """Pool امن در برابر thread برای اتصال‌های bind‌شده به FreeIPA"""
+
+    def __init__(self, hosts: List[str], port: int, use_ssl: bool, bind_dn: str, bind_password: str,
+                 size: int = 8, max_idle: float = 300, check_interval: float = 60, wait_timeout: float = 10,
+                 connect_timeout: float = 5, receive_timeout: float = 15, start_tls: bool = True,
+                 schema_dir: Optional[str] = None, schema_max_age: float = 86400, schema_check_interval: float = 3600):
+        if not hosts:
+            raise LDAPPoolError('هیچ میزبان FreeIPA تنظیم نشده است')
+        self.use_ssl = use_ssl
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = max(1, int(size))
+        self.max_idle = float(max_idle)
+        self.check_interval = float(check_interval)
+        self.wait_timeout = float(wait_timeout)
+        self.receive_timeout = receive_timeout
+        self.start_tls = start_tls and not use_ssl
+        self.schema_dir = schema_dir
+        self.schema_max_age = float(schema_max_age)
+        self.schema_check_interval = float(schema_check_interval)
+        # اطلاعات DSA/schema یک بار برای هر Server (از snapshot محلی یا سرور) گرفته و بین اتصال‌ها مشترک می‌شود
+        servers = [Server(h, port=port, use_ssl=use_ssl, get_info=ALL, connect_timeout=connect_timeout) for h in hosts]
+        # با چند میزبان، میزبان از کار افتاده تا 60 ثانیه کنار گذاشته می‌شود
+        exhaust = 60 if len(servers) > 1 else False
+        self.server_pool = ServerPool(servers, FIRST, active=1, exhaust=exhaust)
+        # bind کاربران (ورود، راستی‌آزمایی رمز) به schema نیاز ندارد؛ بدون get_info هیچ bindی DSE/schema نمی‌خواند
+        user_servers = [Server(h, port=port, use_ssl=use_ssl, get_info=NONE, connect_timeout=connect_timeout) for h in hosts]
+        self.user_server_pool = ServerPool(user_servers, FIRST, active=1, exhaust=exhaust)
+        self._idle: List[Tuple[Connection, float]] = []
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self) -> Connection:
+        conn = Connection(self.server_pool, user=self.bind_dn, password=self.bind_password,
+                          receive_timeout=self.receive_timeout)
+        try:
+            # ldap3 به طور پیش‌فرض پس از هر open/StartTLS/bind دوباره DSE و schema را می‌خواند
+            conn.open(read_server_info=False)
+            self._start_tls(conn)
+            bound = conn.bind(read_server_info=False)
+            if bound:
+                ensure_server_info(conn, self.schema_dir, self.schema_max_age, self.schema_check_interval)
+        except Exception:
+            self._discard(conn)
+            raise
+        if not bound:
+            result = conn.result
+            self._discard(conn)
+            raise LDAPPoolError(f"bind ادمین ناموفق بود: {result.get('description') if result else ''}")
+        return conn
+
+    def _start_tls(self, conn: Connection):
+        if self.start_tls:
+            # محرمانگی برای عملیات پسورد؛ در صورت عدم پشتیبانی سرور ادامه بدون TLS
+            try:
+                conn.start_tls(read_server_info=False)
+            except LDAPException as e:
+                logger.warning(f"StartTLS روی {conn.server} انجام نشد: {e}")
+
+    def _forget(self, conn: Connection):
+        # ServerPool برای هر Connection یک state نگه می‌دارد و خودش آن را پاک نمی‌کند
+        self.server_pool.pool_states.pop(conn, None)
+        self.user_server_pool.pool_states.pop(conn, None)
+
+    def _discard(self, conn: Connection):
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+        self._forget(conn)
+
+    @contextmanager
+    def user_connection(self, user: str, password: str):
+        """اتصال مستقل (مثلاً bind با کاربر) روی همان میزبان‌ها؛ خارج از pool و بدون bind خودکار.
+
+        اتصال باز و در صورت تنظیم StartTLS شده تحویل داده می‌شود؛ bind با read_server_info=False
+        انجام شود تا DSE/schema خوانده نشود.
+        """
+        conn = Connection(self.user_server_pool, user=user, password=password, receive_timeout=self.receive_timeout)
+        try:
+            conn.open(read_server_info=False)
+            self._start_tls(conn)
+            yield conn
+        finally:
+            self._discard(conn)
+
+    def _healthy(self, conn: Connection, idle_for: float) -> bool:
+        if conn.closed or not conn.bound:
+            return False
+        if idle_for < self.check_interval:
+            return True
+        try:
+            return bool(conn.extend.standard.who_am_i())
+        except LDAPException:
+            return False
+
+    def acquire(self) -> Connection:
+        """امانت گرفتن یک اتصال bind‌شده؛ در صورت پر بودن pool تا wait_timeout صبر می‌کند"""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise LDAPPoolError('همه اتصال‌های FreeIPA در حال استفاده هستند')
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._open()
+                conn, last_used = item
+                idle_for = time.monotonic() - last_used
+                if idle_for <= self.max_idle and self._healthy(conn, idle_for):
+                    return conn
+                # اتصال کهنه یا قطع‌شده: کنار گذاشتن و bind مجدد با اتصال تازه
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn: Connection, broken: bool = False):
+        """بازگرداندن اتصال؛ اتصال خراب بسته می‌شود تا دفعه بعد دوباره bind شود"""
+        try:
+            if broken or self._closed or conn.closed or not conn.bound:
+                self._discard(conn)
+                return
+            now = time.monotonic()
+            stale = []
+            with self._lock:
+                # LIFO: اتصال‌های ته لیست کمتر استفاده می‌شوند و پس از max_idle آزاد می‌شوند
+                while self._idle and now - self._idle[0][1] > self.max_idle:
+                    stale.append(self._idle.pop(0)[0])
+                self._idle.append((conn, now))
+            for old in stale:
+                self._discard(old)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            idle = len(self._idle)
+        return {'size': self.size, 'idle': idle}
+
+
+_pools: Dict[tuple, LDAPConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(config: Dict, options: Optional[Dict] = None) -> LDAPConnectionPool:
+    """pool مربوط به تنظیمات فعلی؛ با تغییر تنظیمات (صفحه سرور FreeIPA) pool قبلی بسته می‌شود"""
+    options = options or {}
+    hosts = tuple(split_hosts(config['host']))
+    # pid در کلید: پس از fork، worker جدید سوکت‌های والد را استفاده نمی‌کند
+    key = (os.getpid(), hosts, int(config['port']), bool(config['use_ssl']),
+           config['bind_dn'], config['bind_password'], tuple(sorted(options.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            for old in _pools.values():
+                old.close()
+            _pools.clear()
+            pool = LDAPConnectionPool(list(hosts), int(config['port']), bool(config['use_ssl']),
+                                      config['bind_dn'], config['bind_password'], **options)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,518 @@
+"""
+ایجاد گروهی کاربران FreeIPA از فایل Excel/CSV (مشترک بین CLI و وب)
+
+همه ردیف‌ها ابتدا اعتبارسنجی می‌شوند (فیلدهای الزامی، قالب نام کاربری/ایمیل/موبایل،
+تکرار در فایل و وجود گروه‌ها). سپس ردیف‌های معتبر با یک ThreadPool محدود روی
+اتصال‌های pool شده LDAP ایجاد می‌شوند: افزودن entry، تعیین رمز اولیه و عضویت در
+گروه‌ها. کاربران محلی و رمزهای رمزنگاری‌شده همزمان با تکمیل ردیف‌ها در دسته‌های
+STORE_BATCH_SIZE تایی ذخیره می‌شوند تا خطای پایگاه داده رمزهای ساخته‌شده قبلی را از بین
+نبرد؛ اگر ذخیره دسته‌ای ناموفق باشد گزارش آن ردیف‌ها password_stored=False و راهنمای
+بازنشانی رمز دارد (خود رمز هیچ‌وقت در گزارش نمی‌آید). نتیجه هر ردیف همراه با زمان هر
+مرحله در FreeIPAProvisionJob نگه داشته می‌شود. کار با claim اتمیک pending→running شروع
+می‌شود و heartbeat آن (updated_at) با پیشرفت تازه می‌شود؛ recover_stale_provision_jobs فقط
+کارهای با heartbeat کهنه را failed می‌کند و پایان کار وضعیت ثبت‌شده توسط آن را بازنویسی نمی‌کند.
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from flask import current_app
+from ldap3 import MODIFY_ADD
+from ldap3.utils.dn import escape_rdn
+from sqlalchemy import func
+
+from freeipa_service import freeipa_service
+from models import db, FreeIPAUser, FreeIPAProvisionJob, UserPassword
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_PROVISION_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+
+REQUIRED_COLUMNS = ['uid', 'givenname', 'sn', 'mail']
+OPTIONAL_COLUMNS = ['cn', 'mobile', 'password', 'groups']
+# نام‌های جایگزین رایج در فایل‌های ورودی
+COLUMN_ALIASES = {
+    'username': 'uid',
+    'user': 'uid',
+    'first_name': 'givenname',
+    'firstname': 'givenname',
+    'given_name': 'givenname',
+    'last_name': 'sn',
+    'lastname': 'sn',
+    'surname': 'sn',
+    'email': 'mail',
+    'full_name': 'cn',
+    'phone': 'mobile',
+    'group': 'groups',
+}
+
+UID_RE = re.compile(r'^[a-z0-9_.][a-z0-9_.-]{0,31}$')
+MAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+MOBILE_RE = re.compile(r'^\+?\d{7,15}$')
+MIN_PASSWORD_LENGTH = 8
+STORE_BATCH_SIZE = 100
+
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + '!@#$%^&*()'
+
+# یک کار در هر پروسه؛ موازی‌سازی داخل خود کار انجام می‌شود
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freeipa-provision')
+
+# کار pending/running که heartbeat آن (updated_at) در این مدت تازه نشده worker زنده‌ای ندارد
+STALE_HEARTBEAT_SECONDS = 600
+HEARTBEAT_SECONDS = 30
+# کارهای صف‌شده و در حال اجرای همین پروسه؛ heartbeat همه با پیشرفت کار جاری تازه می‌شود
+_owned: Set[int] = set()
+_owned_lock = threading.Lock()
+
+
+def generate_password(length: int = 12) -> str:
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def read_provision_file(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
+    """خواندن فایل به صورت متن (صفرهای ابتدای موبایل حفظ می‌شود)"""
+    if file_path.lower().endswith('.csv'):
+        return pd.read_csv(file_path, dtype=str, keep_default_na=False)
+    return pd.read_excel(file_path, sheet_name=sheet_name or 0, dtype=str, keep_default_na=False)
+
+
+def build_column_map(headers: List) -> Dict[str, str]:
+    """نگاشت نام منطقی ستون → نام ستون در فایل (بدون حساسیت به حروف و فاصله)"""
+    col_map: Dict[str, str] = {}
+    for header in headers:
+        if not isinstance(header, str):
+            continue
+        norm = header.strip().lower().replace(' ', '_')
+        norm = COLUMN_ALIASES.get(norm, norm)
+        if norm in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+            col_map.setdefault(norm, header)
+    return col_map
+
+
+def _split_groups(value: str) -> List[str]:
+    return [g.strip() for g in re.split(r'[,;|]', value or '') if g.strip()]
+
+
+def validate_rows(df: pd.DataFrame, known_groups: Optional[set] = None) -> Tuple[List[Dict], List[Dict]]:
+    """اعتبارسنجی همه ردیف‌ها پیش از هر تغییر؛ خروجی: (ردیف‌های معتبر، نتیجه ردیف‌های نامعتبر)"""
+    col_map = build_column_map(list(df.columns))
+    missing = [c for c in REQUIRED_COLUMNS if c not in col_map]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    def cell(row, name):
+        col = col_map.get(name)
+        if not col:
+            return ''
+        value = row[col]
+        return str(value).strip() if pd.notna(value) else ''
+
+    valid: List[Dict] = []
+    invalid: List[Dict] = []
+    seen: Dict[str, int] = {}
+    for idx, row in df.iterrows():
+        row_no = idx + 2  # شماره ردیف در فایل (با احتساب سطر عنوان)
+        uid = cell(row, 'uid').lower()
+        spec = {
+            'row': row_no,
+            'uid': uid,
+            'givenname': cell(row, 'givenname'),
+            'sn': cell(row, 'sn'),
+            'cn': cell(row, 'cn'),
+            'mail': cell(row, 'mail'),
+            'mobile': re.sub(r'[\s\-()]', '', cell(row, 'mobile')),
+            'password': cell(row, 'password'),
+            'groups': _split_groups(cell(row, 'groups')),
+        }
+        if not any(spec[k] for k in ('uid', 'givenname', 'sn', 'mail')):
+            continue  # ردیف خالی
+        problems = []
+        for name in REQUIRED_COLUMNS:
+            if not spec[name]:
+                problems.append(f'{name} خالی است')
+        if uid and not UID_RE.match(uid):
+            problems.append('نام کاربری نامعتبر است')
+        if spec['mail'] and not MAIL_RE.match(spec['mail']):
+            problems.append('ایمیل نامعتبر است')
+        if spec['mobile'] and not MOBILE_RE.match(spec['mobile']):
+            problems.append('شماره موبایل نامعتبر است')
+        if spec['password'] and len(spec['password']) < MIN_PASSWORD_LENGTH:
+            problems.append(f'رمز کمتر از {MIN_PASSWORD_LENGTH} کاراکتر است')
+        if uid and uid in seen:
+            problems.append(f'نام کاربری تکراری (ردیف {seen[uid]})')
+        if known_groups is not None:
+            unknown = [g for g in spec['groups'] if g not in known_groups]
+            if unknown:
+                problems.append(f"گروه ناموجود: {', '.join(unknown)}")
+        if uid:
+            seen.setdefault(uid, row_no)
+        if problems:
+            invalid.append(_result(spec, 'invalid', '؛ '.join(problems)))
+            continue
+        if not spec['cn']:
+            spec['cn'] = f"{spec['givenname']} {spec['sn']}"
+        valid.append(spec)
+    return valid, invalid
+
+
+def _result(spec: Dict, status: str, message: str = '') -> Dict:
+    return {
+        'row': spec['row'],
+        'uid': spec['uid'],
+        'status': status,  # valid, created, partial, exists, invalid, failed
+        'message': message,
+        'groups': [],
+        'password_set': False,
+        'password_stored': False,
+        'ms': 0,
+    }
+
+
+def _provision_row(app, spec: Dict) -> Tuple[Dict, Optional[Dict]]:
+    """ایجاد یک کاربر در FreeIPA (در thread کارگر)؛ خروجی: (نتیجه ردیف، رکورد ذخیره محلی)"""
+    started = time.perf_counter()
+    result = _result(spec, 'failed')
+    record = None
+    with app.app_context():
+        try:
+            uid = spec['uid']
+            password = spec['password'] or generate_password()
+            user_dn, attrs = freeipa_service.build_user_entry(
+                uid, spec['givenname'], spec['sn'], spec['cn'], spec['mail'], spec['mobile'] or None)
+            with freeipa_service._admin_connection() as conn:
+                if conn is None:
+                    result['message'] = 'اتصال به FreeIPA برقرار نشد'
+                    return result, None
+                if not conn.add(user_dn, attributes=attrs):
+                    err = conn.result or {}
+                    if err.get('description') == 'entryAlreadyExists':
+                        result['status'] = 'exists'
+                        result['message'] = 'کاربر از قبل وجود دارد'
+                    else:
+                        result['message'] = f"ایجاد ناموفق: {err.get('description')} {err.get('message') or ''}".strip()
+                    return result, None
+
+            problems = []
+            pwd_ok, pwd_msg = freeipa_service.set_user_password(uid, password)
+            result['password_set'] = bool(pwd_ok)
+            if not pwd_ok:
+                problems.append(f'رمز: {pwd_msg}')
+
+            if spec['groups']:
+                base_dn = freeipa_service._get_config()['base_dn']
+                with freeipa_service._admin_connection() as conn:
+                    if conn is None:
+                        problems.append('عضویت گروه‌ها: اتصال برقرار نشد')
+                    else:
+                        for group_cn in spec['groups']:
+                            group_dn = f"cn={escape_rdn(group_cn)},cn=groups,cn=accounts,{base_dn}"
+                            if conn.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]}):
+                                result['groups'].append(group_cn)
+                            else:
+                                problems.append(f"گروه {group_cn}: {(conn.result or {}).get('description')}")
+                freeipa_service.invalidate_user(uid)
+
+            result['status'] = 'partial' if problems else 'created'
+            result['message'] = '؛ '.join(problems)
+            record = {
+                'uid': uid,
+                'cn': spec['cn'],
+                'sn': spec['sn'],
+                'givenname': spec['givenname'],
+                'mail': spec['mail'],
+                'mobile': spec['mobile'] or None,
+                'home_directory': attrs['homeDirectory'],
+                # رمزنگاری (یا هش در نبود کلید) هم در thread کارگر انجام می‌شود
+                'password': UserPassword.encrypt_value(password) if pwd_ok else None,
+            }
+        except Exception as e:
+            logger.error(f"Provisioning {spec['uid']} failed: {e}")
+            result['status'] = 'failed'
+            result['message'] = str(e)
+        finally:
+            result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result, record
+
+
+def store_records(records: List[Dict], created_by: int, batch_size: int = 500) -> int:
+    """ذخیره دسته‌ای کاربران محلی و رمزهای اولیه رمزنگاری‌شده"""
+    if not created_by:
+        raise ValueError('ایجادکننده رمزهای اولیه (created_by) مشخص نشده است')
+    stored = 0
+    now = datetime.utcnow()
+    for start in range(0, len(records), batch_size):
+        chunk = records[start:start + batch_size]
+        existing = dict(db.session.query(FreeIPAUser.uid, FreeIPAUser.id)
+                        .filter(FreeIPAUser.uid.in_([r['uid'] for r in chunk])).all())
+        inserts: List[Dict] = []
+        updates: List[Dict] = []
+        for rec in chunk:
+            values = {k: rec[k] for k in ('uid', 'cn', 'sn', 'givenname', 'mail', 'mobile', 'home_directory')}
+            values.update({'is_active': True, 'is_deleted': False, 'updated_at': now, 'last_sync': now})
+            if rec['uid'] in existing:
+                values['id'] = existing[rec['uid']]
+                updates.append(values)
+            else:
+                values['created_at'] = now
+                inserts.append(values)
+        if inserts:
+            db.session.bulk_insert_mappings(FreeIPAUser, inserts, return_defaults=True)
+            existing.update({m['uid']: m['id'] for m in inserts})
+        if updates:
+            db.session.bulk_update_mappings(FreeIPAUser, updates)
+        passwords = [{
+            'user_id': existing[rec['uid']],
+            'password': rec['password'],
+            'password_type': 'initial',
+            'created_by': created_by,
+            'created_at': now,
+        } for rec in chunk if rec['password']]
+        if passwords:
+            db.session.bulk_insert_mappings(UserPassword, passwords)
+        db.session.commit()
+        stored += len(chunk)
+    return stored
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def provision_users_frame(
+    df: pd.DataFrame,
+    dry_run: bool,
+    created_by: Optional[int] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Tuple[Dict[str, int], List[Dict], Dict]:
+    """اعتبارسنجی و ایجاد کاربران (نیازمند app context)؛ خروجی: (شمارنده‌ها، گزارش ردیف‌ها، زمان‌ها)"""
+    app = current_app._get_current_object()
+    total_started = time.perf_counter()
+    stats = {'processed': 0, 'created': 0, 'existing': 0, 'invalid': 0, 'failed': 0}
+
+    groups = freeipa_service.get_all_groups() if not df.empty else []
+    valid, invalid = validate_rows(df, known_groups={g['cn'] for g in groups if g.get('cn')})
+    validate_ms = (time.perf_counter() - total_started) * 1000
+    stats['invalid'] = len(invalid)
+    stats['processed'] = len(invalid)
+    report: List[Dict] = list(invalid)
+
+    if dry_run:
+        report.extend(_result(spec, 'valid') for spec in valid)
+        stats['processed'] += len(valid)
+        report.sort(key=lambda r: r['row'])
+        return stats, report, {'validate_ms': round(validate_ms, 1), 'rows': len(report)}
+
+    if not created_by:
+        # رمزهای اولیه باید به کاربر واقعی ایجادکننده نسبت داده شوند
+        raise ValueError('ایجادکننده (created_by) برای ایجاد کاربران لازم است')
+    if workers is None:
+        workers = int(app.config.get('FREEIPA_PROVISION_WORKERS', 4))
+    # هر کارگر حداکثر یک اتصال pool را همزمان نگه می‌دارد
+    workers = max(1, min(workers, int(app.config.get('FREEIPA_POOL_SIZE', 8)), len(valid) or 1))
+
+    pending: List[Tuple[Dict, Dict]] = []
+    stored_any = False
+    db_seconds = 0.0
+
+    def flush():
+        nonlocal stored_any, db_seconds
+        if not pending:
+            return
+        db_started = time.perf_counter()
+        try:
+            store_records([record for _, record in pending], created_by)
+            stored = True
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Storing {len(pending)} provisioned user(s) failed: {e}")
+            stored = False
+        db_seconds += time.perf_counter() - db_started
+        for result, _ in pending:
+            result['password_stored'] = stored and result['password_set']
+            if stored:
+                continue
+            hint = 'ذخیره محلی ناموفق'
+            if result['password_set']:
+                hint += '؛ رمز اولیه در FreeIPA تنظیم شد ولی نگه داشته نشد و باید بازنشانی شود'
+            result['message'] = '؛ '.join(m for m in (result['message'], hint) if m)
+            if result['status'] == 'created':
+                result['status'] = 'partial'
+                stats['failed'] += 1
+        stored_any = stored_any or stored
+        pending.clear()
+
+    ldap_started = time.perf_counter()
+    last_progress = ldap_started
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='freeipa-provision-row') as pool:
+        futures = [pool.submit(_provision_row, app, spec) for spec in valid]
+        for future in as_completed(futures):
+            result, record = future.result()
+            report.append(result)
+            stats['processed'] += 1
+            if result['status'] in ('created', 'partial'):
+                stats['created'] += 1
+            elif result['status'] == 'exists':
+                stats['existing'] += 1
+            if result['status'] in ('failed', 'partial'):
+                stats['failed'] += 1
+            if record:
+                pending.append((result, record))
+                if len(pending) >= STORE_BATCH_SIZE:
+                    flush()
+            if progress and time.perf_counter() - last_progress >= 1:
+                progress(stats)
+                last_progress = time.perf_counter()
+        flush()
+    ldap_seconds = time.perf_counter() - ldap_started - db_seconds
+    db_ms = db_seconds * 1000
+    if stored_any:
+        freeipa_service.invalidate_groups()
+
+    report.sort(key=lambda r: r['row'])
+    row_ms = [r['ms'] for r in report if r['status'] not in ('invalid', 'valid')]
+    total_seconds = time.perf_counter() - total_started
+    timings = {
+        'workers': workers,
+        'rows': len(report),
+        'validate_ms': round(validate_ms, 1),
+        'ldap_ms': round(ldap_seconds * 1000, 1),
+        'db_ms': round(db_ms, 1),
+        'total_ms': round(total_seconds * 1000, 1),
+        'users_per_second': round(len(row_ms) / ldap_seconds, 2) if ldap_seconds > 0 and row_ms else 0,
+        'row_p50_ms': _percentile(row_ms, 50),
+        'row_p95_ms': _percentile(row_ms, 95),
+    }
+    if progress:
+        progress(stats)
+    return stats, report, timings
+
+
+def provision_users(
+    file_path: str,
+    sheet_name: Optional[str],
+    dry_run: bool,
+    created_by: Optional[int] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Tuple[Dict[str, int], List[Dict], Dict]:
+    """خواندن فایل و ایجاد کاربران (نیازمند app context)"""
+    df = read_provision_file(file_path, sheet_name)
+    return provision_users_frame(df, dry_run=dry_run, created_by=created_by, workers=workers, progress=progress)
+
+
+def _heartbeat():
+    """تازه کردن updated_at کارهای این پروسه (نیازمند app context؛ commit با فراخواننده)"""
+    with _owned_lock:
+        ids = list(_owned)
+    if ids:
+        FreeIPAProvisionJob.query.filter(
+            FreeIPAProvisionJob.id.in_(ids), FreeIPAProvisionJob.status.in_(['pending', 'running'])
+        ).update({'updated_at': datetime.utcnow()}, synchronize_session=False)
+
+
+def recover_stale_provision_jobs() -> int:
+    """کارهای pending/running با heartbeat کهنه (worker از کار افتاده) را failed می‌کند"""
+    now = datetime.utcnow()
+    heartbeat = func.coalesce(FreeIPAProvisionJob.updated_at, FreeIPAProvisionJob.started_at,
+                              FreeIPAProvisionJob.created_at)
+    stale = heartbeat < now - timedelta(seconds=STALE_HEARTBEAT_SECONDS)
+    recovered = FreeIPAProvisionJob.query.filter(FreeIPAProvisionJob.status == 'running', stale).update(
+        {'status': 'failed', 'finished_at': now,
+         'error_message': 'کار ایجاد گروهی متوقف شد (worker پیش از پایان از کار افتاد)'}, synchronize_session=False)
+    recovered += FreeIPAProvisionJob.query.filter(FreeIPAProvisionJob.status == 'pending', stale).update(
+        {'status': 'failed', 'finished_at': now,
+         'error_message': 'کار ایجاد گروهی هرگز شروع نشد (worker پیش از اجرا از کار افتاد)'}, synchronize_session=False)
+    db.session.commit()
+    if recovered:
+        logger.warning(f"Marked {recovered} stale FreeIPA provision job(s) as failed")
+    return recovered
+
+
+def enqueue_provision_job(app, job_id: int):
+    """ارسال کار ایجاد گروهی به worker پس‌زمینه"""
+    with _owned_lock:
+        _owned.add(job_id)
+    return _executor.submit(_run_provision_job, app, job_id)
+
+
+def _run_provision_job(app, job_id: int):
+    with app.app_context():
+        # claim اتمیک: کاری که در این فاصله failed (رهاشده) علامت خورده دوباره اجرا نمی‌شود
+        now = datetime.utcnow()
+        claimed = FreeIPAProvisionJob.query.filter_by(id=job_id, status='pending').update(
+            {'status': 'running', 'started_at': now, 'updated_at': now}, synchronize_session=False)
+        db.session.commit()
+        job = FreeIPAProvisionJob.query.get(job_id)
+        if not job or not claimed:
+            with _owned_lock:
+                _owned.discard(job_id)
+            db.session.remove()
+            return
+        file_path = job.file_path
+        last_beat = time.monotonic()
+
+        def progress(stats: Dict[str, int]):
+            nonlocal last_beat
+            for key, value in stats.items():
+                setattr(job, key, value)
+            if time.monotonic() - last_beat >= HEARTBEAT_SECONDS:
+                _heartbeat()
+                last_beat = time.monotonic()
+            db.session.commit()
+
+        details: Dict = {}
+        final: Dict = {}
+        try:
+            df = read_provision_file(file_path, job.sheet_name)
+            max_rows = int(app.config.get('FREEIPA_PROVISION_MAX_ROWS', 5000))
+            if len(df) > max_rows:
+                raise ValueError(f'تعداد ردیف‌ها ({len(df)}) بیشتر از حد مجاز {max_rows} است')
+            job.total = len(df)
+            _heartbeat()
+            db.session.commit()
+            connected, message = freeipa_service.test_connection()
+            if not connected:
+                raise RuntimeError(message)
+            stats, report, timings = provision_users_frame(
+                df, dry_run=bool(job.dry_run), created_by=job.created_by, progress=progress)
+            progress(stats)
+            details = {'report': json.dumps(report, ensure_ascii=False), 'timings': json.dumps(timings)}
+            final = {'status': 'completed'}
+        except Exception as e:
+            logger.error(f"FreeIPA provision job {job_id} failed: {e}")
+            db.session.rollback()
+            final = {'status': 'failed', 'error_message': str(e)}
+        finally:
+            final['finished_at'] = datetime.utcnow()
+            try:
+                if details:
+                    FreeIPAProvisionJob.query.filter_by(id=job_id).update(details, synchronize_session=False)
+                # وضعیتی که recover_stale_provision_jobs در این فاصله ثبت کرده بازنویسی نمی‌شود
+                if not FreeIPAProvisionJob.query.filter_by(id=job_id, status='running').update(
+                        final, synchronize_session=False):
+                    logger.warning(f"FreeIPA provision job {job_id} was no longer running; status left unchanged")
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+            with _owned_lock:
+                _owned.discard(job_id)
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            except Exception:
+                pass
+            db.session.remove()
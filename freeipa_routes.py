@@ -6,13 +6,61 @@ from flask import Blueprint, render_template, request, jsonify, flash, redirect,
 from flask_login import current_user
 from datetime import datetime, timedelta
 from freeipa_service import freeipa_service
+from freeipa_sync import (enqueue_sync, get_state, mirror_ready, search_mirror_groups, search_mirror_users,
+                          update_mirror_user)
+from freeipa_provision import ALLOWED_PROVISION_EXTENSIONS, enqueue_provision_job, recover_stale_provision_jobs
+from freeipa_health import health_report
+from freeipa_hosts import enqueue_host_sync, get_host_sync_state
+from freeipa_access import access_index, enqueue_access_sync, get_access_state
+from freeipa_metrics import configure as configure_ldap_metrics, ldap_metrics, request_summary
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 # ایجاد Blueprint
 freeipa_bp = Blueprint('freeipa', __name__, url_prefix='/freeipa')
 
+def _list_args():
+    """پارامترهای صفحه‌بندی و جستجوی لیست‌ها: (q, page, per_page)"""
+    from flask import current_app
+    q = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int) or 1)
+    default_per_page = current_app.config.get('FREEIPA_LIST_PER_PAGE', 50)
+    per_page = min(200, max(1, request.args.get('per_page', default_per_page, type=int) or default_per_page))
+    return q, page, per_page
+
+def _use_mirror():
+    """لیست‌ها از آینه محلی خوانده شوند؟ (source=ldap برای خواندن مستقیم از دایرکتوری)"""
+    from flask import current_app
+    if request.args.get('source') == 'ldap' or not current_app.config.get('FREEIPA_MIRROR_READS', True):
+        return False
+    try:
+        return mirror_ready()
+    except Exception:
+        return False
+
+@freeipa_bp.record_once
+def _configure_ldap_metrics(state):
+    configure_ldap_metrics(state.app.config.get('FREEIPA_LDAP_METRICS', True),
+                           state.app.config.get('FREEIPA_LDAP_SLOW_MS', 500))
+
+@freeipa_bp.after_request
+def _log_ldap_cost(response):
+    """هزینه LDAP هر صفحه /freeipa/*: لاگ ساخت‌یافته، histogram endpoint و هدر Server-Timing"""
+    summary = request_summary()
+    if summary:
+        endpoint = request.endpoint or request.path
+        ldap_metrics.record_request(endpoint, summary['ms'], summary['count'])
+        logging.getLogger('freeipa.ldap').info(json.dumps({
+            'ts': round(time.time(), 3), 'event': 'ldap_request', 'endpoint': endpoint, 'path': request.path,
+            'status': response.status_code, 'ldap_ms': summary['ms'], 'ldap_ops': summary['count'],
+            'operations': summary['operations'],
+        }, ensure_ascii=False))
+        response.headers.add('Server-Timing', f'ldap;dur={summary["ms"]};desc="{summary["count"]} ops"')
+    return response
+
 @freeipa_bp.before_request
 def _require_login_for_freeipa():
     try:
@@ -45,8 +93,14 @@ def test_connection():
 def list_users():
     """لیست کاربران FreeIPA"""
     try:
-        users = freeipa_service.get_all_users()
-        return render_template('freeipa/users.html', users=users)
+        q, page, per_page = _list_args()
+        mirror = _use_mirror()
+        if mirror:
+            result = search_mirror_users(q, page, per_page)
+        else:
+            result = freeipa_service.search_users(q, page, per_page)
+        return render_template('freeipa/users.html', users=result['items'], pagination=result, q=q,
+                               source='mirror' if mirror else 'ldap', sync_state=get_state() if mirror else None)
     except Exception as e:
         flash(f'خطا در دریافت لیست کاربران: {e}', 'error')
         return redirect(url_for('index'))
@@ -157,14 +211,16 @@ def delete_user_action(username):
     try:
         # حذف از LDAP
         cfg = freeipa_service._get_config()
-        from ldap3 import SUBTREE
-        conn = freeipa_service._get_connection()
-        if not conn or not conn.bind():
-            flash('اتصال به FreeIPA برقرار نشد', 'error')
-            return redirect(url_for('freeipa.list_users'))
-        user_dn = f"uid={username},cn=users,cn=accounts,{cfg['base_dn']}"
-        ok = conn.delete(user_dn)
-        conn.unbind()
+        with freeipa_service._admin_connection() as conn:
+            if conn is None:
+                flash('اتصال به FreeIPA برقرار نشد', 'error')
+                return redirect(url_for('freeipa.list_users'))
+            user_dn = f"uid={username},cn=users,cn=accounts,{cfg['base_dn']}"
+            ok = conn.delete(user_dn)
+        if ok:
+            update_mirror_user(username, is_active=False, is_deleted=True)
+        freeipa_service.invalidate_user(username)
+        freeipa_service.invalidate_groups()
         flash('کاربر حذف شد' if ok else 'حذف کاربر ناموفق بود', 'success' if ok else 'error')
     except Exception as e:
         flash(f'خطا: {e}', 'error')
@@ -174,6 +230,8 @@ def delete_user_action(username):
 def enable_user_action(username):
     try:
         ok = freeipa_service.enable_user(username)
+        if ok:
+            update_mirror_user(username, is_active=True)
         flash('کاربر فعال شد' if ok else 'خطا در فعال‌سازی کاربر', 'success' if ok else 'error')
     except Exception as e:
         flash(f'خطا: {e}', 'error')
@@ -183,6 +241,8 @@ def enable_user_action(username):
 def disable_user_action(username):
     try:
         ok = freeipa_service.disable_user(username)
+        if ok:
+            update_mirror_user(username, is_active=False)
         flash('کاربر غیرفعال شد' if ok else 'خطا در غیرفعال‌سازی کاربر', 'success' if ok else 'error')
     except Exception as e:
         flash(f'خطا: {e}', 'error')
@@ -192,6 +252,8 @@ def disable_user_action(username):
 def unlock_user_action(username):
     try:
         ok = freeipa_service.unlock_user(username)
+        if ok:
+            update_mirror_user(username, is_active=True)
         flash('قفل کاربر باز شد' if ok else 'خطا در Unlock کاربر', 'success' if ok else 'error')
     except Exception as e:
         flash(f'خطا: {e}', 'error')
@@ -201,6 +263,8 @@ def unlock_user_action(username):
 def lock_user_action(username):
     try:
         ok = freeipa_service.lock_user(username)
+        if ok:
+            update_mirror_user(username, is_active=False)
         flash('کاربر قفل شد' if ok else 'خطا در Lock کاربر', 'success' if ok else 'error')
     except Exception as e:
         flash(f'خطا: {e}', 'error')
@@ -210,12 +274,33 @@ def lock_user_action(username):
 def groups():
     """نمایش گروه‌ها (الگو موجود)"""
     try:
-        groups = freeipa_service.get_all_groups()
-        return render_template('freeipa/groups.html', groups=groups)
+        q, page, per_page = _list_args()
+        mirror = _use_mirror()
+        if mirror:
+            result = search_mirror_groups(q, page, per_page)
+        else:
+            result = freeipa_service.search_groups(q, page, per_page)
+        return render_template('freeipa/groups.html', groups=result['items'], pagination=result, q=q,
+                               source='mirror' if mirror else 'ldap', sync_state=get_state() if mirror else None)
     except Exception as e:
         flash(f'خطا در نمایش گروه‌ها: {e}', 'error')
         return redirect(url_for('freeipa.dashboard'))
 
+@freeipa_bp.route('/group/<group_cn>')
+def group_info(group_cn):
+    """اطلاعات گروه و اعضای آن به صورت صفحه‌بندی‌شده"""
+    try:
+        group = freeipa_service.get_group(group_cn)
+        if not group:
+            flash(f'گروه {group_cn} یافت نشد', 'error')
+            return redirect(url_for('freeipa.groups'))
+        _, page, per_page = _list_args()
+        result = freeipa_service.search_group_members(group['cn'], page, per_page)
+        return render_template('freeipa/group_info.html', group=group, members=result['items'], pagination=result)
+    except Exception as e:
+        flash(f'خطا در دریافت اعضای گروه: {e}', 'error')
+        return redirect(url_for('freeipa.groups'))
+
 @freeipa_bp.route('/groups/add', methods=['GET'])
 def add_group():
     """افزودن گروه (فرم نمایشی)"""
@@ -255,65 +340,53 @@ def add_user():
         # ایجاد کاربر در FreeIPA با ldap3
         from ldap3 import MODIFY_ADD
         cfg = freeipa_service._get_config()
-        server = freeipa_service._get_connection().server
-        conn = freeipa_service._get_connection()
-        if not conn or not conn.bind():
-            flash('اتصال به FreeIPA برقرار نشد', 'error')
-            return redirect(url_for('freeipa.add_user'))
+        user_dn, attrs = freeipa_service.build_user_entry(uid, givenname, sn, cn, mail, mobile)
 
-        user_dn = f"uid={uid},cn=users,cn=accounts,{cfg['base_dn']}"
-        attrs = {
-            'objectClass': ['inetOrgPerson', 'posixAccount', 'top', 'person', 'organizationalPerson', 'krbPrincipalAux', 'inetUser'],
-            'uid': uid,
-            'cn': cn,
-            'sn': sn,
-            'givenName': givenname,
-            'mail': mail,
-            'loginShell': '/bin/bash',
-            'homeDirectory': f"/home/{uid}",
-            'uidNumber': '10000',
-            'gidNumber': '10000',
-            'krbPrincipalName': f"{uid}@{cfg['base_dn'].replace('dc=','').replace(',', '.').upper()}"
-        }
-        if mobile:
-            attrs['mobile'] = mobile
-
-        ok = conn.add(user_dn, attributes=attrs)
-        if not ok:
+        with freeipa_service._admin_connection() as conn:
+            if conn is None:
+                flash('اتصال به FreeIPA برقرار نشد', 'error')
+                return redirect(url_for('freeipa.add_user'))
+            ok = conn.add(user_dn, attributes=attrs)
             err = conn.result or {}
-            conn.unbind()
+        if not ok:
             flash(f"خطا در ایجاد کاربر: {err}", 'error')
             return redirect(url_for('freeipa.add_user'))
 
         # ست‌کردن رمز با RFC 3062 تا اجبار تغییر فعال نشود
+        # (اتصال ایجاد کاربر قبل از این مرحله به pool برگشته است)
         try:
             pwd_ok, pwd_msg = freeipa_service.set_user_password(uid, password)
             if not pwd_ok:
-                conn.unbind()
                 flash(f"کاربر ایجاد شد ولی خطا در تعیین رمز: {pwd_msg}", 'error')
                 return redirect(url_for('freeipa.list_users'))
         except Exception as ex:
-            conn.unbind()
             flash(f"کاربر ایجاد شد ولی خطا در تعیین رمز: {ex}", 'error')
             return redirect(url_for('freeipa.list_users'))
 
         # افزودن به گروه‌ها
-        for cn_group in selected_groups:
-            group_dn = f"cn={cn_group},cn=groups,cn=accounts,{cfg['base_dn']}"
-            conn.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]})
+        added_groups = []
+        if selected_groups:
+            with freeipa_service._admin_connection() as conn:
+                if conn is not None:
+                    for cn_group in selected_groups:
+                        group_dn = f"cn={cn_group},cn=groups,cn=accounts,{cfg['base_dn']}"
+                        if conn.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]}):
+                            added_groups.append(cn_group)
+
+        freeipa_service.invalidate_user(uid)
+        freeipa_service.invalidate_groups()
 
         # تنظیم پسورد Kerberos (اختیاری)
         # در صورت نیاز: conn.extend.novell.set_password(user_dn, password)
 
-        conn.unbind()
-
         # ذخیره پسورد برای SMS در DB (متن‌واضح برای ارسال بعدی)
-        from models import db, FreeIPAUser, UserPassword
+        # ردیف آینه همان لحظه به‌روز می‌شود تا کاربر تا sync بعدی در لیست کاربران دیده شود
+        from models import db, FreeIPAGroup, FreeIPAUser, FreeIPAUserGroup, UserPassword
+        now = datetime.utcnow()
         freeipa_user = FreeIPAUser.query.filter_by(uid=uid).first()
         if not freeipa_user:
             freeipa_user = FreeIPAUser(uid=uid, cn=cn, sn=sn, givenname=givenname, mail=mail, mobile=mobile)
             db.session.add(freeipa_user)
-            db.session.flush()
         else:
             # به‌روزرسانی اطلاعات در صورت تغییر
             freeipa_user.cn = cn
@@ -321,6 +394,16 @@ def add_user():
             freeipa_user.givenname = givenname
             freeipa_user.mail = mail
             freeipa_user.mobile = mobile
+        freeipa_user.home_directory = attrs['homeDirectory']
+        freeipa_user.is_active = True
+        freeipa_user.is_deleted = False
+        freeipa_user.last_sync = now
+        db.session.flush()
+        if added_groups:
+            linked = {row[0] for row in db.session.query(FreeIPAUserGroup.group_id).filter_by(user_id=freeipa_user.id)}
+            for group in FreeIPAGroup.query.filter(FreeIPAGroup.cn.in_(added_groups)):
+                if group.id not in linked:
+                    db.session.add(FreeIPAUserGroup(user_id=freeipa_user.id, group_id=group.id))
 
         up = UserPassword(user_id=freeipa_user.id, password_type='initial', created_by=1)  # TODO: current_user.id
         up.set_password(password)
@@ -454,14 +537,484 @@ def api_test_connection():
             'message': str(e)
         }), 500
 
+@freeipa_bp.route('/sync', methods=['POST'])
+def sync_directory():
+    """اجرای همگام‌سازی آینه محلی در پس‌زمینه (full=1 برای دور کامل)"""
+    from flask import current_app
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند همگام‌سازی را اجرا کند', 'error')
+        return redirect(url_for('freeipa.list_users'))
+    try:
+        full = True if request.form.get('full') in ['1', 'true', 'on'] else None
+        enqueue_sync(current_app._get_current_object(), full=full)
+        flash('همگام‌سازی دایرکتوری در پس‌زمینه آغاز شد', 'success')
+    except Exception as e:
+        flash(f'خطا در شروع همگام‌سازی: {e}', 'error')
+    return redirect(request.referrer or url_for('freeipa.list_users'))
+
+@freeipa_bp.route('/api/sync/status')
+def api_sync_status():
+    """وضعیت آخرین همگام‌سازی آینه محلی"""
+    try:
+        return jsonify({'success': True, 'sync': get_state().to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/hosts/sync', methods=['POST'])
+def sync_hosts():
+    """همگام‌سازی hostهای FreeIPA با فهرست سرورها در پس‌زمینه"""
+    from flask import current_app
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند همگام‌سازی را اجرا کند', 'error')
+        return redirect(url_for('servers'))
+    try:
+        enqueue_host_sync(current_app._get_current_object())
+        flash('همگام‌سازی hostهای FreeIPA در پس‌زمینه آغاز شد', 'success')
+    except Exception as e:
+        flash(f'خطا در شروع همگام‌سازی: {e}', 'error')
+    return redirect(request.referrer or url_for('servers'))
+
+@freeipa_bp.route('/api/hosts/sync/status')
+def api_host_sync_status():
+    """وضعیت آخرین همگام‌سازی hostها"""
+    try:
+        return jsonify({'success': True, 'sync': get_host_sync_state().to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def _access_matrix():
+    from flask import current_app
+    return access_index.get(current_app._get_current_object(),
+                            check_interval=current_app.config.get('FREEIPA_ACCESS_CHECK_INTERVAL', 30),
+                            refresh_interval=current_app.config.get('FREEIPA_ACCESS_REFRESH_INTERVAL', 300))
+
+@freeipa_bp.route('/access/sync', methods=['POST'])
+def sync_access():
+    """بازسازی ماتریس دسترسی HBAC/sudo در پس‌زمینه (full=1 بدون بررسی تغییرات)"""
+    from flask import current_app
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند همگام‌سازی را اجرا کند', 'error')
+        return redirect(url_for('servers'))
+    try:
+        full = True if request.form.get('full') in ['1', 'true', 'on'] else None
+        enqueue_access_sync(current_app._get_current_object(), full=full)
+        flash('همگام‌سازی ماتریس دسترسی در پس‌زمینه آغاز شد', 'success')
+    except Exception as e:
+        flash(f'خطا در شروع همگام‌سازی: {e}', 'error')
+    return redirect(request.referrer or url_for('servers'))
+
+@freeipa_bp.route('/api/access/status')
+def api_access_status():
+    """وضعیت آخرین همگام‌سازی ماتریس دسترسی"""
+    try:
+        matrix = _access_matrix()
+        return jsonify({'success': True, 'sync': get_access_state().to_dict(),
+                        'matrix': matrix.stats() if matrix else None})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/access/host/<fqdn>')
+def api_host_access(fqdn):
+    """کاربرانی که طبق HBAC/sudo به host دسترسی دارند (uid=... برای بررسی یک کاربر)"""
+    try:
+        matrix = _access_matrix()
+        uid = request.args.get('uid', '').strip()
+        if uid:
+            return jsonify({'success': True, 'host': fqdn.lower(), 'uid': uid,
+                            'hbac': matrix.can_access(uid, fqdn, 'hbac'),
+                            'sudo': matrix.can_access(uid, fqdn, 'sudo')})
+        return jsonify({'success': True, 'host': fqdn.lower(), 'version': matrix.version, **matrix.for_host(fqdn)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/access/server/<int:server_id>')
+def api_server_access(server_id):
+    """دسترسی HBAC/sudo یک سرور فهرست (host پیوندشده یا نام سرور)"""
+    from models import Server
+    server = Server.query.get_or_404(server_id)
+    return api_host_access((server.freeipa_fqdn or server.name or '').strip())
+
+@freeipa_bp.route('/api/access/user/<uid>')
+def api_user_access(uid):
+    """hostهایی که کاربر طبق HBAC/sudo به آن‌ها دسترسی دارد"""
+    try:
+        matrix = _access_matrix()
+        return jsonify({'success': True, 'uid': uid.lower(), 'version': matrix.version, **matrix.for_user(uid)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/metrics')
+def api_ldap_metrics():
+    """histogram عملیات LDAP و هزینه LDAP هر endpoint در این worker (format=prometheus، reset=1)"""
+    from flask import Response
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    if request.args.get('format') == 'prometheus':
+        return Response(ldap_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+    snapshot = ldap_metrics.snapshot()
+    try:
+        snapshot['pool'] = freeipa_service._pool().stats()
+    except Exception:
+        snapshot['pool'] = None
+    if request.args.get('reset') in ['1', 'true']:
+        ldap_metrics.reset()
+    return jsonify({'success': True, 'metrics': snapshot})
+
+@freeipa_bp.route('/api/sms/send', methods=['POST'])
+def api_send_sms():
+    """ثبت پیامک برای یک کاربر در صف ارسال؛ پاسخ بدون انتظار برای ارائه‌دهنده (202)"""
+    from models import FreeIPAUser
+    from sms_queue import enqueue_sms
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    data = request.get_json(silent=True) or request.form
+    username = (data.get('username') or '').strip()
+    message = (data.get('message') or '').strip()
+    if not username or not message:
+        return jsonify({'success': False, 'message': 'username و message الزامی است'}), 400
+    user = FreeIPAUser.query.filter_by(uid=username).first()
+    phone = (data.get('phone') or (user.mobile if user else '') or '').strip()
+    if user is None or not phone:
+        return jsonify({'success': False, 'message': 'کاربر یا شماره موبایل یافت نشد'}), 404
+    try:
+        log = enqueue_sms(user.id, phone, message, provider=data.get('provider') or None)
+        return jsonify({'success': True, 'sms': log.to_dict()}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/sms/bulk', methods=['POST'])
+def api_send_sms_bulk():
+    """ارسال گروهی: {'recipients': [{'username', 'message'}]} یا {'usernames': [...], 'message': '...'}؛ شناسه صف هر گیرنده
+
+    پیام‌ها فقط در صف ثبت می‌شوند (pending) و کارگرهای sms_queue آن‌ها را با endpoint گروهی
+    ارائه‌دهنده ارسال می‌کنند؛ وضعیت هر پیام از /api/sms/<id> قابل پیگیری است.
+
+    با template_id به جای message، متن هر گیرنده از قالب کامپایل‌شده با متغیرهای کاربر،
+    context مشترک و context هر گیرنده ساخته می‌شود.
+    """
+    from flask import current_app
+    from models import FreeIPAUser, SMSTemplate
+    from sms_queue import enqueue_bulk
+    from sms_templates import TemplateError, template_cache, user_context
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    data = request.get_json(silent=True) or {}
+    compiled = None
+    if data.get('template_id'):
+        try:
+            template = SMSTemplate.query.get(int(data['template_id']))
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        if template is None:
+            return jsonify({'success': False, 'message': 'قالب پیامک یافت نشد'}), 404
+        if not template.is_active:
+            return jsonify({'success': False, 'message': 'قالب پیامک غیرفعال است'}), 400
+        try:
+            compiled = template_cache.get(template)
+        except TemplateError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+    items = data.get('recipients') or [{'username': u, 'message': data.get('message')} for u in data.get('usernames') or []]
+    items = [i for i in items if isinstance(i, dict) and (i.get('username') or '').strip()
+             and (compiled is not None or (i.get('message') or '').strip())]
+    if not items:
+        return jsonify({'success': False, 'message': 'گیرنده‌ای مشخص نشده است'}), 400
+    if len(items) > current_app.config.get('SMS_BULK_MAX', 1000):
+        return jsonify({'success': False, 'message': 'تعداد گیرندگان بیش از حد مجاز است'}), 400
+    usernames = {i['username'].strip() for i in items}
+    users = {u.uid: u for u in FreeIPAUser.query.filter(FreeIPAUser.uid.in_(usernames))}
+    recipients, skipped, contexts = [], [], []
+    for item in items:
+        user = users.get(item['username'].strip())
+        if user is None or not user.mobile:
+            skipped.append({'username': item['username'], 'status': 'skipped', 'error': 'کاربر یا شماره موبایل یافت نشد'})
+            continue
+        recipients.append({'user_id': user.id, 'phone_number': user.mobile, 'message': (item.get('message') or '').strip()})
+        if compiled is not None:
+            contexts.append(user_context(user, **dict(data.get('context') or {}, **(item.get('context') or {}))))
+    if compiled is not None:
+        try:
+            for recipient, message in zip(recipients, compiled.render_many(contexts)):
+                recipient.update(message=message, template_id=compiled.template_id)
+        except TemplateError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        log_ids = enqueue_bulk(recipients, provider=data.get('provider') or None)
+        uids = {u.id: u.uid for u in users.values()}
+        report = [{'username': uids.get(recipient['user_id']), 'log_id': log_id, 'status': 'pending'}
+                  for recipient, log_id in zip(recipients, log_ids)]
+        counts = {}
+        for row in report + skipped:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+        return jsonify({'success': True, 'counts': counts, 'log_ids': log_ids, 'results': report + skipped}), 202
+    except Exception as e:
+        from models import db
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/sms/<int:log_id>')
+def api_sms_status(log_id):
+    """وضعیت یک پیامک صف"""
+    from models import SMSLog
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    log = SMSLog.query.get_or_404(log_id)
+    return jsonify({'success': True, 'sms': log.to_dict()})
+
+@freeipa_bp.route('/api/sms/queue')
+def api_sms_queue():
+    """تعداد پیام‌ها در هر وضعیت و وضعیت dispatcher این پروسه"""
+    from flask import current_app
+    from sms_queue import queue_counts, sms_queue
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    try:
+        sms_queue.notify(current_app._get_current_object())
+        return jsonify({'success': True, 'counts': queue_counts(), 'dispatcher': sms_queue.running()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def _sms_template_form():
+    """(name, text, is_active, compiled) از فرم قالب؛ قالب نامعتبر TemplateError می‌دهد"""
+    from sms_templates import CompiledTemplate, TemplateError
+    name = (request.form.get('name') or '').strip()
+    text = (request.form.get('template') or '').strip()
+    if not name or not text:
+        raise TemplateError('نام و متن قالب الزامی است')
+    return name, text, request.form.get('is_active') in ['1', 'true', 'on'], CompiledTemplate(text)
+
+@freeipa_bp.route('/sms/templates')
+def sms_templates():
+    """فهرست قالب‌های پیامک"""
+    from models import SMSTemplate
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند قالب‌های پیامک را مدیریت کند', 'error')
+        return redirect(url_for('freeipa.dashboard'))
+    templates = SMSTemplate.query.order_by(SMSTemplate.name).all()
+    return render_template('freeipa/sms_templates.html', templates=templates)
+
+@freeipa_bp.route('/sms/templates/add', methods=['GET', 'POST'])
+def add_sms_template():
+    """افزودن قالب؛ متن پیش از ذخیره کامپایل و اعتبارسنجی می‌شود"""
+    from models import db, SMSTemplate
+    from sms_templates import TemplateError
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند قالب‌های پیامک را مدیریت کند', 'error')
+        return redirect(url_for('freeipa.dashboard'))
+    if request.method == 'POST':
+        try:
+            name, text, is_active, compiled = _sms_template_form()
+        except TemplateError as e:
+            flash(str(e), 'error')
+            return render_template('freeipa/add_sms_template.html'), 400
+        if SMSTemplate.query.filter_by(name=name).first():
+            flash('قالبی با این نام وجود دارد', 'error')
+            return render_template('freeipa/add_sms_template.html'), 400
+        template = SMSTemplate(name=name, template=text, is_active=is_active)
+        template.set_variables_list(list(compiled.variables))
+        db.session.add(template)
+        db.session.commit()
+        flash('قالب پیامک ذخیره شد', 'success')
+        return redirect(url_for('freeipa.sms_templates'))
+    return render_template('freeipa/add_sms_template.html')
+
+@freeipa_bp.route('/sms/templates/<int:template_id>/edit', methods=['POST'])
+def edit_sms_template(template_id):
+    from models import db, SMSTemplate
+    from sms_templates import TemplateError, template_cache
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند قالب‌های پیامک را مدیریت کند', 'error')
+        return redirect(url_for('freeipa.dashboard'))
+    template = SMSTemplate.query.get_or_404(template_id)
+    try:
+        name, text, is_active, compiled = _sms_template_form()
+    except TemplateError as e:
+        flash(f'قالب {template.name} ذخیره نشد: {e}', 'error')
+        return redirect(url_for('freeipa.sms_templates'))
+    if SMSTemplate.query.filter(SMSTemplate.name == name, SMSTemplate.id != template.id).first():
+        flash('قالبی با این نام وجود دارد', 'error')
+        return redirect(url_for('freeipa.sms_templates'))
+    template.name = name
+    template.template = text
+    template.is_active = is_active
+    template.set_variables_list(list(compiled.variables))
+    db.session.commit()
+    template_cache.invalidate(template.id)
+    flash('قالب پیامک به‌روزرسانی شد', 'success')
+    return redirect(url_for('freeipa.sms_templates'))
+
+@freeipa_bp.route('/sms/templates/<int:template_id>/delete', methods=['POST'])
+def delete_sms_template(template_id):
+    """حذف قالب؛ قالبی که در لاگ پیامک‌ها استفاده شده فقط غیرفعال می‌شود"""
+    from models import db, SMSLog, SMSTemplate
+    from sms_templates import template_cache
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند قالب‌های پیامک را مدیریت کند', 'error')
+        return redirect(url_for('freeipa.dashboard'))
+    template = SMSTemplate.query.get_or_404(template_id)
+    if db.session.query(SMSLog.id).filter(SMSLog.template_id == template.id).first():
+        template.is_active = False
+        flash('این قالب در پیامک‌های ارسال‌شده استفاده شده است و به جای حذف غیرفعال شد', 'warning')
+    else:
+        db.session.delete(template)
+        flash('قالب پیامک حذف شد', 'success')
+    db.session.commit()
+    template_cache.invalidate(template_id)
+    return redirect(url_for('freeipa.sms_templates'))
+
+@freeipa_bp.route('/users/bulk', methods=['GET', 'POST'])
+def bulk_users():
+    """ایجاد گروهی کاربران از فایل Excel/CSV در پس‌زمینه"""
+    from flask import current_app
+    import os
+    from werkzeug.utils import secure_filename
+    from models import db, FreeIPAProvisionJob
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم می‌تواند کاربران را به صورت گروهی ایجاد کند', 'error')
+        return redirect(url_for('freeipa.list_users'))
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            flash('فایل انتخاب نشده است', 'error')
+            return redirect(url_for('freeipa.bulk_users'))
+        ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+        if ext not in ALLOWED_PROVISION_EXTENSIONS:
+            flash('فقط فایل‌های xlsx، xls و csv مجاز هستند', 'error')
+            return redirect(url_for('freeipa.bulk_users'))
+        try:
+            filename = secure_filename(file.filename)
+            if not filename.lower().endswith('.' + ext):
+                filename = f'users.{ext}'
+            target_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'imports')
+            os.makedirs(target_dir, exist_ok=True)
+            file_path = os.path.join(target_dir, f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{filename}")
+            file.save(file_path)
+            job = FreeIPAProvisionJob(
+                file_name=filename,
+                file_path=file_path,
+                sheet_name=(request.form.get('sheet_name') or '').strip() or None,
+                dry_run=request.form.get('dry_run') in ['1', 'true', 'on'],
+                created_by=current_user.id
+            )
+            db.session.add(job)
+            db.session.commit()
+            enqueue_provision_job(current_app._get_current_object(), job.id)
+            current_app.log_activity('import', 'freeipa_user', None, 200, f'FreeIPA provision job #{job.id}: {filename}')
+            flash('فایل دریافت شد و ایجاد کاربران در پس‌زمینه آغاز شد', 'success')
+            return redirect(url_for('freeipa.bulk_users_job', job_id=job.id))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'خطا در ثبت کار ایجاد گروهی: {e}', 'error')
+            return redirect(url_for('freeipa.bulk_users'))
+    recover_stale_provision_jobs()
+    jobs = FreeIPAProvisionJob.query.order_by(FreeIPAProvisionJob.created_at.desc()).limit(20).all()
+    return render_template('freeipa/bulk_users.html', jobs=jobs, job=None)
+
+@freeipa_bp.route('/users/bulk/<int:job_id>')
+def bulk_users_job(job_id):
+    from models import FreeIPAProvisionJob
+    if getattr(current_user, 'role', None) != 'admin':
+        return redirect(url_for('freeipa.list_users'))
+    recover_stale_provision_jobs()
+    job = FreeIPAProvisionJob.query.get_or_404(job_id)
+    jobs = FreeIPAProvisionJob.query.order_by(FreeIPAProvisionJob.created_at.desc()).limit(20).all()
+    return render_template('freeipa/bulk_users.html', jobs=jobs, job=job)
+
+@freeipa_bp.route('/users/bulk/<int:job_id>/report.csv')
+def bulk_users_report(job_id):
+    """گزارش نتیجه هر ردیف (بدون رمزها)"""
+    import csv, io
+    from flask import Response
+    from models import FreeIPAProvisionJob
+    if getattr(current_user, 'role', None) != 'admin':
+        return redirect(url_for('freeipa.list_users'))
+    job = FreeIPAProvisionJob.query.get_or_404(job_id)
+    buffer = io.StringIO()
+    buffer.write('\ufeff')  # BOM برای نمایش درست فارسی در Excel
+    writer = csv.writer(buffer)
+    writer.writerow(['row', 'uid', 'status', 'password_set', 'groups', 'ms', 'message'])
+    for r in job.get_report():
+        writer.writerow([r.get('row'), r.get('uid'), r.get('status'), r.get('password_set'),
+                         ';'.join(r.get('groups') or []), r.get('ms'), r.get('message')])
+    return Response(buffer.getvalue(), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename=provision_{job.id}_report.csv'})
+
+@freeipa_bp.route('/api/users/bulk/<int:job_id>')
+def api_bulk_users_job(job_id):
+    from models import FreeIPAProvisionJob
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    from models import db
+    job = FreeIPAProvisionJob.query.get_or_404(job_id)
+    if job.status in ('pending', 'running') and recover_stale_provision_jobs():
+        db.session.refresh(job)
+    include_report = request.args.get('report') in ['1', 'true']
+    resp = jsonify({'success': True, 'job': job.to_dict(include_report=include_report)})
+    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    return resp
+
+def _health_args():
+    """(app، max_age، warn_days) گزارش سلامت از تنظیمات"""
+    from flask import current_app
+    return (current_app._get_current_object(),
+            float(current_app.config.get('FREEIPA_HEALTH_MAX_AGE', 300)),
+            int(current_app.config.get('FREEIPA_HEALTH_WARN_DAYS', 14)))
+
+@freeipa_bp.route('/health')
+def account_health():
+    """گزارش سلامت حساب‌ها: قفل، انقضای رمز/principal و تلاش‌های ناموفق ورود"""
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم به گزارش سلامت حساب‌ها دسترسی دارد', 'error')
+        return redirect(url_for('freeipa.list_users'))
+    app, max_age, warn_days = _health_args()
+    report = health_report.get(app, max_age, warn_days)
+    if report is None:
+        flash(f"گزارش سلامت حساب‌ها در دسترس نیست: {health_report.status()['error'] or 'در حال تولید'}", 'error')
+    return render_template('freeipa/health.html', report=report, status=health_report.status())
+
+@freeipa_bp.route('/health/refresh', methods=['POST'])
+def refresh_account_health():
+    """scan دوباره حساب‌ها در پس‌زمینه"""
+    if getattr(current_user, 'role', None) != 'admin':
+        flash('فقط مدیر سیستم به گزارش سلامت حساب‌ها دسترسی دارد', 'error')
+        return redirect(url_for('freeipa.list_users'))
+    app, _, warn_days = _health_args()
+    health_report.refresh(app, warn_days)
+    flash('به‌روزرسانی گزارش در پس‌زمینه آغاز شد', 'success')
+    return redirect(url_for('freeipa.account_health'))
+
+@freeipa_bp.route('/api/health')
+def api_account_health():
+    """API گزارش سلامت حساب‌ها (آخرین گزارش کش‌شده + وضعیت به‌روزرسانی)"""
+    if getattr(current_user, 'role', None) != 'admin':
+        return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'}), 403
+    try:
+        app, max_age, warn_days = _health_args()
+        report = health_report.get(app, max_age, warn_days)
+        status = health_report.status()
+        if report is None:
+            return jsonify({'success': False, 'message': status['error'] or 'گزارش در حال تولید است', **status}), 503
+        return jsonify({'success': True, 'report': report, **status})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @freeipa_bp.route('/api/users')
 def api_list_users():
     """API لیست کاربران"""
     try:
-        users = freeipa_service.get_all_users()
+        q, page, per_page = _list_args()
+        mirror = _use_mirror()
+        if mirror:
+            result = search_mirror_users(q, page, per_page)
+        else:
+            result = freeipa_service.search_users(q, page, per_page)
         return jsonify({
             'success': True,
-            'users': users
+            'source': 'mirror' if mirror else 'ldap',
+            'users': result['items'],
+            'page': result['page'],
+            'per_page': result['per_page'],
+            'has_prev': result['has_prev'],
+            'has_next': result['has_next']
         })
     except Exception as e:
         return jsonify({
@@ -490,6 +1043,41 @@ def api_user_info(username):
             'message': str(e)
         }), 500
 
+@freeipa_bp.route('/api/group/<group_cn>/members')
+def api_group_members(group_cn):
+    """API اعضای گروه (صفحه‌بندی‌شده؛ فقط صفحه درخواستی از LDAP خوانده می‌شود)"""
+    try:
+        _, page, per_page = _list_args()
+        result = freeipa_service.search_group_members(group_cn, page, per_page)
+        return jsonify({
+            'success': True,
+            'group': group_cn,
+            'members': result['items'],
+            'page': result['page'],
+            'per_page': result['per_page'],
+            'has_prev': result['has_prev'],
+            'has_next': result['has_next']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@freeipa_bp.route('/api/user/<username>/groups')
+def api_user_groups(username):
+    """API گروه‌های کاربر (مستقیم و تو در تو) از ایندکس عضویت"""
+    try:
+        snapshot = freeipa_service.membership()
+        if snapshot is None:
+            return jsonify({'success': False, 'message': 'ایندکس عضویت در دسترس نیست'}), 503
+        return jsonify({
+            'success': True,
+            'username': username,
+            'groups': snapshot.display_names(snapshot.groups_of(username)),
+            'direct_groups': snapshot.display_names(snapshot.direct_by_user.get(username.lower(), ())),
+            'index': snapshot.stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @freeipa_bp.route('/self-change-password', methods=['GET', 'POST'])
 def self_change_password():
     try:
@@ -0,0 +1,157 @@
+"""
+snapshot محلی schema و اطلاعات DSA سرورهای FreeIPA
+
+خواندن schema کامل FreeIPA (چند صد کیلوبایت) برای هر اتصال جدید پرهزینه است. اطلاعات
+یک بار از سرور خوانده و برای هر میزبان در فایل JSON (قالب to_file/from_file خود ldap3)
+ذخیره می‌شود؛ اتصال‌های بعدی همان را به شیء Server متصل می‌کنند (مانند OFFLINE_*).
+اعتبار snapshot با modifyTimestamp ورودی cn=schema بررسی و پس از max_age یا تغییر
+timestamp دوباره از سرور خوانده می‌شود. اشیای parse‌شده در هر پروسه یک بار ساخته می‌شوند.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from ldap3 import BASE, Connection, Server
+from ldap3.core.exceptions import LDAPException
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+
+logger = logging.getLogger(__name__)
+
+# snapshotهای parse‌شده: مسیر → (mtime، DsaInfo، SchemaInfo، meta)
+_loaded: Dict[str, Tuple[float, DsaInfo, SchemaInfo, Dict]] = {}
+# آخرین بررسی timestamp هر میزبان در این پروسه
+_checked: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def _host_key(server: Server) -> str:
+    return f"{server.host}_{server.port}"
+
+
+def _base_path(directory: str, server: Server) -> str:
+    return os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', _host_key(server)))
+
+
+def _stamp(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return str(value) if value is not None else None
+
+
+def load_snapshot(directory: str, server: Server) -> Optional[Dict]:
+    """اتصال snapshot ذخیره‌شده به Server؛ meta (fetched_at، schema_timestamp) یا None"""
+    base = _base_path(directory, server)
+    meta_path = base + '.meta.json'
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _loaded.get(base)
+        if cached is None or cached[0] != mtime:
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                info = DsaInfo.from_file(base + '.info.json')
+                schema = SchemaInfo.from_file(base + '.schema.json')
+            except Exception as e:
+                logger.warning(f"LDAP schema snapshot {base} unreadable: {e}")
+                return None
+            cached = (mtime, info, schema, meta)
+            _loaded[base] = cached
+    _, info, schema, meta = cached
+    server.attach_dsa_info(info)
+    server.attach_schema_info(schema)
+    return meta
+
+
+def save_snapshot(directory: str, server: Server):
+    """ذخیره info/schema فعلی Server (نوشتن اتمیک با فایل موقت)"""
+    if server.info is None or server.schema is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    base = _base_path(directory, server)
+    meta = {
+        'host': server.host,
+        'port': server.port,
+        'fetched_at': time.time(),
+        'schema_timestamp': _stamp(server.schema.modify_time_stamp),
+    }
+    for suffix, payload in (('.info.json', server.info.to_json()),
+                            ('.schema.json', server.schema.to_json()),
+                            ('.meta.json', json.dumps(meta))):
+        tmp = f"{base}{suffix}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp, base + suffix)
+    logger.info(f"LDAP schema snapshot saved for {_host_key(server)}")
+
+
+def server_schema_timestamp(conn: Connection, schema_entry: Optional[str]) -> Optional[str]:
+    """modifyTimestamp ورودی subschema (یک جستجوی base کوچک)"""
+    try:
+        if not schema_entry:
+            conn.search('', '(objectClass=*)', BASE, attributes=['subschemaSubentry'])
+            raw = (conn.response[0].get('raw_attributes') or {}).get('subschemaSubentry') if conn.response else None
+            if not raw:
+                return None
+            schema_entry = raw[0].decode() if isinstance(raw[0], bytes) else str(raw[0])
+        conn.search(schema_entry, '(objectClass=*)', BASE, attributes=['modifyTimestamp'])
+        raw = (conn.response[0].get('raw_attributes') or {}).get('modifyTimestamp') if conn.response else None
+        if not raw:
+            return None
+        return raw[0].decode() if isinstance(raw[0], bytes) else str(raw[0])
+    except (LDAPException, IndexError, KeyError) as e:
+        logger.debug(f"schema timestamp check failed: {e}")
+        return None
+
+
+def _refresh(conn: Connection, directory: Optional[str]):
+    conn.refresh_server_info()
+    if directory:
+        try:
+            save_snapshot(directory, conn.server)
+        except OSError as e:
+            logger.warning(f"LDAP schema snapshot not saved: {e}")
+
+
+def ensure_server_info(conn: Connection, directory: Optional[str], max_age: float = 86400,
+                       check_interval: float = 3600):
+    """info/schema برای Server اتصال bind‌شده: از snapshot، و در صورت نبود/کهنگی/تغییر از سرور.
+
+    بررسی timestamp در هر پروسه حداکثر یک بار در check_interval برای هر میزبان انجام می‌شود.
+    """
+    server = conn.server
+    if not directory:
+        if server.info is None or server.schema is None:
+            conn.refresh_server_info()
+        return
+    key = _host_key(server)
+    now = time.time()
+    if server.info is None or server.schema is None:
+        meta = load_snapshot(directory, server)
+        if meta is None:
+            _refresh(conn, directory)
+            _checked[key] = now
+            return
+    elif now - _checked.get(key, 0) < check_interval:
+        return
+    else:
+        meta = load_snapshot(directory, server) or {}
+    if now - _checked.get(key, 0) < check_interval:
+        return  # snapshot اخیراً در همین پروسه بررسی شده
+    _checked[key] = now
+    if now - float(meta.get('fetched_at') or 0) > max_age:
+        _refresh(conn, directory)
+        return
+    current = server_schema_timestamp(conn, server.schema.schema_entry if server.schema else None)
+    if current and current != meta.get('schema_timestamp'):
+        logger.info(f"LDAP schema changed on {key} ({meta.get('schema_timestamp')} → {current}); refreshing snapshot")
+        _refresh(conn, directory)
@@ -3,13 +3,132 @@
 """
 
 import os
-from typing import Optional, Tuple
-from ldap3 import Server, Connection, ALL, SUBTREE
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from ldap3 import BASE, SUBTREE
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import escape_rdn
 from flask import current_app
 import logging
 
+from freeipa_metrics import ldap_metrics
+from freeipa_pool import get_pool
+from freeipa_membership import membership_index
+
 logger = logging.getLogger(__name__)
 
+# OID کنترل Simple Paged Results (RFC 2696)
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+USER_ATTRIBUTES = ['cn', 'uid', 'mail', 'memberOf']
+USER_INFO_ATTRIBUTES = ['cn', 'uid', 'mail', 'memberOf', 'givenName', 'sn']
+# لیست گروه‌ها بدون member؛ تعداد اعضا از ایندکس عضویت و اعضا صفحه به صفحه (iter_group_members)
+GROUP_ATTRIBUTES = ['cn', 'description', 'gidNumber']
+MEMBER_ATTRIBUTES = ['uid', 'cn', 'mail', 'objectClass']
+
+
+def _values(attrs, name) -> List:
+    value = attrs.get(name)
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _first(attrs, name, default='') -> str:
+    values = _values(attrs, name)
+    return str(values[0]) if values else default
+
+
+def _substring_filter(base_filter: str, query: Optional[str], attributes: List[str]) -> str:
+    """افزودن جستجوی زیررشته‌ای (سمت سرور) به فیلتر پایه"""
+    query = (query or '').strip()
+    if not query:
+        return base_filter
+    term = escape_filter_chars(query)
+    parts = ''.join(f"({a}=*{term}*)" for a in attributes)
+    return f"(&{base_filter}(|{parts}))"
+
+
+def _user_info(attrs) -> Dict:
+    """دیکشنری اطلاعات کاربر از attributeهای پاسخ جستجو (با یا بدون schema)"""
+    return {
+        'username': _first(attrs, 'uid'),
+        'full_name': _first(attrs, 'cn'),
+        'email': _first(attrs, 'mail'),
+        'first_name': _first(attrs, 'givenName'),
+        'last_name': _first(attrs, 'sn'),
+        'groups': [str(group) for group in _values(attrs, 'memberOf')]
+    }
+
+
+def page_of(items: Iterator, page: int, per_page: int) -> Dict:
+    """برش یک صفحه از iterator بدون خواندن بقیه نتایج؛ تعداد کل مشخص نیست (فقط قبلی/بعدی)"""
+    page = max(1, int(page or 1))
+    start = (page - 1) * per_page
+    try:
+        chunk = list(islice(items, start, start + per_page + 1))
+    finally:
+        close = getattr(items, 'close', None)
+        if close:
+            close()
+    return {
+        'items': chunk[:per_page],
+        'page': page,
+        'per_page': per_page,
+        'has_prev': page > 1,
+        'has_next': len(chunk) > per_page,
+    }
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+# راستی‌آزمایی پس‌زمینه رمزهای جدید (FREEIPA_PASSWORD_VERIFY=async)
+_verify_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='freeipa-verify')
+
+
+def _verify_user_bind(pool, user_dn: str, password: str, use_ssl: bool, username: Optional[str] = None) -> Optional[bool]:
+    """bind آزمایشی با رمز جدید؛ None یعنی امکان آزمایش نبود (خطای شبکه/TLS)"""
+    started = time.perf_counter()
+    try:
+        with pool.user_connection(user_dn, password) as conn:
+            if not use_ssl and not conn.tls_started:
+                try:
+                    conn.start_tls(read_server_info=False)
+                except Exception:
+                    pass
+            verified = bool(conn.bind(read_server_info=False))
+    except Exception as e:
+        logger.warning(f"verify bind {user_dn} skipped: {e}")
+        return None
+    if username:
+        # حالت async: نتیجه فقط در لاگ ثبت می‌شود
+        log = logger.info if verified else logger.warning
+        log(f"set_user_password {username}: async verify={'ok' if verified else 'FAILED'} ({_elapsed_ms(started)}ms)")
+    return verified
+
+
+def _invalidates(groups: bool = False):
+    """پاک کردن کش کاربر (و در صورت نیاز لیست گروه‌ها) پس از هر عملیات نوشتن"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, username, *args, **kwargs):
+            try:
+                return func(self, username, *args, **kwargs)
+            finally:
+                self.invalidate_user(username)
+                if groups:
+                    self.invalidate_groups()
+        return wrapper
+    return decorator
+
+
 class FreeIPAService:
     """سرویس FreeIPA برای احراز هویت و مدیریت کاربران"""
     
@@ -42,69 +161,278 @@ class FreeIPAService:
                 'bind_password': self.bind_password
             }
         
-    def _get_connection(self):
-        """ایجاد اتصال به FreeIPA"""
+    def _pool_options(self):
+        """تنظیمات pool اتصال‌ها از Flask app"""
         try:
-            config = self._get_config()
-            server = Server(config['host'], port=config['port'], use_ssl=config['use_ssl'], get_info=ALL)
-            conn = Connection(server, user=config['bind_dn'], password=config['bind_password'])
-            return conn
+            cfg = current_app.config
+        except Exception:
+            cfg = {}
+        return {
+            'size': int(cfg.get('FREEIPA_POOL_SIZE', 8)),
+            'max_idle': float(cfg.get('FREEIPA_POOL_MAX_IDLE', 300)),
+            'check_interval': float(cfg.get('FREEIPA_POOL_CHECK_INTERVAL', 60)),
+            'wait_timeout': float(cfg.get('FREEIPA_POOL_WAIT_TIMEOUT', 10)),
+            'connect_timeout': float(cfg.get('FREEIPA_CONNECT_TIMEOUT', 5)),
+            'receive_timeout': float(cfg.get('FREEIPA_RECEIVE_TIMEOUT', 15)),
+            'start_tls': bool(cfg.get('FREEIPA_START_TLS', True)),
+            'schema_dir': cfg.get('FREEIPA_SCHEMA_CACHE_DIR') or None,
+            'schema_max_age': float(cfg.get('FREEIPA_SCHEMA_MAX_AGE_HOURS', 24)) * 3600,
+            'schema_check_interval': float(cfg.get('FREEIPA_SCHEMA_CHECK_INTERVAL', 3600)),
+        }
+
+    def _pool(self):
+        return get_pool(self._get_config(), self._pool_options())
+
+    @contextmanager
+    def _admin_connection(self):
+        """امانت گرفتن اتصال bind‌شده ادمین از pool؛ اگر اتصال ممکن نباشد None"""
+        try:
+            pool = self._pool()
+            # شامل open/StartTLS/bind در صورتی که اتصال بیکاری در pool نباشد
+            with ldap_metrics.timed('pool_acquire'):
+                conn = pool.acquire()
         except Exception as e:
-            logger.error(f"خطا در ایجاد اتصال FreeIPA: {e}")
+            logger.error(f"خطا در اتصال به FreeIPA: {e}")
+            yield None
+            return
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            # وضعیت اتصال نامعلوم است؛ به جای بازگشت به pool دوباره bind می‌شود
+            broken = True
+            raise
+        finally:
+            pool.release(conn, broken=broken)
+
+    def _cache(self):
+        """کش Flask-Caching برنامه (Redis یا حافظه بر اساس CACHE_TYPE)؛ با TTL صفر غیرفعال"""
+        try:
+            if int(current_app.config.get('FREEIPA_CACHE_TTL', 60)) <= 0:
+                return None
+            return getattr(current_app, 'cache', None)
+        except Exception:
             return None
-    
+
+    def _cache_key(self, kind: str, name: str = '') -> str:
+        return f"freeipa:{self._get_config()['base_dn']}:{kind}:{name.lower()}"
+
+    def _cached(self, key: str, loader):
+        """خواندن از کش یا بارگذاری و ذخیره با FREEIPA_CACHE_TTL (نتیجه خالی/خطا ذخیره نمی‌شود)"""
+        cache = self._cache()
+        if cache is None:
+            return loader()
+        try:
+            value = cache.get(key)
+        except Exception as e:
+            logger.warning(f"FreeIPA cache read failed: {e}")
+            value = None
+        if value is not None:
+            return value
+        value = loader()
+        if value:
+            self._cache_set(key, value)
+        return value
+
+    def _cache_set(self, key: str, value):
+        cache = self._cache()
+        if cache is None:
+            return
+        try:
+            cache.set(key, value, timeout=int(current_app.config.get('FREEIPA_CACHE_TTL', 60)))
+        except Exception as e:
+            logger.warning(f"FreeIPA cache write failed: {e}")
+
+    def _cache_delete(self, key: str):
+        cache = self._cache()
+        if cache is None:
+            return
+        try:
+            cache.delete(key)
+        except Exception as e:
+            logger.warning(f"FreeIPA cache delete failed: {e}")
+
+    def invalidate_user(self, username: str):
+        """حذف اطلاعات کش‌شده کاربر (پس از تغییر در دایرکتوری)"""
+        self._cache_delete(self._cache_key('user', username))
+
+    def invalidate_groups(self):
+        """حذف لیست کش‌شده گروه‌ها (شامل اعضا) و به‌روزرسانی ایندکس عضویت در دسترسی بعدی"""
+        self._cache_delete(self._cache_key('groups'))
+        membership_index.mark_stale()
+
+    def _page_size(self) -> int:
+        try:
+            return int(current_app.config.get('FREEIPA_PAGE_SIZE', 500))
+        except Exception:
+            return 500
+
+    def paged_search(self, search_base: str, search_filter: str, attributes=None,
+                     page_size: Optional[int] = None, search_scope=SUBTREE) -> Iterator[Dict]:
+        """جستجو با کنترل Simple Paged Results؛ ورودی‌ها صفحه به صفحه yield می‌شوند.
+
+        اتصال تا پایان (یا بسته شدن) generator از pool امانت گرفته می‌شود. اگر اتصالی برقرار
+        نشود یا کد نتیجه یک صفحه success نباشد LDAPException رخ می‌دهد (نه نتیجه خالی).
+        """
+        page_size = page_size or self._page_size()
+        with self._admin_connection() as conn:
+            if conn is None:
+                raise LDAPException(f"paged search {search_base} failed: no connection to FreeIPA")
+            cookie = None
+            try:
+                while True:
+                    conn.search(search_base, search_filter, search_scope, attributes=attributes,
+                                paged_size=page_size, paged_cookie=cookie)
+                    result = conn.result or {}
+                    if result.get('result') != 0:
+                        # بدون این بررسی خطای سرور (busy/timeLimit/...) مثل نتیجه خالی یا ناقص دیده می‌شود
+                        cookie = None
+                        raise LDAPException(f"paged search {search_base} failed: "
+                                            f"{result.get('result')} {result.get('description')} {result.get('message') or ''}".strip())
+                    # cookie قبل از yield خوانده می‌شود تا در توقف وسط صفحه هم آزادسازی انجام شود
+                    cookie = result.get('controls', {}).get(PAGED_RESULTS_OID, {}).get('value', {}).get('cookie')
+                    for entry in list(conn.response or []):
+                        if entry.get('type') == 'searchResEntry':
+                            yield entry
+                    if not cookie:
+                        break
+            finally:
+                if cookie:
+                    # توقف زودهنگام: size=0 نتایج باقی‌مانده سمت سرور را آزاد می‌کند
+                    try:
+                        conn.search(search_base, search_filter, search_scope, attributes=['1.1'],
+                                    paged_size=0, paged_cookie=cookie)
+                    except LDAPException:
+                        pass
+
+    def iter_users(self, query: Optional[str] = None, page_size: Optional[int] = None) -> Iterator[Dict]:
+        """کاربران به صورت generator (جستجو در uid/cn/mail)"""
+        config = self._get_config()
+        search_filter = _substring_filter('(objectClass=person)', query, ['uid', 'cn', 'mail'])
+        for entry in self.paged_search(config['base_dn'], search_filter, USER_ATTRIBUTES, page_size):
+            attrs = entry['attributes']
+            yield {
+                'username': _first(attrs, 'uid'),
+                'full_name': _first(attrs, 'cn'),
+                'email': _first(attrs, 'mail'),
+                'groups': [str(g) for g in _values(attrs, 'memberOf')]
+            }
+
+    def iter_groups(self, query: Optional[str] = None, page_size: Optional[int] = None,
+                    with_counts: bool = True) -> Iterator[Dict]:
+        """گروه‌ها به صورت generator (جستجو در cn/description)؛ به جای لیست member فقط member_count"""
+        config = self._get_config()
+        base_groups = f"cn=groups,cn=accounts,{config['base_dn']}"
+        search_filter = _substring_filter('(objectClass=groupOfNames)', query, ['cn', 'description'])
+        snapshot = self.membership() if with_counts else None
+        for entry in self.paged_search(base_groups, search_filter, GROUP_ATTRIBUTES, page_size):
+            attrs = entry['attributes']
+            cn = _first(attrs, 'cn')
+            yield {
+                'cn': cn,
+                'description': _first(attrs, 'description'),
+                'gid_number': _first(attrs, 'gidNumber'),
+                'member_count': snapshot.member_count(cn) if snapshot is not None else None
+            }
+
+    def group_dn(self, group_cn: str) -> str:
+        return f"cn={escape_rdn(group_cn)},cn=groups,cn=accounts,{self._get_config()['base_dn']}"
+
+    def get_group(self, group_cn: str) -> Optional[Dict]:
+        """اطلاعات یک گروه بدون خواندن اعضا"""
+        with self._admin_connection() as conn:
+            if conn is None:
+                return None
+            try:
+                conn.search(self.group_dn(group_cn), '(objectClass=groupOfNames)', BASE, attributes=GROUP_ATTRIBUTES)
+            except LDAPException as e:
+                logger.error(f"خطا در دریافت گروه {group_cn}: {e}")
+                return None
+            entries = [e for e in (conn.response or []) if e.get('type') == 'searchResEntry']
+        if not entries:
+            return None
+        attrs = entries[0]['attributes']
+        snapshot = self.membership()
+        return {
+            'cn': _first(attrs, 'cn'),
+            'description': _first(attrs, 'description'),
+            'gid_number': _first(attrs, 'gidNumber'),
+            'member_count': snapshot.member_count(group_cn) if snapshot is not None else None
+        }
+
+    def iter_group_members(self, group_cn: str, page_size: Optional[int] = None) -> Iterator[Dict]:
+        """اعضای گروه به صورت generator (شامل عضویت تو در تو).
+
+        389-ds بازیابی بازه‌ای member;range=... را پشتیبانی نمی‌کند؛ به جای خواندن کل ویژگی member
+        ورودی‌هایی که memberOf آن‌ها این گروه است با paged search صفحه به صفحه خوانده می‌شوند.
+        """
+        config = self._get_config()
+        search_filter = f"(memberOf={escape_filter_chars(self.group_dn(group_cn))})"
+        for entry in self.paged_search(f"cn=accounts,{config['base_dn']}", search_filter, MEMBER_ATTRIBUTES, page_size):
+            attrs = entry['attributes']
+            classes = [str(c).lower() for c in _values(attrs, 'objectClass')]
+            is_group = 'groupofnames' in classes and 'person' not in classes
+            yield {
+                'type': 'group' if is_group else 'user',
+                'name': _first(attrs, 'cn') if is_group else _first(attrs, 'uid'),
+                'full_name': _first(attrs, 'cn'),
+                'email': _first(attrs, 'mail'),
+            }
+
+    def search_group_members(self, group_cn: str, page: int = 1, per_page: int = 50) -> Dict:
+        """یک صفحه از اعضای گروه"""
+        return page_of(self.iter_group_members(group_cn, page_size=min(self._page_size(), page * per_page + 1)), page, per_page)
+
+    def search_users(self, query: Optional[str] = None, page: int = 1, per_page: int = 50) -> Dict:
+        """یک صفحه از کاربران؛ فقط تا انتهای صفحه (+1 برای has_next) از LDAP خوانده می‌شود"""
+        return page_of(self.iter_users(query, page_size=min(self._page_size(), page * per_page + 1)), page, per_page)
+
+    def search_groups(self, query: Optional[str] = None, page: int = 1, per_page: int = 50) -> Dict:
+        """یک صفحه از گروه‌ها"""
+        return page_of(self.iter_groups(query, page_size=min(self._page_size(), page * per_page + 1)), page, per_page)
+
     def authenticate_user(self, username, password):
-        """احراز هویت کاربر"""
+        """احراز هویت کاربر؛ اطلاعات کاربر با همان اتصال bind‌شده کاربر خوانده می‌شود"""
         try:
             config = self._get_config()
             # اتصال برای bind (مسیر صحیح FreeIPA)
             bind_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            server = Server(config['host'], port=config['port'], use_ssl=config['use_ssl'])
-            conn = Connection(server, user=bind_dn, password=password)
-            
-            if conn.bind():
-                # دریافت اطلاعات کاربر
-                user_info = self.get_user_info(username)
-                conn.unbind()
+            user_info = None
+            with self._pool().user_connection(bind_dn, password) as conn:
+                if not conn.bind(read_server_info=False):
+                    return False, None
+                # خواندن entry خود کاربر (ACI پیش‌فرض FreeIPA اجازه می‌دهد) به جای اتصال ادمین دوم
+                try:
+                    if conn.search(bind_dn, '(objectClass=*)', BASE, attributes=USER_INFO_ATTRIBUTES) and conn.response:
+                        user_info = _user_info(conn.response[0]['attributes'])
+                except LDAPException as e:
+                    logger.warning(f"خواندن entry کاربر {username} با اتصال خودش ممکن نشد: {e}")
+            if user_info:
+                self._cache_set(self._cache_key('user', username), user_info)
                 return True, user_info
-            else:
-                conn.unbind()
-                return False, None
+            # دریافت اطلاعات کاربر
+            return True, self.get_user_info(username)
             
         except Exception as e:
             logger.error(f"خطا در احراز هویت کاربر {username}: {e}")
             return False, None
     
     def get_user_info(self, username):
-        """دریافت اطلاعات کاربر"""
+        """دریافت اطلاعات کاربر (با کش)"""
+        return self._cached(self._cache_key('user', username), lambda: self._load_user_info(username))
+    
+    def _load_user_info(self, username):
+        """دریافت اطلاعات کاربر از LDAP"""
         try:
-            conn = self._get_connection()
-            if not conn:
-                return None
-                
-            if conn.bind():
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return None
                 config = self._get_config()
-                search_filter = f"(uid={username})"
-                conn.search(config['base_dn'], search_filter, SUBTREE, 
-                           attributes=['cn', 'uid', 'mail', 'memberOf', 'givenName', 'sn'])
-                
-                if conn.entries:
-                    user = conn.entries[0]
-                    user_info = {
-                        'username': str(user.uid),
-                        'full_name': str(user.cn),
-                        'email': str(user.mail) if hasattr(user, 'mail') else '',
-                        'first_name': str(user.givenName) if hasattr(user, 'givenName') else '',
-                        'last_name': str(user.sn) if hasattr(user, 'sn') else '',
-                        'groups': [str(group) for group in user.memberOf] if hasattr(user, 'memberOf') else []
-                    }
-                    conn.unbind()
-                    return user_info
-                
-                conn.unbind()
-                return None
-            else:
-                conn.unbind()
+                search_filter = f"(uid={escape_filter_chars(username)})"
+                conn.search(config['base_dn'], search_filter, SUBTREE, attributes=USER_INFO_ATTRIBUTES)
+                for entry in conn.response or []:
+                    if entry.get('type') == 'searchResEntry':
+                        return _user_info(entry['attributes'])
                 return None
             
         except Exception as e:
@@ -112,50 +440,69 @@ class FreeIPAService:
             return None
     
     def get_all_users(self):
-        """دریافت لیست تمام کاربران"""
+        """دریافت لیست تمام کاربران (paged؛ بدون برخورد به size limit سرور)"""
         try:
-            conn = self._get_connection()
-            if not conn:
-                return []
-                
-            if conn.bind():
-                config = self._get_config()
-                search_filter = "(objectClass=person)"
-                conn.search(config['base_dn'], search_filter, SUBTREE,
-                           attributes=['cn', 'uid', 'mail', 'memberOf'])
-                
-                users = []
-                for entry in conn.entries:
-                    user_info = {
-                        'username': str(entry.uid),
-                        'full_name': str(entry.cn),
-                        'email': str(entry.mail) if hasattr(entry, 'mail') else '',
-                        'groups': [str(group) for group in entry.memberOf] if hasattr(entry, 'memberOf') else []
-                    }
-                    users.append(user_info)
-                
-                conn.unbind()
-                return users
-            else:
-                conn.unbind()
-                return []
-            
+            return list(self.iter_users())
         except Exception as e:
             logger.error(f"خطا در دریافت لیست کاربران: {e}")
             return []
     
     def get_user_groups(self, username):
-        """دریافت گروه‌های کاربر"""
+        """دریافت گروه‌های کاربر (memberOf از اطلاعات کش‌شده کاربر)"""
         user_info = self.get_user_info(username)
         if user_info:
             return user_info.get('groups', [])
         return []
     
+    def membership(self):
+        """snapshot ایندکس عضویت (مستقیم و تو در تو)؛ None در صورت عدم دسترسی به FreeIPA"""
+        return membership_index.get(
+            self,
+            refresh_interval=float(current_app.config.get('FREEIPA_MEMBERSHIP_REFRESH', 60)),
+            full_interval=float(current_app.config.get('FREEIPA_MEMBERSHIP_FULL_INTERVAL', 3600)),
+            retry_interval=float(current_app.config.get('FREEIPA_MEMBERSHIP_RETRY', 30)),
+        )
+    
+    def get_user_group_names(self, username) -> List[str]:
+        """نام همه گروه‌های کاربر شامل عضویت تو در تو"""
+        snapshot = self.membership()
+        if snapshot is None:
+            return []
+        return snapshot.display_names(snapshot.groups_of(username))
+    
     def is_user_in_group(self, username, group_name):
-        """بررسی عضویت کاربر در گروه"""
-        groups = self.get_user_groups(username)
-        return any(group_name in group for group in groups)
+        """بررسی عضویت کاربر در گروه (شامل عضویت تو در تو) از ایندکس عضویت"""
+        snapshot = self.membership()
+        if snapshot is not None:
+            return snapshot.is_member(username, group_name)
+        # بدون ایندکس: تطبیق دقیق cn در memberOf (نه زیررشته)
+        wanted = f"cn={group_name}".lower()
+        return any(str(dn).split(',', 1)[0].strip().lower() == wanted for dn in self.get_user_groups(username))
     
+    def build_user_entry(self, uid: str, givenname: str, sn: str, cn: str, mail: str,
+                         mobile: Optional[str] = None) -> Tuple[str, Dict]:
+        """DN و attributeهای ایجاد کاربر جدید (فرم افزودن و ایجاد گروهی)"""
+        cfg = self._get_config()
+        user_dn = f"uid={uid},cn=users,cn=accounts,{cfg['base_dn']}"
+        attrs = {
+            'objectClass': ['inetOrgPerson', 'posixAccount', 'top', 'person', 'organizationalPerson', 'krbPrincipalAux', 'inetUser'],
+            'uid': uid,
+            'cn': cn,
+            'sn': sn,
+            'givenName': givenname,
+            'mail': mail,
+            'loginShell': '/bin/bash',
+            'homeDirectory': f"/home/{uid}",
+            # مقدار جادویی DNA: FreeIPA برای هر کاربر UID/GID یکتا تخصیص می‌دهد
+            'uidNumber': '-1',
+            'gidNumber': '-1',
+            'krbPrincipalName': f"{uid}@{cfg['base_dn'].replace('dc=','').replace(',', '.').upper()}"
+        }
+        if mobile:
+            attrs['mobile'] = mobile
+        return user_dn, attrs
+    
+    @_invalidates(groups=True)
     def add_user_to_group(self, username: str, group_cn: str) -> bool:
         """افزودن کاربر به یک گروه"""
         try:
@@ -163,16 +510,15 @@ class FreeIPAService:
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
             group_dn = f"cn={group_cn},cn=groups,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]} )
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]} )
         except Exception as e:
             logger.error(f"خطا در افزودن کاربر به گروه: {e}")
             return False
     
+    @_invalidates(groups=True)
     def remove_user_from_group(self, username: str, group_cn: str) -> bool:
         """حذف کاربر از گروه"""
         try:
@@ -180,217 +526,173 @@ class FreeIPAService:
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
             group_dn = f"cn={group_cn},cn=groups,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(group_dn, {'member': [(MODIFY_DELETE, [user_dn])]} )
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(group_dn, {'member': [(MODIFY_DELETE, [user_dn])]} )
         except Exception as e:
             logger.error(f"خطا در حذف کاربر از گروه: {e}")
             return False
 
-    def set_user_password(self, username: str, new_password: str, old_password: Optional[str] = None):
-        """تعیین/ریست پسورد کاربر با Password Modify Extended Operation تا اجبار تغییر رفع شود."""
+    def _reset_expiration_settings(self) -> Tuple[Optional[int], Optional[int], bool]:
+        """تنظیمات principal expiration پس از ریست رمز: (روز، ساعت، حذف انقضا)"""
+        rel_days = current_app.config.get('FREEIPA_DEFAULT_PRINCIPAL_EXP_DAYS', 3)
+        rel_hours = current_app.config.get('FREEIPA_DEFAULT_PRINCIPAL_EXP_HOURS', 0)
+        unset = str(current_app.config.get('FREEIPA_UNSET_PRINCIPAL_EXP_ON_RESET', True)).lower() in ['true', '1', 'on']
+        if unset:
+            return None, None, True
+        return rel_days, rel_hours, False
+    
+    def _expiration_changes(self, rel_days: Optional[int] = None, rel_hours: Optional[int] = None,
+                            unset: bool = False) -> Dict:
+        """تغییرات انقضا/لاک برای یک modify واحد: krbPasswordExpiration دور، unlock، پاک کردن شکست‌ها و principal expiration"""
+        from datetime import datetime, timedelta
+        from ldap3 import MODIFY_REPLACE
+        changes = {
+            'krbPasswordExpiration': [(MODIFY_REPLACE, ['20380119031407Z'])],
+            'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])],
+            # replace بدون مقدار: حذف در صورت وجود، بدون خطا در نبود (برخلاف MODIFY_DELETE که کل modify را رد می‌کند)
+            'krbLoginFailedCount': [(MODIFY_REPLACE, [])],
+        }
+        if unset:
+            changes['krbPrincipalExpiration'] = [(MODIFY_REPLACE, [])]
+        elif rel_days is not None or rel_hours is not None:
+            target = datetime.utcnow() + timedelta(days=int(rel_days or 0), hours=int(rel_hours or 0))
+            changes['krbPrincipalExpiration'] = [(MODIFY_REPLACE, [target.strftime('%Y%m%d%H%M%SZ')])]
+        return changes
+    
+    @_invalidates()
+    def set_user_password(self, username: str, new_password: str, old_password: Optional[str] = None,
+                          verify: Optional[str] = None):
+        """تعیین/ریست پسورد کاربر با Password Modify Extended Operation تا اجبار تغییر رفع شود.
+
+        همه مراحل ادمین روی یک اتصال pool انجام می‌شود: تغییر رمز و سپس یک modify ترکیبی برای
+        انقضاها/لاک. verify (پیش‌فرض FREEIPA_PASSWORD_VERIFY): 'sync' نتیجه bind کاربر را در پاسخ
+        لحاظ می‌کند، 'async' آن را در پس‌زمینه انجام و فقط لاگ می‌کند، 'off' آن را حذف می‌کند.
+        """
+        from ldap3 import MODIFY_REPLACE
+        started = time.perf_counter()
+        steps: Dict[str, float] = {}
         try:
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            # اطمینان از محرمانگی: در صورت نبود SSL، StartTLS را تلاش کن
-            try:
-                if conn and not config['use_ssl']:
-                    conn.open()
-                    conn.start_tls()
-            except Exception:
-                pass
-            if not conn or not conn.bind():
-                return False, 'اتصال به FreeIPA برقرار نشد'
-            # Use LDAP Password Modify Extended Operation
-            ok = conn.extend.standard.modify_password(user=user_dn, new_password=new_password, old_password=old_password)
-            if not ok:
-                err = conn.result
-                # تلاش جایگزین: جایگزینی مستقیم userPassword (نیازمند دسترسی کافی)
-                try:
-                    from ldap3 import MODIFY_REPLACE
-                    alt_ok = conn.modify(user_dn, {'userPassword': [(MODIFY_REPLACE, [new_password])]})
-                    if alt_ok:
-                        ok = True
-                    else:
-                        # اگر باز هم خطا، پیام دقیق برگردد
-                        alt_err = conn.result
-                        conn.unbind()
-                        return False, f"Password modify failed: {err}; direct replace failed: {alt_err}"
-                except Exception as ex:
-                    conn.unbind()
-                    return False, f"Password modify failed: {err}; fallback error: {ex}"
-            # Optionally relax policy to be safe
-            if ok:
-                try:
-                    from ldap3 import MODIFY_REPLACE, MODIFY_DELETE
-                    conn.modify(user_dn, {
-                        'krbPasswordExpiration': [(MODIFY_REPLACE, ['20380119031407Z'])],
-                        'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]
-                    })
-                    # best-effort clear failures
+            rel_days, rel_hours, unset = self._reset_expiration_settings()
+            # اتصال‌های pool در صورت نبود SSL با StartTLS باز می‌شوند (FREEIPA_START_TLS)
+            with self._admin_connection() as conn:
+                steps['acquire'] = _elapsed_ms(started)
+                if conn is None:
+                    return False, 'اتصال به FreeIPA برقرار نشد'
+                mark = time.perf_counter()
+                # Use LDAP Password Modify Extended Operation
+                ok = conn.extend.standard.modify_password(user=user_dn, new_password=new_password, old_password=old_password)
+                if not ok:
+                    err = conn.result
+                    # تلاش جایگزین: جایگزینی مستقیم userPassword (نیازمند دسترسی کافی)
                     try:
-                        conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
-                    except Exception:
-                        pass
-                except Exception:
-                    pass
-                # تنظیم خودکار principal expiration بر اساس تنظیمات پیش‌فرض
-                try:
-                    from flask import current_app
-                    rel_days = current_app.config.get('FREEIPA_DEFAULT_PRINCIPAL_EXP_DAYS', 3)
-                    rel_hours = current_app.config.get('FREEIPA_DEFAULT_PRINCIPAL_EXP_HOURS', 0)
-                    unset = current_app.config.get('FREEIPA_UNSET_PRINCIPAL_EXP_ON_RESET', True)
-                    # انجام در کانکشن جدید تا تداخل نداشته باشد
-                    self._adjust_user_expirations(username, rel_days=None if unset else rel_days, rel_hours=None if unset else rel_hours, unset=bool(unset))
-                except Exception:
-                    pass
+                        if not conn.modify(user_dn, {'userPassword': [(MODIFY_REPLACE, [new_password])]}):
+                            # اگر باز هم خطا، پیام دقیق برگردد
+                            return False, f"Password modify failed: {err}; direct replace failed: {conn.result}"
+                    except Exception as ex:
+                        return False, f"Password modify failed: {err}; fallback error: {ex}"
+                steps['modify_password'] = _elapsed_ms(mark)
+                # برداشتن لاک/اجبار تغییر و تنظیم principal expiration در یک درخواست
+                mark = time.perf_counter()
+                if not conn.modify(user_dn, self._expiration_changes(rel_days, rel_hours, unset)):
+                    logger.warning(f"به‌روزرسانی انقضا/لاک {username} ناموفق بود: {conn.result}")
+                steps['policy'] = _elapsed_ms(mark)
+
             # راستی‌آزمایی: با همان پسورد جدید لاگینِ کاربر را تست کن
-            try:
-                verify_server = Server(config['host'], port=config['port'], use_ssl=config['use_ssl'])
-                verify_conn = Connection(verify_server, user=user_dn, password=new_password)
-                if not config['use_ssl']:
-                    try:
-                        verify_conn.open()
-                        verify_conn.start_tls()
-                    except Exception:
-                        pass
-                if not verify_conn.bind():
-                    try:
-                        conn.unbind()
-                    except Exception:
-                        pass
+            verify = (verify or current_app.config.get('FREEIPA_PASSWORD_VERIFY', 'sync')).lower()
+            if verify == 'sync':
+                mark = time.perf_counter()
+                verified = _verify_user_bind(self._pool(), user_dn, new_password, config['use_ssl'])
+                steps['verify'] = _elapsed_ms(mark)
+                if verified is False:
                     return False, 'پسورد تنظیم شد اما احراز هویت کاربر با پسورد جدید موفق نشد (policy/TLS).'
-                verify_conn.unbind()
-            except Exception:
-                pass
-            conn.unbind()
-            return (True, 'پسورد با موفقیت به‌روزرسانی شد') if ok else (False, 'خطای نامشخص در تغییر پسورد')
+            elif verify == 'async':
+                _verify_executor.submit(_verify_user_bind, self._pool(), user_dn, new_password, config['use_ssl'], username)
+            return True, 'پسورد با موفقیت به‌روزرسانی شد'
         except Exception as e:
             logger.error(f"خطا در تنظیم پسورد کاربر (extended op): {e}")
             return False, str(e)
+        finally:
+            steps['total'] = _elapsed_ms(started)
+            logger.info(f"set_user_password {username}: " + ', '.join(f"{k}={v}ms" for k, v in steps.items()))
     
+    @_invalidates()
     def _adjust_user_expirations(self, username: str, rel_days: Optional[int], rel_hours: Optional[int], unset: bool = False) -> Tuple[bool, str]:
         """تنظیم خودکار انقضاها: krbPasswordExpiration بسیار دور، unlock، و krbPrincipalExpiration نسبی یا حذف."""
         try:
-            from datetime import datetime, timedelta
-            from ldap3 import MODIFY_REPLACE, MODIFY_DELETE
             cfg = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{cfg['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False, 'عدم امکان اتصال برای تنظیم انقضا'
-            # همیشه: برداشتن لاک و تمدید krbPasswordExpiration به دور
-            conn.modify(user_dn, {
-                'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])],
-                'krbPasswordExpiration': [(MODIFY_REPLACE, ['20380119031407Z'])]
-            })
-            try:
-                conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
-            except Exception:
-                pass
-            # Principal expiration
+            if not unset:
+                rel_days, rel_hours = int(rel_days or 0), int(rel_hours or 0)
+            changes = self._expiration_changes(rel_days, rel_hours, unset)
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False, 'عدم امکان اتصال برای تنظیم انقضا'
+                ok = conn.modify(user_dn, changes)
+            if not ok:
+                return False, 'خطا در تنظیم principal exp'
             if unset:
-                conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_DELETE, [])]})
-                conn.unbind()
                 return True, 'principal expiration حذف شد'
-            # relative set
-            days = int(rel_days or 0)
-            hours = int(rel_hours or 0)
-            target = datetime.utcnow() + timedelta(days=days, hours=hours)
-            zulu = target.strftime('%Y%m%d%H%M%SZ')
-            ok = conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_REPLACE, [zulu])]})
-            conn.unbind()
-            return (True, f'principal exp → {zulu}') if ok else (False, 'خطا در تنظیم principal exp')
+            return True, f"principal exp → {changes['krbPrincipalExpiration'][0][1][0]}"
         except Exception as e:
             logger.error(f"adjust expirations error: {e}")
             return False, str(e)
     
+    @_invalidates()
     def relax_password_policy(self, username: str) -> bool:
         """برداشتن اجبار تغییر رمز و تمدید تاریخ انقضای پسورد، پاک‌کردن لاک/شکست‌ها"""
         try:
-            from ldap3 import MODIFY_REPLACE, MODIFY_DELETE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            # تاریخ انقضای خیلی دور (2038-01-19 03:14:07Z)
-            changes = {
-                'krbPasswordExpiration': [(MODIFY_REPLACE, ['20380119031407Z'])],
-                'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]
-            }
-            ok = conn.modify(user_dn, changes)
-            # پاک کردن شمارنده شکست‌ها (اگر وجود دارد)
-            try:
-                conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
-            except Exception:
-                pass
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                # تاریخ انقضای خیلی دور (2038-01-19 03:14:07Z) و پاک کردن شمارنده شکست‌ها در یک modify
+                return conn.modify(user_dn, self._expiration_changes())
         except Exception as e:
             logger.error(f"خطا در Relax policy کاربر: {e}")
             return False
 
+    @_invalidates()
     def set_principal_expiration(self, username: str, zulu_timestamp: str) -> bool:
         """تنظیم تاریخ انقضای Kerberos principal کاربر: فرمت Zulu مانند 20371231235959Z"""
         try:
             from ldap3 import MODIFY_REPLACE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_REPLACE, [zulu_timestamp])]})
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_REPLACE, [zulu_timestamp])]})
         except Exception as e:
             logger.error(f"خطا در تنظیم krbPrincipalExpiration: {e}")
             return False
 
+    @_invalidates()
     def unset_principal_expiration(self, username: str) -> bool:
         """حذف تاریخ انقضای Kerberos principal (بازگردانی به بدون انقضا)"""
         try:
             from ldap3 import MODIFY_DELETE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_DELETE, [])]})
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(user_dn, {'krbPrincipalExpiration': [(MODIFY_DELETE, [])]})
         except Exception as e:
             logger.error(f"خطا در حذف krbPrincipalExpiration: {e}")
             return False
     
     def get_all_groups(self):
-        """دریافت همه گروه‌های FreeIPA"""
+        """دریافت همه گروه‌های FreeIPA (با کش)"""
+        return self._cached(self._cache_key('groups'), self._load_all_groups)
+    
+    def _load_all_groups(self):
         try:
-            conn = self._get_connection()
-            if not conn: return []
-            if conn.bind():
-                config = self._get_config()
-                base_groups = f"cn=groups,cn=accounts,{config['base_dn']}"
-                search_filter = "(objectClass=groupOfNames)"
-                conn.search(base_groups, search_filter, SUBTREE,
-                           attributes=['cn', 'description', 'gidNumber', 'member'])
-                groups = []
-                for entry in conn.entries:
-                    groups.append({
-                        'cn': str(getattr(entry, 'cn', '')),
-                        'description': str(getattr(entry, 'description', '')) if hasattr(entry, 'description') else '',
-                        'gid_number': str(getattr(entry, 'gidNumber', '')) if hasattr(entry, 'gidNumber') else '',
-                        'members': list(entry.member) if hasattr(entry, 'member') else []
-                    })
-                conn.unbind()
-                return groups
-            else:
-                conn.unbind()
-            return []
+            return list(self.iter_groups(with_counts=False))
         except Exception as e:
             logger.error(f"خطا در دریافت گروه‌ها: {e}")
             return []
@@ -398,83 +700,80 @@ class FreeIPAService:
     def test_connection(self):
         """تست اتصال به FreeIPA"""
         try:
-            conn = self._get_connection()
-            if conn and conn.bind():
-                conn.unbind()
-                return True, "اتصال موفق"
-            else:
-                return False, "اتصال ناموفق"
+            with self._admin_connection() as conn:
+                if conn is not None:
+                    return True, "اتصال موفق"
+                else:
+                    return False, "اتصال ناموفق"
         except Exception as e:
             return False, f"خطا: {e}"
 
+    @_invalidates()
     def enable_user(self, username: str) -> bool:
         """فعال‌سازی حساب کاربر (nsAccountLock=FALSE)"""
         try:
             from ldap3 import MODIFY_REPLACE, MODIFY_DELETE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]})
-            try:
-                conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
-            except Exception:
-                pass
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]})
+                try:
+                    conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
+                except Exception:
+                    pass
+                return ok
         except Exception as e:
             logger.error(f"خطا در فعال‌سازی کاربر: {e}")
             return False
 
+    @_invalidates()
     def disable_user(self, username: str) -> bool:
         """غیرفعال‌سازی حساب کاربر (nsAccountLock=TRUE)"""
         try:
             from ldap3 import MODIFY_REPLACE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['TRUE'])]})
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['TRUE'])]})
         except Exception as e:
             logger.error(f"خطا در غیرفعال‌سازی کاربر: {e}")
             return False
 
+    @_invalidates()
     def unlock_user(self, username: str) -> bool:
         """آزاد کردن قفل کاربر: nsAccountLock=FALSE و پاک کردن شمارنده شکست"""
         try:
             from ldap3 import MODIFY_REPLACE, MODIFY_DELETE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]})
-            try:
-                conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
-            except Exception:
-                pass
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['FALSE'])]})
+                try:
+                    conn.modify(user_dn, {'krbLoginFailedCount': [(MODIFY_DELETE, [])]})
+                except Exception:
+                    pass
+                return ok
         except Exception as e:
             logger.error(f"خطا در Unlock کاربر: {e}")
             return False
 
+    @_invalidates()
     def lock_user(self, username: str) -> bool:
         """قفل کردن کاربر: nsAccountLock=TRUE"""
         try:
             from ldap3 import MODIFY_REPLACE
             config = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{config['base_dn']}"
-            conn = self._get_connection()
-            if not conn or not conn.bind():
-                return False
-            ok = conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['TRUE'])]})
-            conn.unbind()
-            return ok
+            with self._admin_connection() as conn:
+                if conn is None:
+                    return False
+                return conn.modify(user_dn, {'nsAccountLock': [(MODIFY_REPLACE, ['TRUE'])]})
         except Exception as e:
             logger.error(f"خطا در Lock کاربر: {e}")
             return False
@@ -484,21 +783,18 @@ class FreeIPAService:
         try:
             cfg = self._get_config()
             user_dn = f"uid={username},cn=users,cn=accounts,{cfg['base_dn']}"
-            server = Server(cfg['host'], port=cfg['port'], use_ssl=cfg['use_ssl'])
-            conn = Connection(server, user=user_dn, password=current_password)
-            # اگر SSL نداریم، StartTLS را اجرا کن تا خطای confidentialityRequired رفع شود
-            try:
-                if not cfg['use_ssl']:
-                    conn.open()
-                    conn.start_tls()
-            except Exception:
-                pass
-            if not conn.bind():
-                return False, 'نام کاربری یا رمز فعلی اشتباه است'
-            ok = conn.extend.standard.modify_password(user=None, old_password=current_password, new_password=new_password)
-            if not ok:
+            with self._pool().user_connection(user_dn, current_password) as conn:
+                # اگر SSL نداریم، StartTLS را اجرا کن تا خطای confidentialityRequired رفع شود
+                try:
+                    if not cfg['use_ssl'] and not conn.tls_started:
+                        conn.start_tls(read_server_info=False)
+                except Exception:
+                    pass
+                if not conn.bind(read_server_info=False):
+                    return False, 'نام کاربری یا رمز فعلی اشتباه است'
+                ok = conn.extend.standard.modify_password(user=None, old_password=current_password, new_password=new_password)
                 err = conn.result
-                conn.unbind()
+            if not ok:
                 # اگر محدودیت «Too soon to change password» بود، به صورت پیش‌فرض با دسترسی ادمین ریست کنیم
                 try:
                     from flask import current_app
@@ -511,7 +807,6 @@ class FreeIPAService:
                         return True, 'رمز توسط ادمین تنظیم شد (به علت محدودیت فاصله زمانی سیاست).'
                     return False, f"خطا در تغییر رمز (سیاست زمان حداقل): {admin_msg}"
                 return False, f"خطا در تغییر رمز: {err}"
-            conn.unbind()
             return True, 'رمز با موفقیت تغییر کرد'
         except Exception as e:
             logger.error(f"self change password error: {e}")
@@ -0,0 +1,415 @@
+"""
+آینه محلی دایرکتوری FreeIPA در جداول FreeIPAUser / FreeIPAGroup / FreeIPAUserGroup
+
+دور کامل: همه کاربران و گروه‌ها با paged search خوانده و به صورت دسته‌ای upsert
+می‌شوند؛ ردیف‌هایی که در دایرکتوری دیده نشده‌اند غیرفعال می‌شوند.
+دور افزایشی: فقط ورودی‌هایی که modifyTimestamp آن‌ها از watermark قبلی بزرگ‌تر
+یا مساوی است خوانده می‌شوند (حذف‌ها فقط در دور کامل تشخیص داده می‌شوند).
+عضویت‌ها از ویژگی member گروه‌ها (عضویت مستقیم کاربر) ساخته می‌شوند.
+تغییراتی که خود برنامه در FreeIPA می‌دهد (ایجاد، حذف، فعال/غیرفعال و قفل کاربر) با
+update_mirror_user همان لحظه روی آینه هم ثبت می‌شوند.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, FreeIPAUser, FreeIPAGroup, FreeIPAUserGroup, FreeIPASyncState
+
+logger = logging.getLogger(__name__)
+
+SCOPE = 'directory'
+# اجرای running قدیمی‌تر از این (مثلاً worker از کار افتاده) رها شده در نظر گرفته می‌شود
+STALE_RUN_SECONDS = 3600
+IN_CHUNK = 500
+
+USER_ATTRIBUTES = ['uid', 'cn', 'sn', 'givenName', 'mail', 'mobile', 'uidNumber', 'gidNumber',
+                   'homeDirectory', 'loginShell', 'nsAccountLock', 'modifyTimestamp']
+GROUP_ATTRIBUTES = ['cn', 'description', 'gidNumber', 'member', 'modifyTimestamp']
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freeipa-sync')
+
+
+def _raw(entry: Dict, name: str) -> List[str]:
+    """مقادیر خام ویژگی (مستقل از schema) به صورت رشته"""
+    values = (entry.get('raw_attributes') or {}).get(name) or []
+    return [v.decode('utf-8', 'replace') if isinstance(v, bytes) else str(v) for v in values]
+
+
+def _one(entry: Dict, name: str, default: Optional[str] = '') -> Optional[str]:
+    values = _raw(entry, name)
+    return values[0] if values else default
+
+
+def _chunks(items: List, size: int = IN_CHUNK) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _uid_from_dn(dn: str) -> Optional[str]:
+    """uid=jdoe,cn=users,cn=accounts,... → jdoe (سایر DNها، مثلاً گروه‌های تو در تو، None)"""
+    head, _, rest = dn.partition(',')
+    if not head.lower().startswith('uid=') or not rest.lower().startswith('cn=users,cn=accounts,'):
+        return None
+    return head[4:]
+
+
+def _user_mapping(entry: Dict, now: datetime) -> Optional[Dict]:
+    uid = _one(entry, 'uid')
+    if not uid:
+        return None
+    return {
+        'uid': uid,
+        'cn': _one(entry, 'cn') or uid,
+        'sn': _one(entry, 'sn'),
+        'givenname': _one(entry, 'givenName'),
+        'mail': _one(entry, 'mail'),
+        'mobile': _one(entry, 'mobile', None),
+        'uid_number': _one(entry, 'uidNumber', None),
+        'gid_number': _one(entry, 'gidNumber', None),
+        'home_directory': _one(entry, 'homeDirectory', None),
+        'login_shell': _one(entry, 'loginShell', None),
+        'is_active': _one(entry, 'nsAccountLock', 'FALSE').upper() != 'TRUE',
+        'is_deleted': False,
+        'updated_at': now,
+        'last_sync': now,
+    }
+
+
+def _group_mapping(entry: Dict, now: datetime) -> Optional[Dict]:
+    cn = _one(entry, 'cn')
+    if not cn:
+        return None
+    return {
+        'cn': cn,
+        'description': _one(entry, 'description', None),
+        'gid_number': _one(entry, 'gidNumber', None),
+        'is_active': True,
+        'updated_at': now,
+        'last_sync': now,
+    }
+
+
+def _upsert(model, key: str, mappings: List[Dict], now: datetime) -> Dict[str, int]:
+    """درج/به‌روزرسانی دسته‌ای بر اساس کلید یکتا؛ خروجی key → id"""
+    column = getattr(model, key)
+    keys = [m[key] for m in mappings]
+    existing = dict(db.session.query(column, model.id).filter(column.in_(keys)).all())
+    inserts, updates = [], []
+    for mapping in mappings:
+        if mapping[key] in existing:
+            updates.append(dict(mapping, id=existing[mapping[key]]))
+        else:
+            inserts.append(dict(mapping, created_at=now))
+    if inserts:
+        db.session.bulk_insert_mappings(model, inserts, return_defaults=True)
+        existing.update({m[key]: m['id'] for m in inserts})
+    if updates:
+        db.session.bulk_update_mappings(model, updates)
+    return existing
+
+
+def _sync_memberships(group_ids: Dict[str, int], members: Dict[str, List[str]], now: datetime) -> int:
+    """جایگزینی عضویت‌های مستقیم کاربر برای گروه‌های این دسته؛ خروجی تعداد تغییرات"""
+    uids = sorted({uid for dns in members.values() for uid in (_uid_from_dn(dn) for dn in dns) if uid})
+    user_ids: Dict[str, int] = {}
+    for chunk in _chunks(uids):
+        user_ids.update(db.session.query(FreeIPAUser.uid, FreeIPAUser.id).filter(FreeIPAUser.uid.in_(chunk)).all())
+
+    desired = set()
+    for cn, dns in members.items():
+        group_id = group_ids.get(cn)
+        if group_id is None:
+            continue
+        for dn in dns:
+            user_id = user_ids.get(_uid_from_dn(dn))
+            if user_id is not None:
+                desired.add((user_id, group_id))
+
+    existing: Dict[Tuple[int, int], int] = {}
+    for chunk in _chunks(list(group_ids.values())):
+        for row_id, user_id, group_id in db.session.query(
+            FreeIPAUserGroup.id, FreeIPAUserGroup.user_id, FreeIPAUserGroup.group_id
+        ).filter(FreeIPAUserGroup.group_id.in_(chunk)):
+            existing[(user_id, group_id)] = row_id
+
+    stale_ids = [row_id for pair, row_id in existing.items() if pair not in desired]
+    for chunk in _chunks(stale_ids):
+        FreeIPAUserGroup.query.filter(FreeIPAUserGroup.id.in_(chunk)).delete(synchronize_session=False)
+    new_rows = [{'user_id': u, 'group_id': g, 'created_at': now} for (u, g) in desired if (u, g) not in existing]
+    if new_rows:
+        db.session.bulk_insert_mappings(FreeIPAUserGroup, new_rows)
+    return len(stale_ids) + len(new_rows)
+
+
+def get_state(scope: str = SCOPE) -> FreeIPASyncState:
+    state = FreeIPASyncState.query.filter_by(scope=scope).first()
+    if state is None:
+        state = FreeIPASyncState(scope=scope, status='idle')
+        db.session.add(state)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # ایجاد همزمان در worker دیگر
+            db.session.rollback()
+            state = FreeIPASyncState.query.filter_by(scope=scope).first()
+    return state
+
+
+def _claim(state: FreeIPASyncState, mode: str) -> bool:
+    """علامت‌گذاری اتمیک running تا دو worker همزمان sync اجرا نکنند"""
+    now = datetime.utcnow()
+    claimed = FreeIPASyncState.query.filter(
+        FreeIPASyncState.id == state.id,
+        or_(FreeIPASyncState.status != 'running',
+            FreeIPASyncState.started_at == None,  # noqa: E711
+            FreeIPASyncState.started_at < now - timedelta(seconds=STALE_RUN_SECONDS))
+    ).update({'status': 'running', 'mode': mode, 'started_at': now, 'finished_at': None,
+              'error_message': None}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _timestamp_filter(base_filter: str, watermark: Optional[str]) -> str:
+    if not watermark:
+        return base_filter
+    return f"(&{base_filter}(modifyTimestamp>={watermark}))"
+
+
+def _run_pass(service, search_base: str, search_filter: str, attributes: List[str],
+              build, flush, batch_size: int, now: datetime) -> Tuple[int, Optional[str]]:
+    """پیمایش paged و فراخوانی flush برای هر دسته؛ خروجی (تعداد، بیشترین modifyTimestamp)"""
+    count = 0
+    watermark = None
+    batch: List[Tuple[Dict, Dict]] = []
+    for entry in service.paged_search(search_base, search_filter, attributes, batch_size):
+        mapping = build(entry, now)
+        if mapping is None:
+            continue
+        stamp = _one(entry, 'modifyTimestamp', None)
+        if stamp and (watermark is None or stamp > watermark):
+            watermark = stamp
+        batch.append((mapping, entry))
+        if len(batch) >= batch_size:
+            flush(batch)
+            db.session.commit()
+            count += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        db.session.commit()
+        count += len(batch)
+    return count, watermark
+
+
+def run_sync(app, full: Optional[bool] = None, service=None) -> Dict:
+    """یک دور همگام‌سازی (نیازمند app context)؛ full=None یعنی انتخاب خودکار"""
+    if service is None:
+        from freeipa_service import freeipa_service as service
+    if not hasattr(service, 'paged_search'):
+        raise RuntimeError('سرویس FreeIPA فعلی از paged search پشتیبانی نمی‌کند (حالت Mock)')
+
+    batch_size = int(app.config.get('FREEIPA_SYNC_BATCH_SIZE', 500))
+    full_every = timedelta(hours=float(app.config.get('FREEIPA_SYNC_FULL_INTERVAL_HOURS', 24)))
+    state = get_state()
+    if full is None:
+        full = (not state.last_full_sync or not state.user_watermark
+                or datetime.utcnow() - state.last_full_sync > full_every)
+    mode = 'full' if full else 'incremental'
+    if not _claim(state, mode):
+        return {'skipped': True, 'reason': 'sync already running'}
+
+    started = datetime.utcnow()
+    base_dn = service._get_config()['base_dn']
+    ok, message = service.test_connection()
+    if not ok:
+        state = get_state()
+        state.status = 'failed'
+        state.error_message = message
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise RuntimeError(f'اتصال به FreeIPA برقرار نشد: {message}')
+    summary = {'mode': mode, 'users': 0, 'groups': 0, 'memberships_changed': 0, 'deactivated': 0}
+    try:
+        state = get_state()
+
+        def flush_users(batch):
+            _upsert(FreeIPAUser, 'uid', [m for m, _ in batch], started)
+
+        def flush_groups(batch):
+            ids = _upsert(FreeIPAGroup, 'cn', [m for m, _ in batch], started)
+            members = {m['cn']: _raw(entry, 'member') for m, entry in batch}
+            summary['memberships_changed'] += _sync_memberships(ids, members, started)
+
+        users, user_mark = _run_pass(
+            service, f"cn=users,cn=accounts,{base_dn}",
+            _timestamp_filter('(objectClass=person)', None if full else state.user_watermark),
+            USER_ATTRIBUTES, _user_mapping, flush_users, batch_size, started)
+        groups, group_mark = _run_pass(
+            service, f"cn=groups,cn=accounts,{base_dn}",
+            _timestamp_filter('(objectClass=groupOfNames)', None if full else state.group_watermark),
+            GROUP_ATTRIBUTES, _group_mapping, flush_groups, batch_size, started)
+        summary['users'], summary['groups'] = users, groups
+
+        if full and users:
+            # ورودی‌هایی که در این دور دیده نشده‌اند در دایرکتوری حذف شده‌اند
+            # (نتیجه خالی به احتمال زیاد خطای اتصال/دسترسی است و چیزی غیرفعال نمی‌شود)
+            unseen = or_(FreeIPAUser.last_sync == None, FreeIPAUser.last_sync < started)  # noqa: E711
+            # کاربر حذف‌شده از کاربر قفل‌شده (is_active=False با is_deleted=False) جداست
+            gone_users = [uid for (uid,) in db.session.query(FreeIPAUser.id).filter(
+                unseen, or_(FreeIPAUser.is_deleted == None, FreeIPAUser.is_deleted == False))]  # noqa: E711,E712
+            gone_groups = [gid for (gid,) in db.session.query(FreeIPAGroup.id).filter(
+                or_(FreeIPAGroup.last_sync == None, FreeIPAGroup.last_sync < started),  # noqa: E711
+                FreeIPAGroup.is_active == True)]  # noqa: E712
+            for chunk in _chunks(gone_users):
+                FreeIPAUser.query.filter(FreeIPAUser.id.in_(chunk)).update({'is_active': False, 'is_deleted': True},
+                                                                          synchronize_session=False)
+                FreeIPAUserGroup.query.filter(FreeIPAUserGroup.user_id.in_(chunk)).delete(synchronize_session=False)
+            for chunk in _chunks(gone_groups):
+                FreeIPAGroup.query.filter(FreeIPAGroup.id.in_(chunk)).update({'is_active': False}, synchronize_session=False)
+                FreeIPAUserGroup.query.filter(FreeIPAUserGroup.group_id.in_(chunk)).delete(synchronize_session=False)
+            summary['deactivated'] = len(gone_users) + len(gone_groups)
+
+        finished = datetime.utcnow()
+        state = get_state()
+        # watermark فقط پس از ذخیره موفق جلو می‌رود
+        if user_mark and (not state.user_watermark or user_mark > state.user_watermark):
+            state.user_watermark = user_mark
+        if group_mark and (not state.group_watermark or group_mark > state.group_watermark):
+            state.group_watermark = group_mark
+        state.status = 'completed'
+        state.users_synced = users
+        state.groups_synced = groups
+        state.memberships_changed = summary['memberships_changed']
+        state.deactivated = summary['deactivated']
+        state.finished_at = finished
+        if full:
+            state.last_full_sync = finished
+        else:
+            state.last_incremental_sync = finished
+        db.session.commit()
+        summary['duration_ms'] = int((finished - started).total_seconds() * 1000)
+        logger.info(f"FreeIPA mirror sync: {summary}")
+        return summary
+    except Exception as e:
+        db.session.rollback()
+        state = get_state()
+        state.status = 'failed'
+        state.error_message = str(e)
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+
+def enqueue_sync(app, full: Optional[bool] = None):
+    """اجرای sync در worker پس‌زمینه"""
+    return _executor.submit(_run_sync_job, app, full)
+
+
+def _run_sync_job(app, full: Optional[bool]):
+    with app.app_context():
+        try:
+            run_sync(app, full=full)
+        except Exception as e:
+            logger.error(f"FreeIPA mirror sync failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def update_mirror_user(uid: str, **values) -> bool:
+    """ثبت تغییری که برنامه خودش در FreeIPA داده روی ردیف آینه کاربر (ایجاد/حذف/فعال/قفل)
+
+    تا دور sync بعدی لیست‌های آینه همان وضعیت LDAP را نشان می‌دهند. خطا فقط لاگ می‌شود
+    چون عملیات LDAP پیش از این انجام شده است.
+    """
+    now = datetime.utcnow()
+    values.update({'updated_at': now, 'last_sync': now})
+    try:
+        updated = FreeIPAUser.query.filter_by(uid=uid).update(values, synchronize_session=False)
+        db.session.commit()
+        return updated > 0
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"FreeIPA mirror update for {uid} failed: {e}")
+        return False
+
+
+def mirror_ready() -> bool:
+    """آیا حداقل یک دور کامل انجام شده تا لیست‌ها از دیتابیس محلی خوانده شوند؟"""
+    state = FreeIPASyncState.query.filter_by(scope=SCOPE).first()
+    return bool(state and state.last_full_sync)
+
+
+def _like(query: Optional[str]) -> Optional[str]:
+    query = (query or '').strip()
+    if not query:
+        return None
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _page_dict(pagination, items: List[Dict]) -> Dict:
+    return {
+        'items': items,
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'has_prev': pagination.has_prev,
+        'has_next': pagination.has_next,
+        'total': pagination.total,
+    }
+
+
+def search_mirror_users(query: Optional[str] = None, page: int = 1, per_page: int = 50) -> Dict:
+    """یک صفحه از کاربران آینه محلی با همان ساختار FreeIPAService.search_users
+
+    کاربران حذف‌شده در FreeIPA کنار گذاشته می‌شوند؛ کاربران قفل‌شده با is_active=False می‌آیند.
+    """
+    q = FreeIPAUser.query.filter(FreeIPAUser.last_sync != None,  # noqa: E711
+                                 or_(FreeIPAUser.is_deleted == None, FreeIPAUser.is_deleted == False))  # noqa: E711,E712
+    pattern = _like(query)
+    if pattern:
+        q = q.filter(or_(FreeIPAUser.uid.ilike(pattern, escape='\\'),
+                         FreeIPAUser.cn.ilike(pattern, escape='\\'),
+                         FreeIPAUser.mail.ilike(pattern, escape='\\')))
+    pagination = q.order_by(FreeIPAUser.uid).paginate(page=page, per_page=per_page, error_out=False)
+    ids = [u.id for u in pagination.items]
+    groups: Dict[int, List[str]] = {}
+    if ids:
+        for user_id, cn in db.session.query(FreeIPAUserGroup.user_id, FreeIPAGroup.cn).join(
+            FreeIPAGroup, FreeIPAGroup.id == FreeIPAUserGroup.group_id
+        ).filter(FreeIPAUserGroup.user_id.in_(ids)).order_by(FreeIPAGroup.cn):
+            groups.setdefault(user_id, []).append(cn)
+    items = [{
+        'username': u.uid,
+        'full_name': u.cn,
+        'email': u.mail or '',
+        'groups': groups.get(u.id, []),
+        'is_active': bool(u.is_active),
+    } for u in pagination.items]
+    return _page_dict(pagination, items)
+
+
+def search_mirror_groups(query: Optional[str] = None, page: int = 1, per_page: int = 50) -> Dict:
+    """یک صفحه از گروه‌های آینه محلی با همان ساختار FreeIPAService.search_groups"""
+    q = FreeIPAGroup.query.filter(FreeIPAGroup.last_sync != None, FreeIPAGroup.is_active == True)  # noqa: E711,E712
+    pattern = _like(query)
+    if pattern:
+        q = q.filter(or_(FreeIPAGroup.cn.ilike(pattern, escape='\\'),
+                         FreeIPAGroup.description.ilike(pattern, escape='\\')))
+    pagination = q.order_by(FreeIPAGroup.cn).paginate(page=page, per_page=per_page, error_out=False)
+    ids = [g.id for g in pagination.items]
+    counts: Dict[int, int] = {}
+    if ids:
+        counts = dict(db.session.query(FreeIPAUserGroup.group_id, func.count(FreeIPAUserGroup.user_id))
+                      .filter(FreeIPAUserGroup.group_id.in_(ids)).group_by(FreeIPAUserGroup.group_id))
+    items = [{
+        'cn': g.cn,
+        'description': g.description or '',
+        'gid_number': g.gid_number or '',
+        'member_count': counts.get(g.id, 0),
+    } for g in pagination.items]
+    return _page_dict(pagination, items)
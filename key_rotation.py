@@ -0,0 +1,203 @@
+"""
+بازرمزنگاری رمزهای ذخیره‌شده با کلید اصلی جدید (چرخش کلید CREDENTIALS_KEYS)
+
+روند چرخش: کلید جدید در ابتدای CREDENTIALS_KEYS قرار می‌گیرد و کلیدهای قبلی پشت آن
+می‌مانند، پس از راه‌اندازی مجدد همه پروسه‌ها نوشتن با کلید جدید انجام می‌شود و خواندن
+مقادیر قدیمی همچنان کار می‌کند. سپس این job هر ستون را به ترتیب کلید اصلی در دسته‌های
+KEY_ROTATION_BATCH_SIZE تایی (yield_per) می‌خواند، مقادیر Fernet که با کلید اصلی نیستند را
+بازگشایی و دوباره رمز می‌کند و با یک executemany شرطی (فقط اگر مقدار در این فاصله عوض
+نشده باشد) می‌نویسد. پس از هر دسته last_id در KeyRotationState ثبت می‌شود و اجرای بعدی از
+همان‌جا ادامه می‌دهد؛ وقتی همه ستون‌ها completed شدند کلیدهای قدیمی قابل حذف‌اند.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy import bindparam, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Credential, FreeIPAServer, KeyRotationState, UserPassword
+from utils.crypto import KEY_ID_SEPARATOR, get_key_ring, is_encrypted_token
+
+logger = logging.getLogger(__name__)
+
+STALE_RUN_SECONDS = 3600
+
+# target → (مدل، ستون، فیلتر اضافه)؛ رمزهای vault کاربر (encrypted_with=user) با DEK خود کاربر هستند
+TARGETS = {
+    'credential.password_encrypted': (Credential, 'password_encrypted',
+                                      lambda: or_(Credential.encrypted_with == None,  # noqa: E711
+                                                  Credential.encrypted_with == 'global')),
+    'freeipaserver.bind_password': (FreeIPAServer, 'bind_password', None),
+    'userpassword.password': (UserPassword, 'password', None),
+}
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='key-rotation')
+
+
+def get_state(target: str) -> KeyRotationState:
+    state = KeyRotationState.query.filter_by(target=target).first()
+    if state is None:
+        state = KeyRotationState(target=target, status='idle', last_id=0)
+        db.session.add(state)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            state = KeyRotationState.query.filter_by(target=target).first()
+    return state
+
+
+def _claim(state: KeyRotationState) -> bool:
+    """علامت‌گذاری اتمیک running تا دو worker همزمان یک ستون را پردازش نکنند"""
+    now = datetime.utcnow()
+    claimed = KeyRotationState.query.filter(
+        KeyRotationState.id == state.id,
+        or_(KeyRotationState.status != 'running',
+            KeyRotationState.started_at == None,  # noqa: E711
+            KeyRotationState.started_at < now - timedelta(seconds=STALE_RUN_SECONDS))
+    ).update({'status': 'running', 'started_at': now, 'finished_at': None, 'error_message': None},
+             synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def _swap_statement(model, column: str):
+    """UPDATE ... SET column=:new WHERE id=:id AND column=:old (updated_at دست نمی‌خورد)"""
+    table = model.__table__
+    values = {column: bindparam('b_new')}
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at
+    return (table.update()
+            .where(table.c.id == bindparam('b_id'))
+            .where(table.c[column] == bindparam('b_old'))
+            .values(values))
+
+
+def _rotate_target(app, target: str, ring, batch_size: int, pause: float, restart: bool) -> Dict:
+    model, column, extra = TARGETS[target]
+    state = get_state(target)
+    if restart or state.key_id != ring.primary_id:
+        state.key_id = ring.primary_id
+        state.status = 'idle'
+        state.last_id = 0
+        state.rotated = state.skipped = state.failed = 0
+        db.session.commit()
+    elif state.status == 'completed':
+        return dict(state.to_dict(), skipped_run=True)
+    if not _claim(state):
+        return {'target': target, 'skipped_run': True, 'reason': 'already running'}
+
+    pk = model.id
+    value_column = getattr(model, column)
+    statement = _swap_statement(model, column)
+    try:
+        while True:
+            last_id = state.last_id or 0
+            query = db.session.query(pk, value_column).filter(pk > last_id)
+            if extra is not None:
+                query = query.filter(extra())
+            rows = query.order_by(pk).limit(batch_size).yield_per(min(batch_size, 500))
+            updates: List[Dict] = []
+            skipped = failed = 0
+            for row_id, value in rows:
+                last_id = row_id
+                if not is_encrypted_token(value) or not ring.needs_rotation(value):
+                    skipped += 1
+                    continue
+                try:
+                    updates.append({'b_id': row_id, 'b_old': value, 'b_new': ring.rotate(value)})
+                except InvalidToken:
+                    failed += 1
+            if last_id == (state.last_id or 0):
+                break
+            if updates:
+                db.session.execute(statement, updates)
+            # checkpoint همراه همان تراکنش دسته
+            state.last_id = last_id
+            state.rotated = (state.rotated or 0) + len(updates)
+            state.skipped = (state.skipped or 0) + skipped
+            state.failed = (state.failed or 0) + failed
+            db.session.commit()
+            if failed:
+                logger.warning(f"Key rotation {target}: {failed} value(s) up to id {last_id} could not be decrypted")
+            if pause:
+                time.sleep(pause)
+        state.status = 'completed'
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        return state.to_dict()
+    except Exception as e:
+        db.session.rollback()
+        state = get_state(target)
+        state.status = 'failed'
+        state.error_message = str(e)
+        state.finished_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+
+def run_reencryption(app, targets: Optional[List[str]] = None, batch_size: Optional[int] = None,
+                     restart: bool = False) -> Dict:
+    """بازرمزنگاری همه ستون‌ها با کلید اصلی فعلی؛ قابل ادامه پس از توقف (نیازمند app context)"""
+    ring = get_key_ring()
+    if ring is None:
+        raise RuntimeError('کلید رمزنگاری تنظیم نشده است')
+    if ring.primary_id is None:
+        raise RuntimeError('برای چرخش کلید CREDENTIALS_KEYS با شناسه کلید لازم است')
+    batch_size = int(batch_size or app.config.get('KEY_ROTATION_BATCH_SIZE', 500))
+    pause = float(app.config.get('KEY_ROTATION_PAUSE_MS', 0)) / 1000
+    unknown = [t for t in (targets or []) if t not in TARGETS]
+    if unknown:
+        raise ValueError(f"Unknown targets: {', '.join(unknown)}")
+    started = time.perf_counter()
+    summary = {'key_id': ring.primary_id, 'targets': {}}
+    for target in targets or list(TARGETS):
+        summary['targets'][target] = _rotate_target(app, target, ring, batch_size, pause, restart)
+    summary['duration_ms'] = int((time.perf_counter() - started) * 1000)
+    logger.info(f"Key rotation: {summary}")
+    return summary
+
+
+def enqueue_reencryption(app, restart: bool = False):
+    """اجرای بازرمزنگاری در worker پس‌زمینه"""
+    return _executor.submit(_run_reencryption_job, app, restart)
+
+
+def _run_reencryption_job(app, restart: bool):
+    with app.app_context():
+        try:
+            run_reencryption(app, restart=restart)
+        except Exception as e:
+            logger.error(f"Key rotation failed: {e}")
+        finally:
+            db.session.remove()
+
+
+def rotation_status() -> Dict:
+    """وضعیت حلقه کلید، checkpoint هر ستون و تعداد مقادیری که هنوز با کلید اصلی نیستند"""
+    ring = get_key_ring()
+    status = {
+        'ready': ring is not None,
+        'primary_key_id': ring.primary_id if ring else None,
+        'key_ids': [k for k in ring.keys if k is not None] if ring else [],
+        'targets': {},
+    }
+    for target, (model, column, extra) in TARGETS.items():
+        state = KeyRotationState.query.filter_by(target=target).first()
+        item = state.to_dict() if state else {'target': target, 'status': 'idle'}
+        if ring is not None and ring.primary_id is not None:
+            value_column = getattr(model, column)
+            query = db.session.query(db.func.count(model.id)).filter(
+                value_column != None,  # noqa: E711
+                ~value_column.like(ring.primary_id.replace('_', '\\_') + KEY_ID_SEPARATOR + '%', escape='\\'))
+            if extra is not None:
+                query = query.filter(extra())
+            # شامل هش‌ها و مقادیر غیر Fernet هم هست (این‌ها بازرمزنگاری نمی‌شوند)
+            item['not_on_primary'] = query.scalar() or 0
+        status['targets'][target] = item
+    return status
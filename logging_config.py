@@ -51,6 +51,23 @@ def setup_logging(app):
         app.logger.addHandler(file_handler)
     app.logger.addHandler(console_handler)
     
+    # لاگ ساخت‌یافته عملیات LDAP (freeipa_metrics.py): یک JSON در هر خط در ldap.log کنار LOG_FILE
+    ldap_logger = logging.getLogger('freeipa.ldap')
+    ldap_logger.setLevel(getattr(logging, str(app.config.get('FREEIPA_LDAP_LOG_LEVEL', 'INFO')).upper(), logging.INFO))
+    ldap_logger.propagate = False
+    if not ldap_logger.handlers:
+        try:
+            ldap_handler = logging.handlers.RotatingFileHandler(
+                os.path.join(log_dir or '.', 'ldap.log'),
+                maxBytes=10*1024*1024,  # 10MB
+                backupCount=5,
+                encoding='utf-8'
+            )
+        except Exception:
+            ldap_handler = logging.StreamHandler()
+        ldap_handler.setFormatter(logging.Formatter('%(message)s'))
+        ldap_logger.addHandler(ldap_handler)
+    
     # تنظیم logger برای SQLAlchemy
     logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
     logging.getLogger('sqlalchemy.pool').setLevel(logging.WARNING)
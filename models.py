@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 import base64
@@ -101,15 +102,112 @@ class Server(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     ip_address = db.Column(db.String(50), nullable=False)
+    # نمایش عددی نرمال‌شده IP برای جستجوی بازه‌ای CIDR (hex با طول ثابت: 8 برای IPv4، 32 برای IPv6)
+    ip_version = db.Column(db.SmallInteger)
+    ip_value = db.Column(db.String(32))
     os_type = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(20), nullable=False)  # فعال، غیرفعال، در حال بررسی
     description = db.Column(db.Text)
+    # پیوند با host entry در FreeIPA (freeipa_hosts.py)؛ freeipa_missing یعنی host دیگر در دایرکتوری نیست
+    freeipa_fqdn = db.Column(db.String(255))
+    freeipa_missing = db.Column(db.Boolean, default=False)
+    freeipa_missing_since = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_server_ip_version_value', 'ip_version', 'ip_value'),
+        db.Index('ix_server_freeipa_fqdn', 'freeipa_fqdn'),
+    )
+    
+    @validates('ip_address')
+    def _sync_ip_value(self, key, value):
+        """به‌روزرسانی ip_version/ip_value همزمان با ip_address"""
+        from utils.ipaddr import ip_sort_key
+        self.ip_version, self.ip_value = ip_sort_key(value)
+        return value
     
     def __repr__(self):
         return f'<Server {self.name}>'
 
+class ServerStatusCheck(db.Model):
+    """تاریخچه فشرده بررسی دسترس‌پذیری سرورها"""
+    __tablename__ = 'server_status_check'
+
+    id = db.Column(db.Integer, primary_key=True)
+    server_id = db.Column(db.Integer, db.ForeignKey('server.id', ondelete='CASCADE'), nullable=False)
+    checked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    is_up = db.Column(db.Boolean, nullable=False)
+    method = db.Column(db.String(8))  # icmp, tcp
+    port = db.Column(db.Integer)  # پورت موفق در روش tcp
+    latency_ms = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_server_status_check_server_checked', 'server_id', 'checked_at'),
+        db.Index('ix_server_status_check_checked_at', 'checked_at'),
+    )
+
+    def __repr__(self):
+        return f'<ServerStatusCheck {self.server_id} {"up" if self.is_up else "down"}>'
+
+class ServerImportJob(db.Model):
+    """کار پس‌زمینه ایمپورت سرورها از فایل Excel/CSV"""
+    id = db.Column(db.Integer, primary_key=True)
+    file_name = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    sheet_name = db.Column(db.String(100))
+    dry_run = db.Column(db.Boolean, default=False)
+    update_on_conflict = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    created = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    issues = db.Column(db.Text)  # JSON list (حداکثر ۲۰۰ مورد)
+    error_message = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)  # heartbeat worker (کار رهاشده با heartbeat کهنه failed می‌شود)
+
+    creator = db.relationship('User', backref='server_import_jobs')
+
+    def get_issues_list(self):
+        """دریافت لیست خطاها/یادداشت‌ها"""
+        import json
+        if self.issues:
+            try:
+                return json.loads(self.issues)
+            except Exception:
+                return []
+        return []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'file_name': self.file_name,
+            'status': self.status,
+            'dry_run': bool(self.dry_run),
+            'update_on_conflict': bool(self.update_on_conflict),
+            'total': self.total or 0,
+            'processed': self.processed or 0,
+            'created': self.created or 0,
+            'updated': self.updated or 0,
+            'skipped': self.skipped or 0,
+            'errors': self.errors or 0,
+            'issues': self.get_issues_list(),
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ServerImportJob {self.id} {self.status}>'
+
 class Task(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -380,7 +478,8 @@ class FreeIPAUser(db.Model):
     gid_number = db.Column(db.String(20))  # GID Number
     home_directory = db.Column(db.String(500))  # مسیر home
     login_shell = db.Column(db.String(100), default='/bin/bash')
-    is_active = db.Column(db.Boolean, default=True)
+    is_active = db.Column(db.Boolean, default=True)  # False: قفل (nsAccountLock) یا حذف‌شده
+    is_deleted = db.Column(db.Boolean, default=False)  # در همگام‌سازی کامل در FreeIPA یافت نشد
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_sync = db.Column(db.DateTime)  # آخرین همگام‌سازی با FreeIPA
@@ -419,12 +518,226 @@ class FreeIPAUserGroup(db.Model):
     group = db.relationship('FreeIPAGroup', backref='group_users')
     
     # Unique constraint
-    __table_args__ = (db.UniqueConstraint('user_id', 'group_id', name='uq_user_group'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'group_id', name='uq_user_group'),
+        db.Index('ix_freeipausergroup_group_id', 'group_id'),
+    )
     
     def __repr__(self):
         return f'<FreeIPAUserGroup {self.user.uid} -> {self.group.cn}>'
 
 
+class FreeIPASyncState(db.Model):
+    """وضعیت همگام‌سازی آینه محلی دایرکتوری FreeIPA (freeipa_sync.py)"""
+    __tablename__ = 'freeipa_sync_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(50), nullable=False, unique=True, default='directory')
+    status = db.Column(db.String(20), nullable=False, default='idle')  # idle, running, completed, failed
+    mode = db.Column(db.String(20))  # full, incremental
+    # بیشترین modifyTimestamp دیده‌شده (GeneralizedTime مانند 20250101120000Z)
+    user_watermark = db.Column(db.String(32))
+    group_watermark = db.Column(db.String(32))
+    users_synced = db.Column(db.Integer, default=0)
+    groups_synced = db.Column(db.Integer, default=0)
+    memberships_changed = db.Column(db.Integer, default=0)
+    deactivated = db.Column(db.Integer, default=0)
+    # شمارنده‌های اختصاصی هر scope به صورت JSON (مثلاً نتیجه همگام‌سازی hostها)
+    details = db.Column(db.Text)
+    error_message = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    last_full_sync = db.Column(db.DateTime)
+    last_incremental_sync = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'scope': self.scope,
+            'status': self.status,
+            'mode': self.mode,
+            'user_watermark': self.user_watermark,
+            'group_watermark': self.group_watermark,
+            'users_synced': self.users_synced or 0,
+            'groups_synced': self.groups_synced or 0,
+            'memberships_changed': self.memberships_changed or 0,
+            'deactivated': self.deactivated or 0,
+            'details': self.get_details(),
+            'error_message': self.error_message,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'last_full_sync': self.last_full_sync.isoformat() if self.last_full_sync else None,
+            'last_incremental_sync': self.last_incremental_sync.isoformat() if self.last_incremental_sync else None,
+        }
+    
+    def get_details(self):
+        import json
+        try:
+            return json.loads(self.details) if self.details else {}
+        except Exception:
+            return {}
+    
+    def __repr__(self):
+        return f'<FreeIPASyncState {self.scope} {self.status}>'
+
+
+class KeyRotationState(db.Model):
+    """checkpoint بازرمزنگاری هر ستون رمز با کلید اصلی جدید (key_rotation.py)"""
+    __tablename__ = 'key_rotation_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    target = db.Column(db.String(100), nullable=False, unique=True)  # table.column
+    key_id = db.Column(db.String(32))  # کلید اصلی هدف این دور
+    status = db.Column(db.String(20), nullable=False, default='idle')  # idle, running, completed, failed
+    last_id = db.Column(db.Integer, default=0)  # آخرین کلید اصلی پردازش‌شده (ادامه از همین‌جا)
+    rotated = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)  # هش/متن غیر Fernet یا از قبل با کلید اصلی
+    failed = db.Column(db.Integer, default=0)  # با هیچ کلیدی بازگشایی نشد
+    error_message = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'target': self.target,
+            'key_id': self.key_id,
+            'status': self.status,
+            'last_id': self.last_id or 0,
+            'rotated': self.rotated or 0,
+            'skipped': self.skipped or 0,
+            'failed': self.failed or 0,
+            'error_message': self.error_message,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<KeyRotationState {self.target} {self.status}>'
+
+
+class FreeIPAProvisionJob(db.Model):
+    """کار پس‌زمینه ایجاد گروهی کاربران FreeIPA از فایل Excel/CSV (freeipa_provision.py)"""
+    __tablename__ = 'freeipa_provision_job'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_name = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    sheet_name = db.Column(db.String(100))
+    dry_run = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    total = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    created = db.Column(db.Integer, default=0)
+    existing = db.Column(db.Integer, default=0)  # کاربر از قبل در FreeIPA بوده
+    invalid = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)  # شامل ایجاد ناقص (رمز/گروه)
+    report = db.Column(db.Text)  # JSON: نتیجه هر ردیف
+    timings = db.Column(db.Text)  # JSON: زمان هر مرحله و throughput
+    error_message = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)  # heartbeat worker (کار رهاشده با heartbeat کهنه failed می‌شود)
+    
+    creator = db.relationship('User', backref='freeipa_provision_jobs')
+    
+    def _load(self, value, default):
+        import json
+        if value:
+            try:
+                return json.loads(value)
+            except Exception:
+                return default
+        return default
+    
+    def get_report(self):
+        return self._load(self.report, [])
+    
+    def get_timings(self):
+        return self._load(self.timings, {})
+    
+    def to_dict(self, include_report=False):
+        data = {
+            'id': self.id,
+            'file_name': self.file_name,
+            'status': self.status,
+            'dry_run': bool(self.dry_run),
+            'total': self.total or 0,
+            'processed': self.processed or 0,
+            'created': self.created or 0,
+            'existing': self.existing or 0,
+            'invalid': self.invalid or 0,
+            'failed': self.failed or 0,
+            'timings': self.get_timings(),
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if include_report:
+            data['report'] = self.get_report()
+        return data
+    
+    def __repr__(self):
+        return f'<FreeIPAProvisionJob {self.id} {self.status}>'
+
+
+class FreeIPAAccessRule(db.Model):
+    """قوانین HBAC/sudo FreeIPA با کاربران و hostهای باز‌شده (freeipa_access.py)"""
+    __tablename__ = 'freeipa_access_rule'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)  # hbac, sudo
+    cn = db.Column(db.String(255), nullable=False)
+    enabled = db.Column(db.Boolean, default=True)
+    # userCategory/hostCategory=all: به جای فهرست همه کاربران/hostها فقط پرچم ذخیره می‌شود
+    all_users = db.Column(db.Boolean, default=False)
+    all_hosts = db.Column(db.Boolean, default=False)
+    users = db.Column(db.Text)  # JSON: uidها (گروه‌های تو در تو باز‌شده)
+    hosts = db.Column(db.Text)  # JSON: fqdnها (hostgroupهای تو در تو باز‌شده)
+    services = db.Column(db.Text)  # JSON: سرویس‌ها/گروه‌های سرویس HBAC یا ['all']
+    modify_timestamp = db.Column(db.String(32))
+    last_sync = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'cn', name='uq_freeipa_access_rule_kind_cn'),
+    )
+    
+    def _load(self, value):
+        import json
+        try:
+            return json.loads(value) if value else []
+        except Exception:
+            return []
+    
+    def get_users(self):
+        return self._load(self.users)
+    
+    def get_hosts(self):
+        return self._load(self.hosts)
+    
+    def get_services(self):
+        return self._load(self.services)
+    
+    def to_dict(self, include_members=False):
+        data = {
+            'kind': self.kind,
+            'cn': self.cn,
+            'enabled': bool(self.enabled),
+            'all_users': bool(self.all_users),
+            'all_hosts': bool(self.all_hosts),
+            'services': self.get_services(),
+            'modify_timestamp': self.modify_timestamp,
+        }
+        if include_members:
+            data['users'] = self.get_users()
+            data['hosts'] = self.get_hosts()
+        return data
+    
+    def __repr__(self):
+        return f'<FreeIPAAccessRule {self.kind}:{self.cn}>'
+
+
 class UserPassword(db.Model):
     """ذخیره پسوردهای کاربران برای ارسال پیامک"""
     __tablename__ = 'userpassword'
@@ -447,6 +760,31 @@ class UserPassword(db.Model):
         from werkzeug.security import generate_password_hash
         self.password = generate_password_hash(password)
     
+    @staticmethod
+    def encrypt_value(password):
+        """مقدار ذخیره‌شده: Fernet (قابل بازگشایی برای SMS) در صورت وجود CREDENTIALS_KEY، وگرنه هش"""
+        try:
+            from utils.crypto import encrypt_text
+            enc = encrypt_text(password)
+            if enc:
+                return enc
+        except Exception:
+            pass
+        from werkzeug.security import generate_password_hash
+        return generate_password_hash(password)
+    
+    def set_encrypted_password(self, password):
+        """رمزنگاری متقارن (برای ارسال بعدی با SMS)"""
+        self.password = self.encrypt_value(password)
+    
+    def get_decrypted_password(self):
+        """بازگشایی رمز؛ برای مقدار هش‌شده None برمی‌گرداند"""
+        try:
+            from utils.crypto import decrypt_text
+            return decrypt_text(self.password)
+        except Exception:
+            return None
+    
     def set_password_raw(self, password):
         """ذخیره متن‌واضح (برای ارسال SMS بعدی) - هشدار: فقط موقت استفاده شود"""
         self.password = password
@@ -477,7 +815,14 @@ class SMSTemplate(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
+
+    @validates('template')
+    def _compile_template(self, key, value):
+        """متن قالب پیش از ذخیره کامپایل می‌شود؛ قالب نامعتبر TemplateError می‌دهد"""
+        from sms_templates import CompiledTemplate
+        CompiledTemplate(value)
+        return value
+
     def get_variables_list(self):
         """دریافت لیست متغیرها"""
         import json
@@ -493,6 +838,11 @@ class SMSTemplate(db.Model):
         import json
         self.variables = json.dumps(variables_list) if variables_list else None
     
+    def render(self, **context):
+        """رندر با نسخه کامپایل‌شده قالب (cache بر اساس id و updated_at)"""
+        from sms_templates import template_cache
+        return template_cache.get(self).render(context)
+    
     def __repr__(self):
         return f'<SMSTemplate {self.name}>'
 
@@ -507,16 +857,41 @@ class SMSLog(db.Model):
     message = db.Column(db.Text, nullable=False)
     template_id = db.Column(db.Integer, db.ForeignKey('smstemplate.id'))
     provider = db.Column(db.String(50), nullable=False)  # kavenegar, melipayamak, sms_ir
-    status = db.Column(db.String(20), nullable=False)  # sent, failed, pending
+    status = db.Column(db.String(20), nullable=False)  # pending, sending, sent, failed, unknown (نتیجه ارسال نامشخص؛ تکرار نمی‌شود)
     message_id = db.Column(db.String(100))  # ID پیام از سرویس دهنده
     error_message = db.Column(db.Text)  # پیام خطا در صورت عدم ارسال
     cost = db.Column(db.Float)  # هزینه ارسال
     sent_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # صف ارسال (sms_queue.py): تعداد تلاش، زمان تلاش بعدی و worker در حال ارسال
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
     
     user = db.relationship('FreeIPAUser', backref='sms_logs')
     template = db.relationship('SMSTemplate', backref='sms_logs')
     
+    __table_args__ = (
+        db.Index('ix_smslog_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'phone_number': self.phone_number,
+            'provider': self.provider,
+            'status': self.status,
+            'attempts': self.attempts or 0,
+            'message_id': self.message_id,
+            'error_message': self.error_message,
+            'cost': self.cost,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+    
     def __repr__(self):
         return f'<SMSLog {self.user.uid} - {self.status}>'
 
@@ -0,0 +1,170 @@
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app  # type: ignore
+from freeipa_client import FreeIPAClient  # type: ignore
+from freeipa_metrics import ldap_metrics  # type: ignore
+from freeipa_mock import MockLDAPDirectory  # type: ignore
+from freeipa_service import FreeIPAService  # type: ignore
+
+
+OPERATIONS = ["auth", "info", "list", "members", "membership", "groups", "password", "client_info", "client_groups"]
+
+
+def percentile(values, pct):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def build_operations(service, directory, uids, groups):
+	local = threading.local()
+
+	def client():
+		# FreeIPAClient یک اتصال نگه می‌دارد و thread-safe نیست: یک کلاینت برای هر thread
+		if getattr(local, "client", None) is None:
+			local.client = FreeIPAClient(directory.host, port=389, use_ssl=False, base_dn=directory.base_dn,
+				bind_dn=directory.bind_dn, bind_password=directory.admin_password)
+		return local.client
+
+	def group_change(uid, group):
+		return service.add_user_to_group(uid, group) and service.remove_user_from_group(uid, group)
+
+	def client_group_change(uid, group):
+		c = client()
+		return c.add_user_to_group(uid, group)[0] and c.remove_user_from_group(uid, group)[0]
+
+	return {
+		"auth": lambda uid, group: service.authenticate_user(uid, directory.users[uid])[0],
+		"info": lambda uid, group: service.get_user_info(uid) is not None,
+		"list": lambda uid, group: bool(service.search_users(None, random.randint(1, 5), 50)["items"]),
+		"members": lambda uid, group: bool(service.search_group_members(group, 1, 50)["items"]),
+		"membership": lambda uid, group: service.is_user_in_group(uid, "ipausers"),
+		"groups": group_change,
+		# همان رمز دوباره تنظیم می‌شود تا auth در ادامه معتبر بماند
+		"password": lambda uid, group: service.set_user_password(uid, directory.users[uid])[0],
+		"client_info": lambda uid, group: client().get_user(uid) is not None,
+		"client_groups": client_group_change,
+	}
+
+
+def run_operation(app, func, uids, groups, count, threads):
+	latencies = []
+	errors = [0]
+	lock = threading.Lock()
+
+	def worker(n):
+		uid = random.choice(uids)
+		group = random.choice(groups)
+		started = time.perf_counter()
+		with app.app_context():
+			try:
+				ok = func(uid, group)
+			except Exception:
+				ok = False
+		elapsed = (time.perf_counter() - started) * 1000
+		with lock:
+			latencies.append(elapsed)
+			if not ok:
+				errors[0] += 1
+
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=threads) as executor:
+		list(executor.map(worker, range(count)))
+	wall = time.perf_counter() - started
+	return {
+		"count": count,
+		"errors": errors[0],
+		"wall_s": round(wall, 3),
+		"ops_per_s": round(count / wall, 1) if wall else 0.0,
+		"p50_ms": round(percentile(latencies, 50), 2),
+		"p95_ms": round(percentile(latencies, 95), 2),
+		"p99_ms": round(percentile(latencies, 99), 2),
+		"max_ms": round(max(latencies) if latencies else 0.0, 2),
+	}
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Benchmark FreeIPAService/FreeIPAClient LDAP paths against an in-process FreeIPA stand-in"
+	)
+	parser.add_argument("--users", type=int, default=20000, help="Seeded users (default 20000)")
+	parser.add_argument("--groups", type=int, default=200, help="Seeded groups besides admins/ipausers (default 200)")
+	parser.add_argument("--members", type=int, default=100, help="Direct user members per seeded group (default 100)")
+	parser.add_argument("--threads", type=int, default=8, help="Concurrent callers (default 8)")
+	parser.add_argument("--ops", type=int, default=200, help="Calls per operation (default 200)")
+	parser.add_argument(
+		"--only",
+		default=",".join(OPERATIONS),
+		help=f"Comma separated operations to run: {','.join(OPERATIONS)}",
+	)
+	parser.add_argument("--cache", action="store_true", help="Keep FREEIPA_CACHE_TTL (read cache) enabled")
+	parser.add_argument("--seed", type=int, default=1, help="Random seed for data and call mix")
+	parser.add_argument("--load", help="Load extra entries from an ldap3 JSON dump before running")
+	parser.add_argument("--json", action="store_true", help="Print results as JSON")
+	parser.add_argument("--verbose", action="store_true", help="Keep per-call INFO logging")
+
+	args = parser.parse_args()
+	selected = [op.strip() for op in args.only.split(",") if op.strip()]
+	unknown = [op for op in selected if op not in OPERATIONS]
+	if unknown:
+		print(f"Unknown operations: {', '.join(unknown)}")
+		return 1
+	random.seed(args.seed)
+
+	directory = MockLDAPDirectory()
+	started = time.perf_counter()
+	seeded = directory.seed(users=args.users, groups=args.groups, members_per_group=args.members, seed=args.seed)
+	if args.load:
+		seeded["loaded"] = directory.load_json(args.load)
+	seeded["seed_s"] = round(time.perf_counter() - started, 2)
+
+	app = create_app()
+	app.config.update(directory.app_config())
+	app.config["FREEIPA_POOL_SIZE"] = max(args.threads, int(app.config.get("FREEIPA_POOL_SIZE", 8)))
+	if not args.cache:
+		app.config["FREEIPA_CACHE_TTL"] = 0
+	if not args.verbose:
+		for name in ("freeipa_service", "freeipa_pool", "freeipa_membership", "freeipa_client"):
+			logging.getLogger(name).setLevel(logging.WARNING)
+
+	# نمونه جدا از freeipa_service سراسری تا FREEIPA_USE_MOCK روی بنچمارک اثر نگذارد
+	service = FreeIPAService()
+	uids = sorted(directory.users)
+	groups = sorted(g for g in directory.groups if g not in ("admins", "ipausers"))
+	operations = build_operations(service, directory, uids, groups)
+	results = {}
+	with directory:
+		for name in selected:
+			results[name] = run_operation(app, operations[name], uids, groups, args.ops, args.threads)
+			if not args.json:
+				r = results[name]
+				print(
+					f"{name:<14} ops={r['count']:<6} err={r['errors']:<4} {r['ops_per_s']:>8}/s  "
+					f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms max={r['max_ms']}ms",
+					flush=True,
+				)
+
+	# تعداد/زمان عملیات LDAP پشت همه اجراها (open و bind یعنی اتصال تازه)
+	ldap = {
+		name: {key: h[key] for key in ("count", "errors", "entries", "avg_ms", "p95_ms")}
+		for name, h in ldap_metrics.snapshot()["operations"].items()
+	}
+	if args.json:
+		print(json.dumps({"directory": seeded, "threads": args.threads, "results": results, "ldap": ldap}))
+	else:
+		for name, h in ldap.items():
+			print(f"ldap {name:<12} count={h['count']:<7} err={h['errors']:<4} entries={h['entries']:<8} avg={h['avg_ms']}ms p95<={h['p95_ms']}ms")
+		print(json.dumps({"directory": seeded, "threads": args.threads}))
+	return 0 if not any(r["errors"] for r in results.values()) else 2
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,245 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sms_mock import PROVIDERS, MockSMSProvider  # type: ignore
+from sms_service import SMSService, close_sessions  # type: ignore
+
+
+MODES = ["send", "bulk", "queue"]
+
+
+def percentile(values, pct):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def summarize(latencies, wall, count, outcomes):
+	return {
+		"messages": count,
+		"wall_s": round(wall, 3),
+		"msgs_per_s": round(count / wall, 1) if wall else 0.0,
+		"p50_ms": round(percentile(latencies, 50), 2),
+		"p95_ms": round(percentile(latencies, 95), 2),
+		"p99_ms": round(percentile(latencies, 99), 2),
+		"max_ms": round(max(latencies) if latencies else 0.0, 2),
+		"outcomes": outcomes,
+	}
+
+
+def phone(n):
+	return f"0912{n:07d}"
+
+
+def run_send(config, provider, count, threads):
+	"""ارسال تکی SMSService.send_sms با threads فراخوانی همزمان (مسیر کارگرهای صف بدون DB)"""
+	service = SMSService.from_config(config, provider)
+	latencies = []
+	outcomes = {}
+	lock = threading.Lock()
+
+	def worker(n):
+		started = time.perf_counter()
+		result = service.send_sms(phone(n), f"bench message {n}")
+		elapsed = (time.perf_counter() - started) * 1000
+		key = "sent" if result.get("success") else ("retryable" if result.get("retryable") else ("unknown" if result.get("unknown") else "failed"))
+		with lock:
+			latencies.append(elapsed)
+			outcomes[key] = outcomes.get(key, 0) + 1
+
+	started = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=threads) as executor:
+		list(executor.map(worker, range(count)))
+	return summarize(latencies, time.perf_counter() - started, count, outcomes)
+
+
+def run_bulk(config, provider, count, threads, batch):
+	"""SMSService.send_bulk روی دسته‌های batch تایی؛ تأخیر هر پیام = زمان فراخوانی دسته‌اش"""
+	service = SMSService.from_config(config, provider)
+	messages = [(phone(n), f"bench message {n}") for n in range(count)]
+	chunks = [messages[i:i + batch] for i in range(0, count, batch)]
+	latencies = []
+	outcomes = {}
+	lock = threading.Lock()
+
+	def worker(chunk):
+		started = time.perf_counter()
+		results = service.send_bulk(chunk, max_workers=threads)
+		elapsed = (time.perf_counter() - started) * 1000
+		with lock:
+			for result in results:
+				latencies.append(elapsed)
+				key = "sent" if result.get("success") else ("retryable" if result.get("retryable") else ("unknown" if result.get("unknown") else "failed"))
+				outcomes[key] = outcomes.get(key, 0) + 1
+
+	started = time.perf_counter()
+	# برای ارائه‌دهنده بدون endpoint گروهی همزمانی داخل send_bulk است
+	with ThreadPoolExecutor(max_workers=max(1, threads // 4)) as executor:
+		list(executor.map(worker, chunks))
+	return summarize(latencies, time.perf_counter() - started, count, outcomes)
+
+
+def run_queue(config, provider, count, threads, timeout):
+	"""مسیر کامل: ثبت ردیف pending در SMSLog، dispatcher/کارگرهای sms_queue تا sent/failed"""
+	from datetime import datetime
+	from app import create_app  # type: ignore
+	from models import db, FreeIPAUser, SMSLog  # type: ignore
+	from sms_queue import sms_queue  # type: ignore
+
+	# DATABASE_URL در main به پایگاه داده موقت اشاره می‌کند؛ dispatcher فقط ردیف‌های بنچمارک را claim می‌کند
+	app = create_app("production")
+	app.config.update(config)
+	app.config.update(SMS_WORKERS=threads, SMS_QUEUE_AUTOSTART=False)
+	with app.app_context():
+		db.create_all()
+		user = FreeIPAUser.query.filter_by(uid="bench").first()
+		if user is None:
+			user = FreeIPAUser(uid="bench", cn="bench", sn="bench", givenname="bench", mail="bench@example.com")
+			db.session.add(user)
+			db.session.commit()
+		user_id = user.id
+		first_id = (db.session.query(db.func.max(SMSLog.id)).scalar() or 0) + 1
+		now = datetime.utcnow()
+		db.session.bulk_insert_mappings(SMSLog, [
+			{"user_id": user_id, "phone_number": phone(n), "message": f"bench message {n}", "provider": provider,
+			 "status": "pending", "attempts": 0, "created_at": now}
+			for n in range(count)
+		])
+		db.session.commit()
+		db.session.remove()
+
+	started = time.perf_counter()
+	sms_queue.start(app)
+	drained = sms_queue.drain(app, timeout=timeout)
+	wall = time.perf_counter() - started
+	sms_queue.stop()
+
+	with app.app_context():
+		rows = db.session.query(SMSLog.status, SMSLog.attempts, SMSLog.created_at, SMSLog.sent_at).filter(
+			SMSLog.id >= first_id, SMSLog.provider == provider).all()
+		latencies = [(sent - created).total_seconds() * 1000 for _, _, created, sent in rows if sent]
+		outcomes = {}
+		for status, attempts, _, _ in rows:
+			outcomes[status] = outcomes.get(status, 0) + 1
+		result = summarize(latencies, wall, count, outcomes)
+		result["drained"] = drained
+		result["attempts"] = sum(attempts or 0 for _, attempts, _, _ in rows)
+		db.session.remove()
+		db.engine.dispose()
+	return result
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Benchmark SMSService / sms_queue send paths against a local SMS provider stand-in"
+	)
+	parser.add_argument("--providers", default=",".join(PROVIDERS), help=f"Comma separated providers: {','.join(PROVIDERS)}")
+	parser.add_argument("--mode", choices=MODES, default="send", help="send: SMSService.send_sms, bulk: send_bulk, queue: SMSLog queue end to end")
+	parser.add_argument("--messages", type=int, default=1000, help="Messages per provider (default 1000)")
+	parser.add_argument("--threads", type=int, default=16, help="Concurrent senders / SMS_WORKERS (default 16)")
+	parser.add_argument("--batch", type=int, default=200, help="Recipients per send_bulk call in bulk mode (default 200)")
+	parser.add_argument("--latency-ms", type=float, default=50, help="Stand-in base latency per request (default 50)")
+	parser.add_argument("--jitter-ms", type=float, default=20, help="Mean of exponential extra latency (default 20)")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+	parser.add_argument("--reject-rate", type=float, default=0.0, help="Fraction of messages rejected by the provider")
+	parser.add_argument("--rate-limit", type=float, default=0, help="Stand-in requests/s per provider before 429 (0: none)")
+	parser.add_argument("--token-ttl", type=float, default=1800, help="Stand-in sms.ir token lifetime in seconds")
+	parser.add_argument("--client-rate", type=float, default=0, help="SMS_RATE_LIMITS for every provider in queue mode (0: none)")
+	parser.add_argument("--retry-base", type=float, default=0.2, help="SMS_RETRY_BASE_SECONDS in queue mode (default 0.2)")
+	parser.add_argument("--timeout", type=float, default=300, help="Maximum seconds to drain the queue")
+	parser.add_argument("--keep", action="store_true", help="Keep the temporary queue-mode database and print its path")
+	parser.add_argument("--seed", type=int, default=1, help="Random seed for injected latency/errors")
+	parser.add_argument("--serve", action="store_true", help="Only run the stand-in (use its SMS_<PROVIDER>_BASE_URL values)")
+	parser.add_argument("--port", type=int, default=0, help="Stand-in port (default: random free port)")
+	parser.add_argument("--target", help="Use a stand-in already running elsewhere (--serve), e.g. http://127.0.0.1:8025")
+	parser.add_argument("--json", action="store_true", help="Print results as JSON")
+	parser.add_argument("--verbose", action="store_true", help="Keep per-message retry/failure logging")
+
+	args = parser.parse_args()
+	providers = [p.strip() for p in args.providers.split(",") if p.strip()]
+	unknown = [p for p in providers if p not in PROVIDERS]
+	if unknown:
+		print(f"Unknown providers: {', '.join(unknown)}")
+		return 1
+
+	if not args.verbose:
+		for name in ("sms_queue", "sms_service"):
+			logging.getLogger(name).setLevel(logging.ERROR)
+
+	mock = None if args.target else MockSMSProvider(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+		reject_rate=args.reject_rate, rate_limit=args.rate_limit, token_ttl=args.token_ttl, port=args.port, seed=args.seed)
+	config = {
+		"SMS_CONNECT_TIMEOUT": 5,
+		"SMS_READ_TIMEOUT": 30,
+		"SMS_WORKERS": args.threads,
+		"SMS_RATE_LIMITS": ",".join(f"{p}={args.client_rate}" for p in PROVIDERS) if args.client_rate else "",
+		"SMS_RETRY_BASE_SECONDS": args.retry_base,
+		"SMS_RETRY_MAX_SECONDS": max(args.retry_base * 16, 1),
+		"SMS_QUEUE_POLL_INTERVAL": 0.2,
+	}
+	database = None
+	if args.mode == "queue" and not args.serve:
+		# صف روی پایگاه داده برنامه اجرا نمی‌شود: dispatcher هر ردیف pending موجود را ارسال می‌کند
+		fd, database = tempfile.mkstemp(prefix="bench_sms_", suffix=".db")
+		os.close(fd)
+		os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+	results = {}
+	with mock or contextlib.nullcontext():
+		if mock is not None:
+			config.update(mock.app_config())
+		else:
+			# stand-in در پروسه جدا (--serve): client و سرور برای GIL رقابت نمی‌کنند؛ آمار سمت سرور در دسترس نیست
+			config.update({f"SMS_{p.upper()}_BASE_URL": f"{args.target.rstrip('/')}/{p}" for p in PROVIDERS})
+		config.setdefault("SMS_API_KEY", "mock-api-key")
+		config.setdefault("SMS_SENDER", "10004346")
+		if args.serve and mock is not None:
+			for key, value in mock.app_config().items():
+				print(f"{key}={value}", flush=True)
+			try:
+				while True:
+					time.sleep(5)
+					print(json.dumps(mock.stats()), flush=True)
+			except KeyboardInterrupt:
+				return 0
+		for provider in providers:
+			if mock is not None:
+				mock.reset_stats()
+			if args.mode == "send":
+				r = run_send(config, provider, args.messages, args.threads)
+			elif args.mode == "bulk":
+				r = run_bulk(config, provider, args.messages, args.threads, args.batch)
+			else:
+				r = run_queue(config, provider, args.messages, args.threads, args.timeout)
+			r["server"] = mock.stats()[provider] if mock is not None else {}
+			results[provider] = r
+			if not args.json:
+				s = r["server"]
+				print(
+					f"{provider:<12} {args.mode:<5} n={r['messages']:<6} {r['msgs_per_s']:>8}/s  "
+					f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms max={r['max_ms']}ms  "
+					f"{json.dumps(r['outcomes'])} http={s.get('requests')} 429={s.get('rate_limited')} 503={s.get('errors')}",
+					flush=True,
+				)
+	close_sessions()
+	if database is not None:
+		if args.keep:
+			print(f"SMSLog rows kept in {database}", file=sys.stderr)
+		else:
+			os.remove(database)
+
+	if args.json:
+		print(json.dumps({"mode": args.mode, "threads": args.threads, "results": results}))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,37 @@
+import argparse
+import json
+import sys
+
+from app import create_app  # type: ignore
+from server_monitor import run_forever, run_sweep  # type: ignore
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Probe reachability of all servers (ICMP/TCP) and update their status"
+	)
+	parser.add_argument(
+		"--loop",
+		action="store_true",
+		help="Run continuously every SERVER_MONITOR_INTERVAL seconds",
+	)
+	parser.add_argument(
+		"--interval",
+		type=int,
+		help="Override sweep interval in seconds (minimum 30)",
+	)
+
+	args = parser.parse_args()
+
+	app = create_app()
+	if args.loop:
+		run_forever(app, interval=args.interval)
+		return 0
+	with app.app_context():
+		summary = run_sweep(app)
+	print(json.dumps(summary))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
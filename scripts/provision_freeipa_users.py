@@ -0,0 +1,89 @@
+import argparse
+import csv
+import json
+import sys
+
+from app import create_app  # type: ignore
+from freeipa_provision import provision_users  # type: ignore
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Create FreeIPA users (with initial passwords and groups) from Excel/CSV"
+	)
+	parser.add_argument("file", help="Path to Excel (.xlsx) or CSV file")
+	parser.add_argument(
+		"--sheet",
+		dest="sheet_name",
+		help="Excel sheet name (if multiple). Ignored for CSV",
+	)
+	parser.add_argument(
+		"--dry-run",
+		action="store_true",
+		help="Validate all rows without creating anything",
+	)
+	parser.add_argument(
+		"--workers",
+		type=int,
+		help="Concurrent workers (default FREEIPA_PROVISION_WORKERS, capped by FREEIPA_POOL_SIZE)",
+	)
+	parser.add_argument(
+		"--created-by",
+		help="Username of the local account the initial passwords are recorded under (required unless --dry-run)",
+	)
+	parser.add_argument(
+		"--report",
+		help="Write the per-row result report to this CSV file",
+	)
+
+	args = parser.parse_args()
+
+	app = create_app()
+	with app.app_context():
+		created_by = None
+		if not args.dry_run:
+			from models import User  # type: ignore
+			user = User.query.filter_by(username=args.created_by).first() if args.created_by else None
+			if user is None:
+				print("--created-by must name an existing local user")
+				return 1
+			created_by = user.id
+		try:
+			stats, report, timings = provision_users(
+				file_path=args.file,
+				sheet_name=args.sheet_name,
+				dry_run=args.dry_run,
+				created_by=created_by,
+				workers=args.workers,
+			)
+		except ValueError as e:
+			# Missing required columns
+			print(e)
+			return 1
+		except Exception as e:
+			print(f"Provisioning failed: {e}")
+			return 1
+
+	print(
+		f"Processed: {stats['processed']}, Created: {stats['created']}, Existing: {stats['existing']}, "
+		f"Invalid: {stats['invalid']}, Failed/partial: {stats['failed']}"
+	)
+	print(json.dumps(timings))
+	problems = [r for r in report if r['status'] not in ('created', 'valid')]
+	for r in problems[:50]:
+		print(f"- Row {r['row']} {r['uid']}: {r['status']} {r['message']}")
+	if len(problems) > 50:
+		print(f"... and {len(problems)-50} more")
+
+	if args.report:
+		with open(args.report, "w", newline="", encoding="utf-8-sig") as fh:
+			writer = csv.writer(fh)
+			writer.writerow(["row", "uid", "status", "password_set", "password_stored", "groups", "ms", "message"])
+			for r in report:
+				writer.writerow([r["row"], r["uid"], r["status"], r["password_set"], r["password_stored"], ";".join(r["groups"]), r["ms"], r["message"]])
+
+	return 0 if not stats["failed"] else 2
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,58 @@
+import argparse
+import json
+import sys
+
+from utils.crypto import generate_key  # type: ignore
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Re-encrypt stored secrets with the primary CREDENTIALS_KEYS key (resumable)"
+	)
+	parser.add_argument(
+		"--generate-key",
+		metavar="KEY_ID",
+		help="Print a new CREDENTIALS_KEYS entry (KEY_ID:<fernet key>) to put first in the ring, then exit",
+	)
+	parser.add_argument(
+		"--status",
+		action="store_true",
+		help="Show key ring, per-column checkpoints and values not yet on the primary key",
+	)
+	parser.add_argument(
+		"--target",
+		action="append",
+		help="Only this column (repeatable): credential.password_encrypted, freeipaserver.bind_password, userpassword.password",
+	)
+	parser.add_argument(
+		"--batch-size",
+		type=int,
+		help="Override KEY_ROTATION_BATCH_SIZE (rows per chunk/checkpoint)",
+	)
+	parser.add_argument(
+		"--restart",
+		action="store_true",
+		help="Ignore saved checkpoints and scan from the first row again",
+	)
+
+	args = parser.parse_args()
+	if args.generate_key:
+		print(f"{args.generate_key}:{generate_key()}")
+		return 0
+
+	from app import create_app  # type: ignore
+	from key_rotation import rotation_status, run_reencryption  # type: ignore
+
+	app = create_app()
+	with app.app_context():
+		if args.status:
+			print(json.dumps(rotation_status(), indent=2))
+			return 0
+		summary = run_reencryption(app, targets=args.target, batch_size=args.batch_size, restart=args.restart)
+		print(json.dumps(summary))
+		failed = sum(t.get("failed", 0) for t in summary["targets"].values())
+	return 0 if not failed else 2
+
+
+if __name__ == "__main__":
+	sys.exit(main())
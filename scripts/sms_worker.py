@@ -0,0 +1,60 @@
+import argparse
+import json
+import signal
+import sys
+import time
+
+from app import create_app  # type: ignore
+from models import db  # type: ignore
+from sms_queue import queue_counts, sms_queue  # type: ignore
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Deliver queued SMS messages (SMSLog rows with status=pending)"
+	)
+	parser.add_argument(
+		"--workers",
+		type=int,
+		help="Override SMS_WORKERS (concurrent sends in this process)",
+	)
+	parser.add_argument(
+		"--drain",
+		action="store_true",
+		help="Exit once no pending (including scheduled retries) or in-flight messages remain",
+	)
+	parser.add_argument(
+		"--timeout",
+		type=float,
+		default=600,
+		help="Maximum seconds to wait in --drain mode",
+	)
+
+	args = parser.parse_args()
+
+	app = create_app()
+	if args.workers:
+		app.config["SMS_WORKERS"] = max(1, args.workers)
+	sms_queue.start(app)
+
+	if args.drain:
+		done = sms_queue.drain(app, timeout=args.timeout)
+		with app.app_context():
+			print(json.dumps(queue_counts()))
+			db.session.remove()
+		sms_queue.stop()
+		return 0 if done else 1
+
+	stop = []
+	signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+	try:
+		while not stop:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pass
+	sms_queue.stop()
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+import time
+
+from app import create_app  # type: ignore
+from models import db  # type: ignore
+from freeipa_sync import run_sync  # type: ignore
+from freeipa_hosts import run_host_sync  # type: ignore
+from freeipa_access import run_access_sync  # type: ignore
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(
+		description="Mirror FreeIPA users/groups/memberships into the local database"
+	)
+	parser.add_argument(
+		"--full",
+		action="store_true",
+		help="Force a full pass (otherwise incremental by modifyTimestamp when possible)",
+	)
+	parser.add_argument(
+		"--loop",
+		action="store_true",
+		help="Run continuously every FREEIPA_SYNC_INTERVAL seconds",
+	)
+	parser.add_argument(
+		"--hosts",
+		action="store_true",
+		help="Also sync FreeIPA host entries into the server inventory",
+	)
+	parser.add_argument(
+		"--access",
+		action="store_true",
+		help="Also rebuild the HBAC/sudo access matrix (skipped when rules and groups are unchanged)",
+	)
+	parser.add_argument(
+		"--interval",
+		type=int,
+		help="Override sync interval in seconds (minimum 60)",
+	)
+
+	args = parser.parse_args()
+
+	app = create_app()
+	if not args.loop:
+		with app.app_context():
+			summary = run_sync(app, full=True if args.full else None)
+			print(json.dumps(summary))
+			if args.hosts:
+				print(json.dumps(run_host_sync(app)))
+			if args.access:
+				print(json.dumps(run_access_sync(app, full=True if args.full else None)))
+		return 0
+
+	interval = max(60, int(args.interval or app.config.get("FREEIPA_SYNC_INTERVAL", 300)))
+	full = True if args.full else None
+	while True:
+		started = time.monotonic()
+		with app.app_context():
+			try:
+				print(json.dumps(run_sync(app, full=full)), flush=True)
+			except Exception as e:
+				print(f"Sync failed: {e}", file=sys.stderr, flush=True)
+			finally:
+				db.session.remove()
+			if args.hosts:
+				try:
+					print(json.dumps(run_host_sync(app)), flush=True)
+				except Exception as e:
+					print(f"Host sync failed: {e}", file=sys.stderr, flush=True)
+				finally:
+					db.session.remove()
+			if args.access:
+				try:
+					print(json.dumps(run_access_sync(app, full=full)), flush=True)
+				except Exception as e:
+					print(f"Access sync failed: {e}", file=sys.stderr, flush=True)
+				finally:
+					db.session.remove()
+		# فقط دور اول اجباری کامل است؛ بعدی‌ها خودکار انتخاب می‌شوند
+		full = None
+		time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+خروجی گرفتن از فهرست سرورها به صورت CSV/XLSX (streaming)
+
+ردیف‌ها با yield_per خوانده می‌شوند و مقادیر فیلدهای سفارشی برای هر دسته با یک
+کوئری واکشی می‌شوند؛ بنابراین مصرف حافظه مستقل از تعداد سرورهاست.
+متن‌هایی که با = + - @ (یا tab/CR) شروع می‌شوند در Excel/LibreOffice فرمول می‌شوند
+(CSV injection): در CSV با ' شروع می‌شوند و در XLSX صریحاً از نوع متن نوشته می‌شوند.
+"""
+
+import csv
+import io
+import os
+import tempfile
+from typing import Iterator, List
+
+from models import db, Server, CustomField, CustomFieldValue
+
+BASE_COLUMNS = [
+    ('name', 'name'),
+    ('ip_address', 'ip_address'),
+    ('os_type', 'os_type'),
+    ('status', 'status'),
+    ('description', 'description'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _is_formula_like(value) -> bool:
+    return isinstance(value, str) and value.startswith(FORMULA_PREFIXES)
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    return "'" + value if _is_formula_like(value) else value
+
+
+def _server_custom_fields() -> List[CustomField]:
+    return CustomField.query.filter_by(model_name='Server', is_active=True).order_by(CustomField.order).all()
+
+
+def header_row(custom_fields: List[CustomField]) -> List[str]:
+    return ['id'] + [label for _, label in BASE_COLUMNS] + [f.label for f in custom_fields]
+
+
+def iter_server_rows(servers_query, custom_fields: List[CustomField], batch_size: int = 1000) -> Iterator[list]:
+    """ردیف‌های خروجی (لیست مقادیر) با خواندن دسته‌ای سرورها و فیلدهای سفارشی"""
+    columns = [Server.id] + [getattr(Server, attr) for attr, _ in BASE_COLUMNS]
+    rows = servers_query.with_entities(*columns).order_by(Server.id).yield_per(batch_size)
+    field_ids = [f.id for f in custom_fields]
+
+    def emit(batch):
+        values = {}
+        if field_ids:
+            # یک کوئری برای کل دسته به جای یک کوئری برای هر سرور
+            for record_id, field_id, value in db.session.query(
+                CustomFieldValue.record_id, CustomFieldValue.field_id, CustomFieldValue.value
+            ).filter(
+                CustomFieldValue.model_name == 'Server',
+                CustomFieldValue.record_id.in_([r[0] for r in batch]),
+                CustomFieldValue.field_id.in_(field_ids)
+            ):
+                values[(record_id, field_id)] = value
+        for r in batch:
+            base = [v.isoformat(sep=' ', timespec='seconds') if hasattr(v, 'isoformat') else v for v in r]
+            yield base + [values.get((r[0], fid), '') for fid in field_ids]
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from emit(batch)
+            batch = []
+    if batch:
+        yield from emit(batch)
+
+
+def generate_csv(servers_query, batch_size: int = 1000) -> Iterator[str]:
+    """تولید تدریجی CSV؛ BOM برای نمایش درست متن فارسی در Excel"""
+    custom_fields = _server_custom_fields()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([_csv_cell(v) for v in header_row(custom_fields)])
+    yield '\ufeff' + buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+    count = 0
+    for row in iter_server_rows(servers_query, custom_fields, batch_size):
+        writer.writerow([_csv_cell(v) for v in row])
+        count += 1
+        if count % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def generate_xlsx(servers_query, batch_size: int = 1000) -> Iterator[bytes]:
+    """ساخت XLSX با workbook از نوع write_only (ردیف‌ها روی دیسک) و ارسال فایل به صورت chunk"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    def cells(values):
+        for value in values:
+            if _is_formula_like(value):
+                # مقدار همان متن می‌ماند ولی به جای فرمول به صورت رشته ذخیره می‌شود
+                cell = WriteOnlyCell(sheet, value=value)
+                cell.data_type = 's'
+                yield cell
+            else:
+                yield value
+
+    custom_fields = _server_custom_fields()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Servers')
+    sheet.append(list(cells(header_row(custom_fields))))
+    for row in iter_server_rows(servers_query, custom_fields, batch_size):
+        sheet.append(list(cells(row)))
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
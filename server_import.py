@@ -0,0 +1,335 @@
+"""
+ایمپورت سرورها از فایل Excel/CSV (مشترک بین CLI و وب)
+
+اجرای وب به صورت کار پس‌زمینه خارج از thread درخواست gunicorn انجام می‌شود و
+وضعیت/شمارنده‌ها در جدول ServerImportJob نگه داشته می‌شود تا همه workerها
+بتوانند پیشرفت را گزارش دهند. کار با claim اتمیک pending→running شروع می‌شود و
+heartbeat آن (updated_at) با پیشرفت تازه می‌شود؛ recover_stale_jobs فقط کارهای با
+heartbeat کهنه را failed می‌کند و پایان کار وضعیت ثبت‌شده توسط آن را بازنویسی نمی‌کند.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+from sqlalchemy import func
+
+from models import db, Server, ServerImportJob
+from utils.ipaddr import ip_sort_key
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = [
+    "name",
+    "ip_address",
+    "os_type",
+    "status",
+]
+
+DESCRIPTION_COLUMNS = ("description", "desc", "شرح")
+
+ALLOWED_IMPORT_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+
+MAX_STORED_ISSUES = 200
+
+# یک worker در هر پروسه تا ایمپورت‌های همزمان روی هم نیفتند
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='server-import')
+
+# کار pending/running که heartbeat آن (updated_at) در این مدت تازه نشده worker زنده‌ای ندارد
+# (restart/deploy)؛ کارهای صف‌شده پشت یک ایمپورت طولانی با heartbeat همان کار تازه می‌مانند
+STALE_HEARTBEAT_SECONDS = 600
+HEARTBEAT_SECONDS = 30
+# کارهای صف‌شده و در حال اجرای همین پروسه
+_owned: Set[int] = set()
+_owned_lock = threading.Lock()
+
+
+def normalize_columns(columns: List[str]) -> List[str]:
+    """Lowercase and strip spaces/underscores for matching."""
+    return [
+        c.strip().lower().replace(" ", "_") if isinstance(c, str) else c for c in columns
+    ]
+
+
+def build_column_map(headers: List[str]) -> Dict[str, str]:
+    """Map required logical names to actual dataframe column names (case-insensitive)."""
+    normalized = normalize_columns(headers)
+    actual_by_norm = {n: orig for n, orig in zip(normalized, headers)}
+    col_map: Dict[str, str] = {}
+    for req in REQUIRED_COLUMNS:
+        if req in actual_by_norm:
+            col_map[req] = actual_by_norm[req]
+    for cand in DESCRIPTION_COLUMNS:
+        norm = normalize_columns([cand])[0]
+        if norm in actual_by_norm:
+            col_map["description"] = actual_by_norm[norm]
+            break
+    return col_map
+
+
+def validate_required_columns(col_map: Dict[str, str]) -> Optional[str]:
+    missing = [c for c in REQUIRED_COLUMNS if c not in col_map]
+    if missing:
+        return f"Missing required columns in Excel: {', '.join(missing)}"
+    return None
+
+
+def read_servers_file(file_path: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
+    """خواندن فایل Excel/CSV به DataFrame"""
+    if file_path.lower().endswith(".csv"):
+        return pd.read_csv(file_path)
+    # sheet_name=None در pandas یعنی همه شیت‌ها؛ پیش‌فرض شیت اول است
+    return pd.read_excel(file_path, sheet_name=sheet_name or 0)  # requires openpyxl
+
+
+def _cell(row, col: Optional[str]) -> str:
+    if not col:
+        return ""
+    value = row[col]
+    return str(value).strip() if pd.notna(value) else ""
+
+
+def import_servers_frame(
+    df: pd.DataFrame,
+    update_on_conflict: bool,
+    dry_run: bool,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+    batch_size: int = 500,
+) -> Tuple[Dict[str, int], List[str]]:
+    """ایمپورت ردیف‌های DataFrame در جدول Server.
+
+    تطبیق تکراری‌ها ابتدا با نام و سپس با IP انجام می‌شود. به جای یک کوئری به ازای
+    هر ردیف، نگاشت نام/IP یک بار از دیتابیس خوانده می‌شود و نوشتن‌ها به صورت
+    دسته‌ای (bulk) و در commitهای batch_size تایی انجام می‌شود.
+    """
+    stats = {'processed': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+    issues: List[str] = []
+
+    col_map = build_column_map(list(df.columns))
+    err = validate_required_columns(col_map)
+    if err:
+        raise ValueError(err)
+
+    # نگاشت‌های موجود: name -> id و ip -> id
+    by_name: Dict[str, object] = {}
+    by_ip: Dict[str, object] = {}
+    for sid, name, ip in db.session.query(Server.id, Server.name, Server.ip_address).yield_per(1000):
+        by_name.setdefault(name, sid)
+        by_ip.setdefault(ip, sid)
+
+    pending_inserts: List[Dict] = []
+    pending_updates: Dict[object, Dict] = {}
+
+    def flush_batch():
+        if dry_run:
+            pending_inserts.clear()
+            pending_updates.clear()
+            return
+        if pending_inserts:
+            db.session.bulk_insert_mappings(Server, pending_inserts, return_defaults=True)
+            for mapping in pending_inserts:
+                # جایگزینی کلید موقت با id واقعی برای تطبیق ردیف‌های بعدی
+                if by_name.get(mapping['name']) is mapping:
+                    by_name[mapping['name']] = mapping['id']
+                if by_ip.get(mapping['ip_address']) is mapping:
+                    by_ip[mapping['ip_address']] = mapping['id']
+        if pending_updates:
+            db.session.bulk_update_mappings(Server, list(pending_updates.values()))
+        db.session.commit()
+        pending_inserts.clear()
+        pending_updates.clear()
+
+    for row_no, (idx, row) in enumerate(df.iterrows(), 1):
+        if row_no > 1 and (row_no - 1) % batch_size == 0:
+            flush_batch()
+            if progress:
+                progress(stats)
+        try:
+            name = _cell(row, col_map["name"])
+            ip_address = _cell(row, col_map["ip_address"])
+            os_type = _cell(row, col_map["os_type"])
+            status = _cell(row, col_map["status"])
+            description = _cell(row, col_map.get("description")) or None
+
+            if not name or not ip_address or not os_type or not status:
+                issues.append(f"Row {idx+2}: missing required fields (name/ip/os/status)")
+                stats['skipped'] += 1
+                continue
+
+            # Conflict policy: try match by name first, fallback to ip_address
+            existing = by_name.get(name)
+            if existing is None:
+                existing = by_ip.get(ip_address)
+
+            now = datetime.utcnow()
+            # عملیات bulk از validator مدل عبور نمی‌کند؛ ستون‌های عددی IP اینجا محاسبه می‌شوند
+            ip_version, ip_value = ip_sort_key(ip_address)
+            if existing is not None:
+                if update_on_conflict:
+                    values = {
+                        'ip_address': ip_address,
+                        'ip_version': ip_version,
+                        'ip_value': ip_value,
+                        'os_type': os_type,
+                        'status': status,
+                        'description': description,
+                        'updated_at': now,
+                    }
+                    if isinstance(existing, dict):
+                        # ردیفی که در همین batch ایجاد شده و هنوز ذخیره نشده
+                        existing.update(values)
+                    else:
+                        pending_updates.setdefault(existing, {'id': existing}).update(values)
+                    by_ip.setdefault(ip_address, existing)
+                    stats['updated'] += 1
+                else:
+                    stats['skipped'] += 1
+            else:
+                mapping = {
+                    'name': name,
+                    'ip_address': ip_address,
+                    'ip_version': ip_version,
+                    'ip_value': ip_value,
+                    'os_type': os_type,
+                    'status': status,
+                    'description': description,
+                    'created_at': now,
+                    'updated_at': now,
+                }
+                pending_inserts.append(mapping)
+                by_name[name] = mapping
+                by_ip.setdefault(ip_address, mapping)
+                stats['created'] += 1
+
+            stats['processed'] += 1
+        except Exception as e:
+            stats['errors'] += 1
+            issues.append(f"Row {idx+2}: error {e}")
+
+    flush_batch()
+    if progress:
+        progress(stats)
+    return stats, issues
+
+
+def import_servers(
+    file_path: str,
+    sheet_name: Optional[str],
+    update_on_conflict: bool,
+    dry_run: bool,
+    progress: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Tuple[Dict[str, int], List[str]]:
+    """خواندن فایل و ایمپورت آن (نیازمند app context)"""
+    df = read_servers_file(file_path, sheet_name)
+    if df is None or df.empty:
+        return {'processed': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}, []
+    return import_servers_frame(df, update_on_conflict=update_on_conflict, dry_run=dry_run, progress=progress)
+
+
+def _heartbeat():
+    """تازه کردن updated_at کارهای این پروسه (نیازمند app context؛ commit با فراخواننده)"""
+    with _owned_lock:
+        ids = list(_owned)
+    if ids:
+        ServerImportJob.query.filter(
+            ServerImportJob.id.in_(ids), ServerImportJob.status.in_(['pending', 'running'])
+        ).update({'updated_at': datetime.utcnow()}, synchronize_session=False)
+
+
+def recover_stale_jobs() -> int:
+    """کارهای رهاشده (pending/running با heartbeat کهنه) را failed می‌کند؛ تعداد را برمی‌گرداند"""
+    now = datetime.utcnow()
+    heartbeat = func.coalesce(ServerImportJob.updated_at, ServerImportJob.started_at, ServerImportJob.created_at)
+    stale = heartbeat < now - timedelta(seconds=STALE_HEARTBEAT_SECONDS)
+    recovered = ServerImportJob.query.filter(ServerImportJob.status == 'running', stale).update(
+        {'status': 'failed', 'finished_at': now,
+         'error_message': 'کار ایمپورت متوقف شد (worker پیش از پایان از کار افتاد)'}, synchronize_session=False)
+    recovered += ServerImportJob.query.filter(ServerImportJob.status == 'pending', stale).update(
+        {'status': 'failed', 'finished_at': now,
+         'error_message': 'کار ایمپورت هرگز شروع نشد (worker پیش از اجرا از کار افتاد)'}, synchronize_session=False)
+    db.session.commit()
+    if recovered:
+        logger.warning(f"Marked {recovered} stale server import job(s) as failed")
+    return recovered
+
+
+def enqueue_import_job(app, job_id: int):
+    """ارسال کار ایمپورت به worker پس‌زمینه"""
+    with _owned_lock:
+        _owned.add(job_id)
+    return _executor.submit(_run_import_job, app, job_id)
+
+
+def _run_import_job(app, job_id: int):
+    with app.app_context():
+        # claim اتمیک: کاری که در این فاصله failed (رهاشده) علامت خورده دوباره اجرا نمی‌شود
+        now = datetime.utcnow()
+        claimed = ServerImportJob.query.filter_by(id=job_id, status='pending').update(
+            {'status': 'running', 'started_at': now, 'updated_at': now}, synchronize_session=False)
+        db.session.commit()
+        job = ServerImportJob.query.get(job_id)
+        if not job or not claimed:
+            with _owned_lock:
+                _owned.discard(job_id)
+            db.session.remove()
+            return
+        file_path = job.file_path
+        last_beat = time.monotonic()
+
+        def progress(stats: Dict[str, int]):
+            nonlocal last_beat
+            for key, value in stats.items():
+                setattr(job, key, value)
+            if time.monotonic() - last_beat >= HEARTBEAT_SECONDS:
+                _heartbeat()
+                last_beat = time.monotonic()
+            db.session.commit()
+
+        details: Dict = {}
+        final: Dict = {}
+        try:
+            df = read_servers_file(file_path, job.sheet_name)
+            job.total = 0 if df is None else len(df)
+            _heartbeat()
+            db.session.commit()
+            if df is None or df.empty:
+                issues = ["No rows found in the provided file/sheet."]
+            else:
+                _, issues = import_servers_frame(
+                    df,
+                    update_on_conflict=bool(job.update_on_conflict),
+                    dry_run=bool(job.dry_run),
+                    progress=progress,
+                )
+            details = {'issues': json.dumps(issues[:MAX_STORED_ISSUES], ensure_ascii=False)}
+            final = {'status': 'completed'}
+        except Exception as e:
+            logger.error(f"Server import job {job_id} failed: {e}")
+            db.session.rollback()
+            final = {'status': 'failed', 'error_message': str(e)}
+        finally:
+            final['finished_at'] = datetime.utcnow()
+            try:
+                if details:
+                    ServerImportJob.query.filter_by(id=job_id).update(details, synchronize_session=False)
+                # وضعیتی که recover_stale_jobs در این فاصله ثبت کرده بازنویسی نمی‌شود
+                if not ServerImportJob.query.filter_by(id=job_id, status='running').update(
+                        final, synchronize_session=False):
+                    logger.warning(f"Server import job {job_id} was no longer running; status left unchanged")
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+            with _owned_lock:
+                _owned.discard(job_id)
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            except Exception:
+                pass
+            db.session.remove()
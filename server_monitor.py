@@ -0,0 +1,291 @@
+"""
+پایش دسترس‌پذیری سرورها با asyncio
+
+همه Server.ip_address ها به صورت همزمان بررسی می‌شوند (SERVER_MONITOR_CONCURRENCY سقف
+تعداد کل socketهای باز است، نه تعداد میزبان‌ها): ICMP echo در صورت مجاز بودن (ping socket بدون نیاز به root یا raw socket)
+و در غیر این صورت/در صورت عدم پاسخ، اتصال TCP به پورت‌های تنظیم‌شده.
+نتایج در server_status_check ذخیره و وضعیت سرورها به صورت دسته‌ای به‌روزرسانی می‌شود.
+"""
+
+import asyncio
+import errno
+import ipaddress
+import logging
+import socket
+import struct
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from models import db, Server, ServerStatusCheck
+
+logger = logging.getLogger(__name__)
+
+STATUS_UP = 'active'
+STATUS_DOWN = 'inactive'
+# وضعیت‌هایی که به صورت دستی تعیین می‌شوند و پایش آن‌ها را تغییر نمی‌دهد
+MANUAL_STATUSES = {'maintenance'}
+
+MIN_INTERVAL_SECONDS = 30
+
+_ICMP_AVAILABLE: Optional[bool] = None
+
+# خطاهای منابع محلی (fd/بافر/حافظه)؛ نشانه خاموش بودن میزبان نیستند و نتیجه ثبت نمی‌شود
+LOCAL_RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL}
+
+
+def _is_local_error(error: OSError) -> bool:
+    return error.errno in LOCAL_RESOURCE_ERRNOS
+
+
+def parse_ports(value) -> List[int]:
+    """تبدیل '22,443' به لیست پورت‌های معتبر"""
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = str(value or '').split(',')
+    ports = []
+    for item in items:
+        try:
+            port = int(str(item).strip())
+        except ValueError:
+            continue
+        if 0 < port < 65536 and port not in ports:
+            ports.append(port)
+    return ports
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _icmp_socket(family: int) -> socket.socket:
+    proto = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+    sock.setblocking(False)
+    return sock
+
+
+def icmp_available() -> bool:
+    """آیا ping socket بدون دسترسی root مجاز است؟ (net.ipv4.ping_group_range)"""
+    global _ICMP_AVAILABLE
+    if _ICMP_AVAILABLE is None:
+        try:
+            _icmp_socket(socket.AF_INET).close()
+            _ICMP_AVAILABLE = True
+        except (OSError, AttributeError):
+            _ICMP_AVAILABLE = False
+    return _ICMP_AVAILABLE
+
+
+async def _icmp_probe(ip: str, timeout: float, sockets: asyncio.Semaphore) -> Optional[float]:
+    """ارسال یک echo request؛ خروجی latency بر حسب ms یا None"""
+    async with sockets:
+        return await _icmp_echo(ip, timeout)
+
+
+async def _icmp_echo(ip: str, timeout: float) -> Optional[float]:
+    loop = asyncio.get_running_loop()
+    v6 = ':' in ip
+    sock = _icmp_socket(socket.AF_INET6 if v6 else socket.AF_INET)
+    try:
+        # ping socket شناسه را خودش تنظیم می‌کند و پاسخ‌ها را فقط به همین socket می‌دهد
+        header = struct.pack('!BBHHH', 128 if v6 else 8, 0, 0, 0, 1)
+        payload = struct.pack('!d', time.time())
+        if not v6:
+            header = struct.pack('!BBHHH', 8, 0, _checksum(header + payload), 0, 1)
+        started = time.perf_counter()
+        sock.sendto(header + payload, (ip, 0))
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            data = await asyncio.wait_for(loop.sock_recv(sock, 1024), remaining)
+            if data and data[0] == (129 if v6 else 0):
+                return (time.perf_counter() - started) * 1000.0
+    except asyncio.TimeoutError:
+        return None
+    except OSError as e:
+        if _is_local_error(e):
+            raise
+        return None
+    finally:
+        sock.close()
+
+
+async def _tcp_probe(host: str, port: int, timeout: float, sockets: asyncio.Semaphore) -> Optional[float]:
+    """اتصال TCP؛ RST (Connection refused) هم یعنی میزبان در دسترس است
+
+    timeout و unreachable یعنی پاسخی نیامد (None)؛ خطای منابع محلی دوباره raise می‌شود.
+    """
+    async with sockets:
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            writer.close()
+            return (time.perf_counter() - started) * 1000.0
+        except ConnectionRefusedError:
+            return (time.perf_counter() - started) * 1000.0
+        except asyncio.TimeoutError:
+            return None
+        except OSError as e:
+            if _is_local_error(e):
+                raise
+            # EHOSTUNREACH/ENETUNREACH/ECONNRESET/خطای DNS
+            return None
+
+
+async def probe_host(host: str, ports: List[int], timeout: float, use_icmp: bool,
+                     sockets: asyncio.Semaphore) -> Tuple[bool, Optional[str], Optional[int], Optional[float]]:
+    """بررسی یک میزبان: (is_up, method, port, latency_ms)؛ هر اتصال یک جایگاه از sockets می‌گیرد"""
+    host = (host or '').strip()
+    if not host:
+        return False, None, None, None
+    is_ip = True
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        is_ip = False
+    if use_icmp and is_ip:
+        latency = await _icmp_probe(host, timeout, sockets)
+        if latency is not None:
+            return True, 'icmp', None, latency
+    if not ports:
+        return False, 'icmp' if use_icmp else None, None, None
+    # همه پورت‌ها موازی؛ اولین پاسخ کافی است
+    tasks = [asyncio.ensure_future(_tcp_probe(host, port, timeout, sockets)) for port in ports]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                latency = task.result()
+                if latency is not None:
+                    return True, 'tcp', ports[tasks.index(task)], latency
+        return False, 'tcp', None, None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def probe_hosts(targets: List[Tuple[int, str]], ports: List[int], timeout: float,
+                      concurrency: int, use_icmp: bool) -> List[Dict]:
+    """بررسی همزمان لیست (server_id, ip)؛ concurrency سقف کل socketهای باز است
+
+    میزبانی که بررسی آن به خطای منابع محلی خورد با is_up=None برمی‌گردد (نه down).
+    """
+    sockets = asyncio.Semaphore(max(1, concurrency))
+    # سقف میزبان‌های در حال بررسی فقط برای محدود کردن تعداد task هاست
+    hosts = asyncio.Semaphore(max(1, concurrency))
+    checked_at = datetime.utcnow()
+
+    async def run(server_id: int, host: str) -> Dict:
+        async with hosts:
+            try:
+                is_up, method, port, latency = await probe_host(host, ports, timeout, use_icmp, sockets)
+            except OSError as e:
+                if not _is_local_error(e):
+                    raise
+                logger.warning(f"Server reachability probe skipped for {host}: {e}")
+                is_up, method, port, latency = None, None, None, None
+        return {
+            'server_id': server_id,
+            'checked_at': checked_at,
+            'is_up': is_up,
+            'method': method,
+            'port': port,
+            'latency_ms': round(latency, 2) if latency is not None else None,
+        }
+
+    return await asyncio.gather(*(run(sid, host) for sid, host in targets))
+
+
+def _app_setting(app, key: str, default):
+    value = app.config.get(key)
+    return default if value is None else value
+
+
+def run_sweep(app) -> Dict[str, int]:
+    """یک دور کامل بررسی همه سرورها و ذخیره نتایج (نیازمند app context)"""
+    ports = parse_ports(_app_setting(app, 'SERVER_MONITOR_PORTS', '22,3389,443,80'))
+    timeout = float(_app_setting(app, 'SERVER_MONITOR_TIMEOUT', 1.5))
+    concurrency = int(_app_setting(app, 'SERVER_MONITOR_CONCURRENCY', 512))
+    batch_size = int(_app_setting(app, 'SERVER_MONITOR_BATCH_SIZE', 1000))
+    history_days = int(_app_setting(app, 'SERVER_MONITOR_HISTORY_DAYS', 30))
+    use_icmp = bool(_app_setting(app, 'SERVER_MONITOR_USE_ICMP', True)) and icmp_available()
+
+    targets = []
+    current_status: Dict[int, str] = {}
+    for sid, ip, status in db.session.query(Server.id, Server.ip_address, Server.status).yield_per(batch_size):
+        targets.append((sid, ip))
+        current_status[sid] = status
+    db.session.commit()
+
+    started = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(probe_hosts(targets, ports, timeout, concurrency, use_icmp))
+    finally:
+        loop.close()
+    probe_seconds = time.perf_counter() - started
+    skipped = sum(1 for r in results if r['is_up'] is None)
+    results = [r for r in results if r['is_up'] is not None]
+
+    # نوشتن دسته‌ای: تاریخچه برای همه، وضعیت فقط برای سرورهایی که تغییر کرده‌اند
+    now = datetime.utcnow()
+    changes = []
+    for result in results:
+        old = current_status.get(result['server_id'])
+        if old in MANUAL_STATUSES:
+            continue
+        new = STATUS_UP if result['is_up'] else STATUS_DOWN
+        if old != new:
+            changes.append({'id': result['server_id'], 'status': new, 'updated_at': now})
+    for i in range(0, len(results), batch_size):
+        db.session.bulk_insert_mappings(ServerStatusCheck, results[i:i + batch_size])
+        db.session.commit()
+    for i in range(0, len(changes), batch_size):
+        db.session.bulk_update_mappings(Server, changes[i:i + batch_size])
+        db.session.commit()
+
+    if history_days > 0:
+        cutoff = now - timedelta(days=history_days)
+        ServerStatusCheck.query.filter(ServerStatusCheck.checked_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+
+    up = sum(1 for r in results if r['is_up'])
+    summary = {
+        'total': len(results),
+        'up': up,
+        'down': len(results) - up,
+        'changed': len(changes),
+        'skipped': skipped,
+        'probe_ms': int(probe_seconds * 1000),
+    }
+    logger.info(f"Server reachability sweep: {summary} (icmp={'on' if use_icmp else 'off'}, ports={ports})")
+    return summary
+
+
+def run_forever(app, interval: Optional[int] = None):
+    """اجرای دوره‌ای sweep با فاصله محدودشده (حداقل MIN_INTERVAL_SECONDS)"""
+    interval = int(interval or _app_setting(app, 'SERVER_MONITOR_INTERVAL', 300))
+    interval = max(MIN_INTERVAL_SECONDS, interval)
+    while True:
+        started = time.monotonic()
+        with app.app_context():
+            try:
+                run_sweep(app)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Server reachability sweep failed: {e}")
+            finally:
+                db.session.remove()
+        elapsed = time.monotonic() - started
+        time.sleep(max(0.0, interval - elapsed))
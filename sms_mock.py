@@ -0,0 +1,257 @@
+"""
+stand-in محلی HTTP برای ارائه‌دهندگان پیامک (بدون مصرف اعتبار واقعی)
+
+MockSMSProvider یک ThreadingHTTPServer روی 127.0.0.1 است که endpointهای استفاده‌شده در
+SMSService را با همان شکل پاسخ شبیه‌سازی می‌کند، هر ارائه‌دهنده زیر پیشوند خودش:
+- /kavenegar/v1/<key>/sms/send.json، sendarray.json و account/info.json
+- /melipayamak/api/SendSMS/SendSMS
+- /sms_ir/api/Token و /sms_ir/api/MessageSend (توکن با انقضای token_ttl)
+
+تأخیر هر درخواست latency_ms به‌علاوه jitter نمایی با میانگین jitter_ms است (دم توزیع مثل
+سرویس واقعی). error_rate سهم پاسخ‌های 503، reject_rate سهم پیام‌های ردشده توسط ارائه‌دهنده
+و rate_limit حداکثر درخواست در ثانیه هر ارائه‌دهنده است (بیش از آن 429). app_config()
+آدرس‌ها را به صورت SMS_<PROVIDER>_BASE_URL برمی‌گرداند (scripts/bench_sms.py).
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+PROVIDERS = ('kavenegar', 'melipayamak', 'sms_ir')
+
+
+class _Limiter:
+    """token bucket غیرمسدودکننده (درخواست در ثانیه)"""
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self.tokens = max(1.0, self.rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockSMS/1.0'
+    # هدر و بدنه در دو write جدا نوشته می‌شوند؛ بدون TCP_NODELAY تأخیر delayed ACK به هر پاسخ اضافه می‌شود
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body, content_type: str = 'application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        self._dispatch(b'')
+
+    def do_POST(self):
+        self._dispatch(self._body())
+
+    def _dispatch(self, body: bytes):
+        mock: 'MockSMSProvider' = self.server.mock
+        path = urlsplit(self.path).path
+        provider, _, rest = path.lstrip('/').partition('/')
+        if provider not in PROVIDERS:
+            self._reply(404, {'error': 'not found'})
+            return
+        mock._count(provider, 'requests')
+        mock._delay()
+        if not mock._limiters[provider].allow():
+            mock._count(provider, 'rate_limited')
+            self._reply(429, {'return': {'status': 429, 'message': 'Too Many Requests'}, 'IsSuccessful': False,
+                              'Message': 'Too Many Requests', 'RetStatus': 0, 'StrRetStatus': 'TooManyRequests'})
+            return
+        if mock._roll(mock.error_rate):
+            mock._count(provider, 'errors')
+            self._reply(503, b'Service Unavailable', 'text/plain')
+            return
+        try:
+            status, result = getattr(mock, '_' + provider)('/' + rest, body, self.headers)
+        except (ValueError, KeyError) as e:
+            status, result = 400, {'error': str(e)}
+        self._reply(status, result)
+
+
+class MockSMSProvider:
+    """سرور HTTP شبیه kavenegar/melipayamak/sms.ir برای تست و بنچمارک SMSService"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0.0,
+                 reject_rate: float = 0.0, rate_limit: float = 0, token_ttl: float = 1800,
+                 host: str = '127.0.0.1', port: int = 0, seed: Optional[int] = None):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.error_rate = float(error_rate)
+        self.reject_rate = float(reject_rate)
+        self.token_ttl = float(token_ttl)
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._limiters = {provider: _Limiter(rate_limit) for provider in PROVIDERS}
+        self._tokens: Dict[str, float] = {}
+        self._stats_lock = threading.Lock()
+        self._message_id = 0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self.reset_stats()
+
+    # --- چرخه عمر ---
+
+    def start(self) -> 'MockSMSProvider':
+        server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        server.daemon_threads = True
+        server.request_queue_size = 128
+        server.mock = self
+        self._server = server
+        self.port = server.server_address[1]
+        self._thread = threading.Thread(target=server.serve_forever, name='sms-mock', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def base_url(self, provider: str) -> str:
+        return f'{self.url}/{provider}'
+
+    def app_config(self) -> Dict:
+        """تنظیمات Flask برای ارسال SMSService به این stand-in"""
+        config = {f'SMS_{provider.upper()}_BASE_URL': self.base_url(provider) for provider in PROVIDERS}
+        config.setdefault('SMS_API_KEY', 'mock-api-key')
+        config.setdefault('SMS_SENDER', '10004346')
+        return config
+
+    # --- آمار ---
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {provider: {'requests': 0, 'messages': 0, 'rejected': 0, 'errors': 0,
+                                      'rate_limited': 0, 'tokens': 0, 'unauthorized': 0}
+                           for provider in PROVIDERS}
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {provider: dict(values) for provider, values in self._stats.items()}
+
+    def _count(self, provider: str, key: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[provider][key] += n
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def _delay(self):
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._random_lock:
+            jitter = self._random.expovariate(1.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0
+        time.sleep((self.latency_ms + jitter) / 1000.0)
+
+    def _next_id(self) -> int:
+        with self._stats_lock:
+            self._message_id += 1
+            return self._message_id
+
+    # --- ارائه‌دهنده‌ها ---
+
+    def _kavenegar_entry(self, receptor: str, message: str, rejected: bool = False) -> Dict:
+        self._count('kavenegar', 'rejected' if rejected else 'messages')
+        return {'messageid': self._next_id(), 'message': message, 'status': 6 if rejected else 1,
+                'statustext': 'خطا در ارسال' if rejected else 'در صف ارسال', 'sender': '10004346',
+                'receptor': receptor, 'date': int(time.time()), 'cost': 0 if rejected else 120}
+
+    def _kavenegar(self, path: str, body: bytes, headers):
+        form = {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+        if path.endswith('/account/info.json'):
+            return 200, {'return': {'status': 200, 'message': 'تایید شد'},
+                         'entries': {'remaincredit': 1000000, 'expiredate': 0, 'type': 'master'}}
+        if path.endswith('/sms/sendarray.json'):
+            receptors = json.loads(form['receptor'])
+            messages = json.loads(form['message'])
+            entries = [self._kavenegar_entry(r, m, self._roll(self.reject_rate)) for r, m in zip(receptors, messages)]
+            return 200, {'return': {'status': 200, 'message': 'تایید شد'}, 'entries': entries}
+        if path.endswith('/sms/send.json'):
+            if self._roll(self.reject_rate):
+                self._count('kavenegar', 'rejected')
+                return 400, {'return': {'status': 411, 'message': 'گیرنده نامعتبر است'}, 'entries': None}
+            entry = self._kavenegar_entry(form.get('receptor', ''), form.get('message', ''))
+            return 200, {'return': {'status': 200, 'message': 'تایید شد'}, 'entries': [entry]}
+        return 404, {'return': {'status': 404, 'message': 'not found'}}
+
+    def _melipayamak(self, path: str, body: bytes, headers):
+        if not path.endswith('/api/SendSMS/SendSMS'):
+            return 404, {'RetStatus': 0, 'StrRetStatus': 'NotFound'}
+        if self._roll(self.reject_rate):
+            self._count('melipayamak', 'rejected')
+            return 200, {'Value': '0', 'RetStatus': 0, 'StrRetStatus': 'InvalidNumber'}
+        self._count('melipayamak', 'messages')
+        return 200, {'Value': str(self._next_id()), 'RetStatus': 1, 'StrRetStatus': 'Ok'}
+
+    def _sms_ir(self, path: str, body: bytes, headers):
+        data = json.loads(body or b'{}')
+        if path.endswith('/api/Token'):
+            if not data.get('UserApiKey'):
+                return 200, {'IsSuccessful': False, 'Message': 'کلید نامعتبر است'}
+            token = uuid.uuid4().hex
+            with self._stats_lock:
+                self._tokens[token] = time.monotonic() + self.token_ttl
+            self._count('sms_ir', 'tokens')
+            return 200, {'IsSuccessful': True, 'TokenKey': token, 'Message': 'ok'}
+        if path.endswith('/api/MessageSend'):
+            token = headers.get('x-sms-ir-secure-token')
+            with self._stats_lock:
+                expires = self._tokens.get(token)
+            if expires is None or expires < time.monotonic():
+                self._count('sms_ir', 'unauthorized')
+                return 401, {'IsSuccessful': False, 'Message': 'توکن نامعتبر است'}
+            mobiles = data.get('MobileNumbers') or []
+            if self._roll(self.reject_rate):
+                self._count('sms_ir', 'rejected', len(mobiles))
+                return 200, {'IsSuccessful': False, 'Message': 'ارسال ناموفق'}
+            self._count('sms_ir', 'messages', len(mobiles))
+            return 200, {'IsSuccessful': True, 'Ids': [{'ID': self._next_id(), 'MobileNo': m} for m in mobiles],
+                         'BatchKey': uuid.uuid4().hex, 'Message': 'ok'}
+        return 404, {'IsSuccessful': False, 'Message': 'not found'}
@@ -0,0 +1,390 @@
+"""
+صف پایدار ارسال پیامک روی جدول SMSLog
+
+درخواست وب فقط ردیف‌های pending ثبت می‌کند (enqueue_sms، یا enqueue_bulk برای ارسال گروهی)
+و بلافاصله برمی‌گردد. یک thread dispatcher در هر پروسه ردیف‌های موعد رسیده را به صورت اتمیک
+claim می‌کند (status=sending و locked_by یکتا، تا چند worker gunicorn یک پیام را دو بار ارسال
+نکنند) و به pool کارگرها می‌سپارد؛ برای ارائه‌دهندگان دارای endpoint گروهی (BULK_BATCH_SIZES)
+هر کارگر یک دسته را با SMSService.send_bulk در یک درخواست می‌فرستد. هر ارائه‌دهنده یک token bucket دارد؛ خطای اتصال و 429/5xx با backoff نمایی و jitter
+دوباره زمان‌بندی می‌شود و پس از SMS_MAX_ATTEMPTS تلاش failed می‌شود. اگر درخواست فرستاده
+شده ولی نتیجه معلوم نیست (مثلاً read timeout) وضعیت unknown است و دوباره ارسال نمی‌شود. ردیف sending که worker
+آن از کار افتاده باشد پس از SMS_SENDING_TIMEOUT دوباره pending می‌شود.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+
+from models import db, SMSLog
+from sms_service import BULK_BATCH_SIZES, SMSService
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate_limits(value) -> Dict[str, float]:
+    """'kavenegar=5,sms_ir=2.5' → {'kavenegar': 5.0, 'sms_ir': 2.5} (پیام در ثانیه)"""
+    if isinstance(value, dict):
+        return {k: float(v) for k, v in value.items()}
+    limits = {}
+    for part in (value or '').split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip():
+            try:
+                limits[name.strip()] = float(rate)
+            except ValueError:
+                logger.warning(f"SMS_RATE_LIMITS: invalid rate for {name.strip()!r}")
+    return limits
+
+
+class TokenBucket:
+    """محدودیت نرخ: rate توکن در ثانیه با ظرفیت burst؛ rate <= 0 یعنی بدون محدودیت
+
+    acquire(n) برای دسته بزرگ‌تر از ظرفیت، موجودی را منفی می‌کند تا درخواست‌های بعدی به همان
+    اندازه صبر کنند (نرخ میانگین پیام در ثانیه حفظ می‌شود).
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        if self.rate <= 0:
+            return
+        need = min(float(n), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= need:
+                    self.tokens -= n
+                    return
+                wait = (need - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_delay(attempts: int, base: float, cap: float) -> float:
+    """backoff نمایی با jitter ±20٪: base، 2×base، 4×base ... حداکثر cap ثانیه"""
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def enqueue_sms(user_id: int, phone_number: str, message: str, provider: Optional[str] = None,
+                template_id: Optional[int] = None, app=None, commit: bool = True) -> SMSLog:
+    """ثبت پیامک در صف (status=pending)؛ ارسال در پس‌زمینه انجام می‌شود"""
+    from flask import current_app
+    app = app or current_app._get_current_object()
+    log = SMSLog(user_id=user_id, phone_number=phone_number, message=message, template_id=template_id,
+                 provider=provider or app.config.get('SMS_PROVIDER', 'kavenegar'),
+                 status='pending', attempts=0, next_attempt_at=datetime.utcnow())
+    db.session.add(log)
+    if commit:
+        db.session.commit()
+        sms_queue.notify(app)
+    return log
+
+
+def enqueue_bulk(recipients: List[Dict], provider: Optional[str] = None, app=None) -> List[int]:
+    """ثبت گروهی پیامک‌ها در صف با یک bulk insert؛ شناسه SMSLogها به ترتیب ورودی.
+
+    recipients: [{'user_id', 'phone_number', 'message', 'template_id' (اختیاری)}]. ارسال را
+    کارگرهای صف با endpoint گروهی ارائه‌دهنده و زیر محدودیت نرخ آن انجام می‌دهند.
+    """
+    from flask import current_app
+    app = app or current_app._get_current_object()
+    if not recipients:
+        return []
+    provider = provider or app.config.get('SMS_PROVIDER', 'kavenegar')
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': r['user_id'], 'phone_number': r['phone_number'], 'message': r['message'],
+        'template_id': r.get('template_id'), 'provider': provider, 'status': 'pending',
+        'attempts': 0, 'next_attempt_at': now, 'created_at': now,
+    } for r in recipients]
+    db.session.bulk_insert_mappings(SMSLog, rows, return_defaults=True)
+    db.session.commit()
+    sms_queue.notify(app)
+    return [row['id'] for row in rows]
+
+
+class SMSQueue:
+    """dispatcher و pool کارگرهای ارسال در این پروسه"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._slots_changed = threading.Condition()
+        self._inflight = 0
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._stopping = False
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.workers = 4
+
+    def _bucket(self, provider: str, config) -> TokenBucket:
+        bucket = self._buckets.get(provider)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(provider)
+                if bucket is None:
+                    rate = parse_rate_limits(config.get('SMS_RATE_LIMITS', '')).get(provider, 0)
+                    bucket = self._buckets[provider] = TokenBucket(rate)
+        return bucket
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self, app):
+        """شروع dispatcher (یک بار در هر پروسه؛ پس از fork دوباره ساخته می‌شود)"""
+        if self.running():
+            return
+        with self._lock:
+            if self.running():
+                return
+            self.workers = max(1, int(app.config.get('SMS_WORKERS', 4)))
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sms-worker')
+            self._inflight = 0
+            self._stopping = False
+            self._pid = os.getpid()
+            self._buckets = {}
+            self._thread = threading.Thread(target=self._run, args=(app,), name='sms-dispatcher', daemon=True)
+            self._thread.start()
+
+    def notify(self, app=None):
+        """بیدار کردن dispatcher پس از ثبت پیام جدید (در صورت نیاز شروع آن)"""
+        if app is not None and not self.running() and app.config.get('SMS_QUEUE_AUTOSTART', True):
+            self.start(app)
+        self._wake.set()
+
+    def stop(self, wait: bool = True):
+        self._stopping = True
+        self._wake.set()
+        with self._slots_changed:
+            self._slots_changed.notify_all()
+        thread, executor = self._thread, self._executor
+        if thread is not None and wait:
+            thread.join(timeout=10)
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        self._thread = None
+
+    def _free_slots(self) -> int:
+        with self._slots_changed:
+            while self._inflight >= self.workers and not self._stopping:
+                self._slots_changed.wait()
+            return self.workers - self._inflight
+
+    def _release_slot(self):
+        with self._slots_changed:
+            self._inflight -= 1
+            self._slots_changed.notify()
+
+    def _run(self, app):
+        poll = float(app.config.get('SMS_QUEUE_POLL_INTERVAL', 2))
+        while not self._stopping:
+            limit = self._free_slots()
+            if self._stopping:
+                break
+            # پیام‌هایی که حین claim ثبت شوند دوباره بیدار می‌کنند
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    jobs = claim_jobs(limit, float(app.config.get('SMS_SENDING_TIMEOUT', 120)))
+                except Exception as e:
+                    logger.error(f"SMS queue claim failed: {e}")
+                    jobs = []
+                finally:
+                    db.session.remove()
+            for log_ids in jobs:
+                with self._slots_changed:
+                    self._inflight += 1
+                self._executor.submit(self._deliver, app, log_ids)
+            if len(jobs) < limit:
+                # صف خالی یا پیام‌های باقی‌مانده هنوز موعدشان نرسیده
+                self._wake.wait(poll)
+
+    def _deliver(self, app, log_ids: List[int]):
+        try:
+            with app.app_context():
+                try:
+                    if len(log_ids) == 1:
+                        deliver(app, log_ids[0], self._bucket)
+                    else:
+                        deliver_batch(app, log_ids, self._bucket)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"SMS {log_ids} delivery failed: {e}")
+                finally:
+                    db.session.remove()
+        finally:
+            self._release_slot()
+
+    def drain(self, app, timeout: float = 60) -> bool:
+        """منتظر ماندن تا پیام pending/sending (از جمله تلاش‌های مجدد زمان‌بندی‌شده) باقی نماند"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with app.app_context():
+                try:
+                    counts = queue_counts()
+                    if not counts.get('pending') and not counts.get('sending') and not self._inflight:
+                        return True
+                finally:
+                    db.session.remove()
+            self._wake.set()
+            time.sleep(0.05)
+        return False
+
+
+def claim_due(limit: int, sending_timeout: float = 120, providers: Optional[List[str]] = None,
+              exclude: Optional[List[str]] = None) -> List[int]:
+    """claim اتمیک حداکثر limit پیام موعد رسیده (status pending → sending با locked_by یکتا)"""
+    now = datetime.utcnow()
+    # پیام‌هایی که worker ارسال‌کننده‌شان از کار افتاده
+    SMSLog.query.filter(SMSLog.status == 'sending',
+                        SMSLog.locked_at < now - timedelta(seconds=sending_timeout)).update(
+        {'status': 'pending', 'locked_at': None, 'locked_by': None}, synchronize_session=False)
+    query = db.session.query(SMSLog.id).filter(
+        SMSLog.status == 'pending',
+        or_(SMSLog.next_attempt_at == None, SMSLog.next_attempt_at <= now)  # noqa: E711
+    )
+    if providers:
+        query = query.filter(SMSLog.provider.in_(providers))
+    if exclude:
+        query = query.filter(SMSLog.provider.notin_(exclude))
+    due = [row.id for row in query.order_by(SMSLog.next_attempt_at, SMSLog.id).limit(limit)]
+    if not due:
+        db.session.commit()
+        return []
+    token = f"{socket.gethostname()[:30]}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    SMSLog.query.filter(SMSLog.id.in_(due), SMSLog.status == 'pending').update(
+        {'status': 'sending', 'locked_at': now, 'locked_by': token}, synchronize_session=False)
+    db.session.commit()
+    return [row.id for row in db.session.query(SMSLog.id).filter(SMSLog.id.in_(due), SMSLog.locked_by == token)]
+
+
+def claim_jobs(slots: int, sending_timeout: float = 120) -> List[List[int]]:
+    """claim کار برای slots کارگر آزاد: هر کار یک دسته از یک ارائه‌دهنده گروهی یا یک پیام تکی"""
+    jobs: List[List[int]] = []
+    # نوبتی بین ارائه‌دهندگان گروهی و پیام‌های تکی تا صف یکی بقیه را معطل نکند
+    groups = [([provider], None, size) for provider, size in BULK_BATCH_SIZES.items()]
+    groups.append((None, list(BULK_BATCH_SIZES), 1))
+    while groups and len(jobs) < slots:
+        for group in list(groups):
+            free = slots - len(jobs)
+            if free <= 0:
+                break
+            providers, exclude, size = group
+            want = size if size > 1 else max(1, free // len(groups))
+            ids = claim_due(want, sending_timeout, providers=providers, exclude=exclude)
+            if size > 1:
+                if ids:
+                    jobs.append(ids)
+            else:
+                jobs.extend([log_id] for log_id in ids)
+            if len(ids) < want:
+                groups.remove(group)
+    return jobs
+
+
+def _relock(log_ids: List[int], token: Optional[str]) -> List[int]:
+    """تمدید locked_at پیش از ارسال؛ فقط ردیف‌هایی که هنوز در اختیار همین claim هستند.
+
+    انتظار برای محدودیت نرخ ممکن است از SMS_SENDING_TIMEOUT بیشتر شود و ردیف به صف برگشته باشد.
+    """
+    SMSLog.query.filter(SMSLog.id.in_(log_ids), SMSLog.status == 'sending', SMSLog.locked_by == token).update(
+        {'locked_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return [row.id for row in db.session.query(SMSLog.id).filter(
+        SMSLog.id.in_(log_ids), SMSLog.status == 'sending', SMSLog.locked_by == token)]
+
+
+def _record_result(app, log: SMSLog, result: Dict, now: datetime):
+    log.attempts = (log.attempts or 0) + 1
+    log.locked_at = None
+    log.locked_by = None
+    if result.get('success'):
+        log.status = 'sent'
+        log.message_id = str(result['message_id']) if result.get('message_id') is not None else None
+        log.cost = result.get('cost')
+        log.sent_at = now
+        log.error_message = None
+    elif result.get('unknown'):
+        # ممکن است پیامک رسیده باشد؛ ارسال دوباره باعث پیام تکراری می‌شود
+        log.status = 'unknown'
+        log.error_message = result.get('error')
+    elif result.get('retryable') and log.attempts < int(app.config.get('SMS_MAX_ATTEMPTS', 5)):
+        log.status = 'pending'
+        log.error_message = result.get('error')
+        log.next_attempt_at = now + timedelta(seconds=retry_delay(
+            log.attempts, float(app.config.get('SMS_RETRY_BASE_SECONDS', 5)),
+            float(app.config.get('SMS_RETRY_MAX_SECONDS', 600))))
+    else:
+        log.status = 'failed'
+        log.error_message = result.get('error')
+    if log.status != 'sent':
+        logger.warning(f"SMS {log.id} via {log.provider} attempt {log.attempts}: {log.status} ({log.error_message})")
+
+
+def deliver(app, log_id: int, bucket_for) -> Optional[str]:
+    """ارسال یک پیام claim‌شده و ثبت نتیجه؛ وضعیت جدید را برمی‌گرداند"""
+    log = SMSLog.query.get(log_id)
+    if log is None or log.status != 'sending':
+        return None
+    bucket_for(log.provider, app.config).acquire()
+    if not _relock([log.id], log.locked_by):
+        return None
+    result = SMSService.from_config(app.config, log.provider).send_sms(log.phone_number, log.message)
+    _record_result(app, log, result, datetime.utcnow())
+    db.session.commit()
+    return log.status
+
+
+def deliver_batch(app, log_ids: List[int], bucket_for) -> Dict[str, int]:
+    """ارسال دسته‌ای پیام‌های claim‌شده یک ارائه‌دهنده با SMSService.send_bulk؛ تعداد هر وضعیت"""
+    logs = SMSLog.query.filter(SMSLog.id.in_(log_ids), SMSLog.status == 'sending').order_by(SMSLog.id).all()
+    if not logs:
+        return {}
+    provider, token = logs[0].provider, logs[0].locked_by
+    bucket_for(provider, app.config).acquire(len(logs))
+    owned = set(_relock([log.id for log in logs], token))
+    logs = [log for log in logs if log.id in owned]
+    if not logs:
+        return {}
+    results = SMSService.from_config(app.config, provider).send_bulk(
+        [(log.phone_number, log.message) for log in logs], max_workers=int(app.config.get('SMS_BULK_WORKERS', 8)))
+    now = datetime.utcnow()
+    counts: Dict[str, int] = {}
+    for log, result in zip(logs, results):
+        _record_result(app, log, result, now)
+        counts[log.status] = counts.get(log.status, 0) + 1
+    db.session.commit()
+    return counts
+
+
+def queue_counts(due_only: bool = False) -> Dict[str, int]:
+    """تعداد پیام‌ها در هر وضعیت (due: pending با موعد رسیده)"""
+    counts = {}
+    if not due_only:
+        counts = {status: n for status, n in
+                  db.session.query(SMSLog.status, func.count(SMSLog.id)).group_by(SMSLog.status)}
+    counts['due'] = db.session.query(func.count(SMSLog.id)).filter(
+        SMSLog.status == 'pending',
+        or_(SMSLog.next_attempt_at == None, SMSLog.next_attempt_at <= datetime.utcnow())  # noqa: E711
+    ).scalar() or 0
+    return counts
+
+
+sms_queue = SMSQueue()
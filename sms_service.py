@@ -2,19 +2,139 @@
 import requests
 import json
 import logging
-from typing import Optional, Dict, List
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# (connect, read) ثانیه
+DEFAULT_TIMEOUT = (5, 30)
+
+# یک Session با keep-alive برای هر ارائه‌دهنده در هر پروسه (بعد از fork دوباره ساخته می‌شود)
+_sessions: Dict[Tuple[int, str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+# توکن sms.ir مشترک بین threadها: api_key → (token، زمان انقضا)
+_sms_ir_tokens: Dict[str, Tuple[str, float]] = {}
+_sms_ir_token_lock = threading.Lock()
+SMS_IR_TOKEN_TTL = 1800
+SMS_IR_TOKEN_MARGIN = 120
+
+# آدرس پایه API هر ارائه‌دهنده (SMS_<PROVIDER>_BASE_URL، مثلاً stand-in محلی sms_mock)
+PROVIDER_BASE_URLS = {
+    'kavenegar': 'https://api.kavenegar.com',
+    'melipayamak': 'https://rest.payamak-resan.com',
+    'sms_ir': 'https://RestfulSms.com',
+}
+
+# حداکثر گیرنده در هر درخواست endpointهای گروهی (kavenegar sendarray، sms.ir MessageSend)
+BULK_BATCH_SIZES = {'kavenegar': 200, 'sms_ir': 100}
+# وضعیت‌های ناموفق entryهای kavenegar (6 خطا، 11 نرسیده، 13 لغو، 14 بلاک، 100 نامعتبر)
+KAVENEGAR_FAILED_STATUSES = (6, 11, 13, 14, 100)
+
+
+def provider_session(provider: str, pool_size: int = 10) -> requests.Session:
+    """Session مشترک ارائه‌دهنده با pool اتصال و تلاش مجدد.
+
+    فقط خطای اتصال (درخواست هنوز به سرور نرسیده) برای POST تکرار می‌شود تا پیامک دو بار
+    ارسال نشود؛ پاسخ‌های 502/503/504 فقط برای GET (موجودی) دوباره امتحان می‌شوند.
+    """
+    key = (os.getpid(), provider)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                retry = Retry(total=2, connect=2, read=0, status=2, backoff_factor=0.3,
+                              status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET']),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[key] = session
+    return session
+
+
+def _provider_json(response: requests.Response) -> Dict:
+    """بدنه JSON پاسخ ارائه‌دهنده؛ 429 (محدودیت نرخ) و 5xx به صورت استثنا تا ارسال قابل تلاش مجدد شود"""
+    if response.status_code == 429 or response.status_code >= 500:
+        raise requests.HTTPError(f"HTTP {response.status_code} from SMS provider", response=response)
+    return response.json()
+
+
+def _sent_before_failure(error: requests.ConnectionError) -> bool:
+    """اتصال پس از ارسال درخواست قطع شده است (نه در مرحله برقراری اتصال)"""
+    cause = error.args[0] if error.args else None
+    if isinstance(cause, MaxRetryError):
+        cause = cause.reason
+    return isinstance(cause, (ProtocolError, ReadTimeoutError))
+
+
+def send_failure(error: Exception) -> Dict:
+    """نتیجه ناموفق برای استثنای حین ارسال.
+
+    فقط وقتی درخواست قطعاً به ارائه‌دهنده نرسیده (خطای اتصال/ConnectTimeout) یا صراحتاً با
+    429/5xx رد شده retryable است. اگر درخواست فرستاده شده و پاسخی نیامده (ReadTimeout، قطع
+    اتصال وسط پاسخ، پاسخ نامعتبر) ممکن است پیامک ارسال شده باشد: unknown و بدون تلاش مجدد.
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        if status is not None and (status == 429 or status >= 500):
+            return {'success': False, 'error': str(error), 'retryable': True}
+        return {'success': False, 'error': str(error)}
+    if isinstance(error, requests.ConnectTimeout):
+        return {'success': False, 'error': str(error), 'retryable': True}
+    if isinstance(error, requests.ReadTimeout):
+        return {'success': False, 'error': str(error), 'unknown': True}
+    if isinstance(error, requests.ConnectionError):
+        if _sent_before_failure(error):
+            return {'success': False, 'error': str(error), 'unknown': True}
+        return {'success': False, 'error': str(error), 'retryable': True}
+    if isinstance(error, ValueError):
+        # بدنه غیر JSON برای درخواستی که به ارائه‌دهنده رسیده است
+        return {'success': False, 'error': str(error), 'unknown': True}
+    return {'success': False, 'error': str(error)}
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
 class SMSService:
     """سرویس ارسال پیامک"""
     
-    def __init__(self, provider: str = 'kavenegar', api_key: str = None, sender: str = None):
+    def __init__(self, provider: str = 'kavenegar', api_key: str = None, sender: str = None,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT, pool_size: int = 10, base_url: Optional[str] = None):
         self.provider = provider
         self.api_key = api_key
         self.sender = sender
+        self.timeout = timeout
+        self.base_url = (base_url or PROVIDER_BASE_URLS.get(provider, '')).rstrip('/')
+        self.http = provider_session(provider, pool_size)
+    
+    @classmethod
+    def from_config(cls, config, provider: Optional[str] = None) -> 'SMSService':
+        """ساخت سرویس از تنظیمات Flask؛ SMS_<PROVIDER>_API_KEY/SENDER بر مقادیر عمومی مقدم است"""
+        provider = provider or config.get('SMS_PROVIDER', 'kavenegar')
+        prefix = f"SMS_{provider.upper()}_"
+        return cls(provider,
+                   api_key=config.get(prefix + 'API_KEY') or config.get('SMS_API_KEY'),
+                   sender=config.get(prefix + 'SENDER') or config.get('SMS_SENDER'),
+                   timeout=(float(config.get('SMS_CONNECT_TIMEOUT', 5)), float(config.get('SMS_READ_TIMEOUT', 30))),
+                   pool_size=max(10, int(config.get('SMS_WORKERS', 4))),
+                   base_url=config.get(prefix + 'BASE_URL'))
         
     def send_sms(self, phone_number: str, message: str) -> Dict:
         """ارسال پیامک"""
@@ -30,12 +150,100 @@ class SMSService:
                 
         except Exception as e:
             logger.error(f"SMS sending failed: {e}")
-            return {'success': False, 'error': str(e)}
+            return send_failure(e)
+    
+    def send_bulk(self, messages: List[Tuple[str, str]], max_workers: int = 8) -> List[Dict]:
+        """ارسال گروهی [(شماره، متن)]؛ نتیجه هر گیرنده به ترتیب ورودی.
+
+        برای kavenegar و sms.ir از endpoint گروهی (BULK_BATCH_SIZES گیرنده در هر درخواست)
+        استفاده می‌شود؛ برای بقیه ارسال تکی با حداکثر max_workers درخواست همزمان.
+        """
+        if not messages:
+            return []
+        batch_size = BULK_BATCH_SIZES.get(self.provider)
+        if batch_size:
+            results = []
+            for start in range(0, len(messages), batch_size):
+                results.extend(self._send_batch(messages[start:start + batch_size]))
+            return results
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(messages))),
+                                thread_name_prefix='sms-bulk') as pool:
+            return list(pool.map(lambda item: self.send_sms(*item), messages))
+    
+    def _send_batch(self, chunk: List[Tuple[str, str]]) -> List[Dict]:
+        try:
+            if self.provider == 'kavenegar':
+                return self._send_kavenegar_array(chunk)
+            return self._send_sms_ir_array(chunk)
+        except Exception as e:
+            failure = send_failure(e)
+            return [dict(failure) for _ in chunk]
+    
+    def _send_kavenegar_array(self, chunk: List[Tuple[str, str]]) -> List[Dict]:
+        """ارسال یک دسته با sendarray کاوه‌نگار (هر گیرنده متن و فرستنده خودش)"""
+        url = "{}/v1/{}/sms/sendarray.json".format(self.base_url, self.api_key)
+        data = {
+            'receptor': json.dumps([phone for phone, _ in chunk]),
+            'sender': json.dumps([self.sender] * len(chunk)),
+            'message': json.dumps([message for _, message in chunk], ensure_ascii=False)
+        }
+        result = _provider_json(self.http.post(url, data=data, timeout=self.timeout))
+        if result.get('return', {}).get('status') != 200:
+            error = result.get('return', {}).get('message', 'Unknown error')
+            return [{'success': False, 'error': error, 'provider_response': result} for _ in chunk]
+        entries = result.get('entries') or []
+        results = []
+        for index in range(len(chunk)):
+            entry = entries[index] if index < len(entries) else {}
+            if entry.get('messageid') and entry.get('status') not in KAVENEGAR_FAILED_STATUSES:
+                results.append({'success': True, 'message_id': entry.get('messageid'), 'cost': entry.get('cost'),
+                                'provider_response': entry})
+            else:
+                results.append({'success': False, 'error': entry.get('statustext') or 'Not accepted',
+                                'provider_response': entry})
+        return results
+    
+    def _send_sms_ir_array(self, chunk: List[Tuple[str, str]]) -> List[Dict]:
+        """ارسال یک دسته با MessageSend sms.ir (آرایه متن‌ها و شماره‌ها به ترتیب)"""
+        token, auth_result = self._sms_ir_token()
+        if not token:
+            return [{'success': False, 'error': 'Authentication failed', 'provider_response': auth_result} for _ in chunk]
+        send_url = self.base_url + "/api/MessageSend"
+        send_data = {
+            'Messages': [message for _, message in chunk],
+            'MobileNumbers': [phone for phone, _ in chunk],
+            'LineNumber': self.sender,
+            'SendDateTime': None,
+            'CanContinueInCaseOfError': True
+        }
+        headers = {'Content-Type': 'application/json', 'x-sms-ir-secure-token': token}
+        response = self.http.post(send_url, json=send_data, headers=headers, timeout=self.timeout)
+        if response.status_code in (401, 403):
+            token, auth_result = self._sms_ir_token(stale=token)
+            if not token:
+                return [{'success': False, 'error': 'Authentication failed', 'provider_response': auth_result} for _ in chunk]
+            headers['x-sms-ir-secure-token'] = token
+            response = self.http.post(send_url, json=send_data, headers=headers, timeout=self.timeout)
+        result = _provider_json(response)
+        if not result.get('IsSuccessful'):
+            return [{'success': False, 'error': result.get('Message', 'Unknown error'), 'provider_response': result}
+                    for _ in chunk]
+        ids = result.get('Ids') or []
+        results = []
+        for index in range(len(chunk)):
+            if ids and index >= len(ids):
+                results.append({'success': False, 'error': 'Not accepted', 'provider_response': result})
+                continue
+            message_id = ids[index] if ids else None
+            if isinstance(message_id, dict):
+                message_id = message_id.get('ID')
+            results.append({'success': True, 'message_id': message_id})
+        return results
     
     def _send_kavenegar(self, phone_number: str, message: str) -> Dict:
         """ارسال پیامک از طریق کاوه‌نگار"""
         try:
-            url = "https://api.kavenegar.com/v1/{}/sms/send.json".format(self.api_key)
+            url = "{}/v1/{}/sms/send.json".format(self.base_url, self.api_key)
             
             data = {
                 'receptor': phone_number,
@@ -43,8 +251,8 @@ class SMSService:
                 'sender': self.sender
             }
             
-            response = requests.post(url, data=data, timeout=30)
-            result = response.json()
+            response = self.http.post(url, data=data, timeout=self.timeout)
+            result = _provider_json(response)
             
             if result.get('return', {}).get('status') == 200:
                 return {
@@ -61,12 +269,12 @@ class SMSService:
                 }
                 
         except Exception as e:
-            return {'success': False, 'error': str(e)}
+            return send_failure(e)
     
     def _send_melipayamak(self, phone_number: str, message: str) -> Dict:
         """ارسال پیامک از طریق ملی‌پیامک"""
         try:
-            url = "https://rest.payamak-resan.com/api/SendSMS/SendSMS"
+            url = self.base_url + "/api/SendSMS/SendSMS"
             
             data = {
                 'username': self.api_key,
@@ -77,8 +285,8 @@ class SMSService:
                 'isFlash': False
             }
             
-            response = requests.post(url, data=data, timeout=30)
-            result = response.json()
+            response = self.http.post(url, data=data, timeout=self.timeout)
+            result = _provider_json(response)
             
             if result.get('RetStatus') == 1:
                 return {
@@ -94,63 +302,84 @@ class SMSService:
                 }
                 
         except Exception as e:
-            return {'success': False, 'error': str(e)}
+            return send_failure(e)
     
-    def _send_sms_ir(self, phone_number: str, message: str) -> Dict:
-        """ارسال پیامک از طریق SMS.ir"""
-        try:
-            # دریافت توکن
-            auth_url = "https://RestfulSms.com/api/Token"
+    def _sms_ir_token(self, stale: Optional[str] = None) -> Tuple[Optional[str], Dict]:
+        """توکن sms.ir از کش مشترک؛ توکن جدید فقط نزدیک انقضا یا وقتی stale رد شده باشد گرفته می‌شود"""
+        key = self.api_key or ''
+        cached = _sms_ir_tokens.get(key)
+        if cached and cached[1] > time.time() and cached[0] != stale:
+            return cached[0], {}
+        with _sms_ir_token_lock:
+            # thread دیگری ممکن است در این فاصله توکن تازه گرفته باشد
+            cached = _sms_ir_tokens.get(key)
+            if cached and cached[1] > time.time() and cached[0] != stale:
+                return cached[0], {}
+            auth_url = self.base_url + "/api/Token"
             auth_data = {
                 'UserApiKey': self.api_key,
                 'SecretKey': self.api_key  # معمولاً همان API key است
             }
+            auth_result = _provider_json(self.http.post(auth_url, json=auth_data, timeout=self.timeout))
+            if not auth_result.get('IsSuccessful'):
+                _sms_ir_tokens.pop(key, None)
+                return None, auth_result
+            token = auth_result.get('TokenKey')
+            _sms_ir_tokens[key] = (token, time.time() + SMS_IR_TOKEN_TTL - SMS_IR_TOKEN_MARGIN)
+            return token, auth_result
+    
+    def _send_sms_ir(self, phone_number: str, message: str) -> Dict:
+        """ارسال پیامک از طریق SMS.ir"""
+        try:
+            token, auth_result = self._sms_ir_token()
+            if not token:
+                return {
+                    'success': False,
+                    'error': 'Authentication failed',
+                    'provider_response': auth_result
+                }
             
-            auth_response = requests.post(auth_url, json=auth_data, timeout=30)
-            auth_result = auth_response.json()
+            # ارسال پیامک
+            send_url = self.base_url + "/api/MessageSend"
+            send_data = {
+                'Messages': [message],
+                'MobileNumbers': [phone_number],
+                'LineNumber': self.sender,
+                'SendDateTime': None,
+                'CanContinueInCaseOfError': False
+            }
             
-            if auth_result.get('IsSuccessful'):
-                token = auth_result.get('TokenKey')
-                
-                # ارسال پیامک
-                send_url = "https://RestfulSms.com/api/MessageSend"
-                send_data = {
-                    'Messages': [message],
-                    'MobileNumbers': [phone_number],
-                    'LineNumber': self.sender,
-                    'SendDateTime': None,
-                    'CanContinueInCaseOfError': False
-                }
-                
+            for attempt in range(2):
                 headers = {
                     'Content-Type': 'application/json',
                     'x-sms-ir-secure-token': token
                 }
-                
-                send_response = requests.post(send_url, json=send_data, headers=headers, timeout=30)
-                send_result = send_response.json()
-                
-                if send_result.get('IsSuccessful'):
-                    return {
-                        'success': True,
-                        'message_id': send_result.get('Ids', [None])[0],
-                        'provider_response': send_result
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': send_result.get('Message', 'Unknown error'),
-                        'provider_response': send_result
-                    }
+                send_response = self.http.post(send_url, json=send_data, headers=headers, timeout=self.timeout)
+                if send_response.status_code in (401, 403) and attempt == 0:
+                    # توکن کش‌شده زودتر از موعد باطل شده است
+                    token, auth_result = self._sms_ir_token(stale=token)
+                    if not token:
+                        return {'success': False, 'error': 'Authentication failed', 'provider_response': auth_result}
+                    continue
+                break
+            send_result = _provider_json(send_response)
+            
+            if send_result.get('IsSuccessful'):
+                message_id = (send_result.get('Ids') or [None])[0]
+                return {
+                    'success': True,
+                    'message_id': message_id.get('ID') if isinstance(message_id, dict) else message_id,
+                    'provider_response': send_result
+                }
             else:
                 return {
                     'success': False,
-                    'error': 'Authentication failed',
-                    'provider_response': auth_result
+                    'error': send_result.get('Message', 'Unknown error'),
+                    'provider_response': send_result
                 }
                 
         except Exception as e:
-            return {'success': False, 'error': str(e)}
+            return send_failure(e)
     
     def get_balance(self) -> Dict:
         """دریافت موجودی"""
@@ -166,9 +395,9 @@ class SMSService:
     def _get_kavenegar_balance(self) -> Dict:
         """دریافت موجودی کاوه‌نگار"""
         try:
-            url = "https://api.kavenegar.com/v1/{}/account/info.json".format(self.api_key)
-            response = requests.get(url, timeout=30)
-            result = response.json()
+            url = "{}/v1/{}/account/info.json".format(self.base_url, self.api_key)
+            response = self.http.get(url, timeout=self.timeout)
+            result = _provider_json(response)
             
             if result.get('return', {}).get('status') == 200:
                 return {
@@ -0,0 +1,166 @@
+"""
+کامپایل و cache قالب‌های پیامک (SMSTemplate)
+
+متن قالب با placeholderهای {name} (همان قالب فرم افزودن قالب) یک بار تجزیه و اعتبارسنجی
+می‌شود: فقط نام ساده مجاز است (دسترسی به attribute/index و format spec رد می‌شود) و اگر
+قالب فهرست variables داشته باشد، هر placeholder باید در آن تعریف شده باشد. نتیجه یک رشته
+format نرمال‌شده است که رندر هر پیام با یک فراخوانی format_map انجام می‌شود.
+
+cache بر اساس (id، updated_at) است: ویرایش قالب updated_at را عوض می‌کند و نسخه قبلی
+خودبه‌خود کنار گذاشته می‌شود؛ get_by_id برای بررسی اعتبار فقط ستون updated_at را می‌خواند.
+"""
+
+import re
+import string
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_FORMATTER = string.Formatter()
+_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class TemplateError(ValueError):
+    """قالب نامعتبر یا متغیر ناموجود هنگام رندر"""
+
+
+class CompiledTemplate:
+    """قالب تجزیه‌شده: render(context) و render_many(contexts)"""
+
+    __slots__ = ('template_id', 'version', 'variables', 'source', '_format')
+
+    def __init__(self, text: str, declared: Optional[Iterable[str]] = None,
+                 template_id: Optional[int] = None, version=None):
+        self.template_id = template_id
+        self.version = version
+        self.source = text or ''
+        parts: List[str] = []
+        names: List[str] = []
+        try:
+            parsed = list(_FORMATTER.parse(self.source))
+        except ValueError as e:
+            raise TemplateError(f'قالب نامعتبر: {e}')
+        for literal, field, spec, conversion in parsed:
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if not _NAME.match(field) or spec or conversion:
+                raise TemplateError(f'placeholder نامعتبر: {{{field}}}')
+            if field not in names:
+                names.append(field)
+            parts.append('{' + field + '}')
+        declared = [v for v in (declared or []) if v]
+        if declared:
+            unknown = [name for name in names if name not in declared]
+            if unknown:
+                raise TemplateError(f"متغیر تعریف‌نشده در قالب: {', '.join(unknown)}")
+        self.variables: Tuple[str, ...] = tuple(names)
+        self._format = ''.join(parts).format_map
+
+    def render(self, context: Dict) -> str:
+        try:
+            return self._format(context)
+        except KeyError as e:
+            raise TemplateError(f'مقدار متغیر {e.args[0]} مشخص نشده است')
+
+    def render_many(self, contexts: Iterable[Dict]) -> List[str]:
+        """رندر دسته‌ای؛ خطای متغیر ناموجود با شماره context گزارش می‌شود"""
+        fmt = self._format
+        results = []
+        try:
+            for context in contexts:
+                results.append(fmt(context))
+        except KeyError as e:
+            raise TemplateError(f'مقدار متغیر {e.args[0]} برای گیرنده {len(results) + 1} مشخص نشده است')
+        return results
+
+    def missing(self, context: Dict) -> List[str]:
+        return [name for name in self.variables if name not in context]
+
+
+class TemplateCache:
+    """cache قالب‌های کامپایل‌شده (LRU، thread-safe)"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: 'OrderedDict[int, CompiledTemplate]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, template_id: int, version) -> Optional[CompiledTemplate]:
+        with self._lock:
+            compiled = self._items.get(template_id)
+            if compiled is not None and compiled.version == version:
+                self._items.move_to_end(template_id)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+            return None
+
+    def _store(self, compiled: CompiledTemplate) -> CompiledTemplate:
+        with self._lock:
+            self._items[compiled.template_id] = compiled
+            self._items.move_to_end(compiled.template_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return compiled
+
+    def get(self, template) -> CompiledTemplate:
+        """قالب کامپایل‌شده یک SMSTemplate بارگذاری‌شده"""
+        compiled = self._lookup(template.id, template.updated_at)
+        if compiled is None:
+            compiled = self._store(CompiledTemplate(template.template, template.get_variables_list(),
+                                                    template.id, template.updated_at))
+        return compiled
+
+    def get_by_id(self, template_id: int) -> Optional[CompiledTemplate]:
+        """قالب با شناسه (None اگر وجود نداشته باشد)؛ در حالت hit فقط updated_at خوانده می‌شود"""
+        from models import db, SMSTemplate
+        row = db.session.query(SMSTemplate.updated_at).filter(SMSTemplate.id == template_id).first()
+        if row is None:
+            return None
+        compiled = self._lookup(template_id, row[0])
+        if compiled is None:
+            template = db.session.get(SMSTemplate, template_id)
+            if template is None:
+                return None
+            compiled = self._store(CompiledTemplate(template.template, template.get_variables_list(),
+                                                    template.id, template.updated_at))
+        return compiled
+
+    def invalidate(self, template_id: Optional[int] = None):
+        with self._lock:
+            if template_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(template_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+template_cache = TemplateCache()
+
+
+def user_context(user, **extra) -> Dict:
+    """متغیرهای استاندارد قالب برای یک FreeIPAUser (همان فهرست راهنمای فرم قالب)"""
+    context = {
+        'username': user.uid,
+        'fullname': user.cn,
+        'firstname': user.givenname,
+        'lastname': user.sn,
+        'email': user.mail,
+        'mobile': user.mobile or '',
+    }
+    context.update(extra)
+    return context
+
+
+def render_many(template_id: int, contexts: List[Dict]) -> List[str]:
+    """رندر دسته‌ای قالب با شناسه؛ TemplateError برای قالب ناموجود/نامعتبر یا متغیر ناموجود"""
+    compiled = template_cache.get_by_id(template_id)
+    if compiled is None:
+        raise TemplateError('قالب پیامک یافت نشد')
+    return compiled.render_many(contexts)
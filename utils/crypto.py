@@ -1,59 +1,158 @@
 import base64
 import os
-from typing import Optional
-from cryptography.fernet import Fernet, InvalidToken
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.backends import default_backend
 
-_FERNET: Optional[Fernet] = None
+# Key ring: CREDENTIALS_KEYS="kid2:<fernet key>,kid1:<fernet key>" (first = primary, used for
+# encryption; the rest stay decrypt-only until re-encryption finishes). Tokens written with a
+# key id are stored as "<kid>$<fernet token>"; plain tokens (legacy CREDENTIALS_KEY) are tried
+# against every key like MultiFernet.
+KEY_ID_SEPARATOR = '$'
+LEGACY_KEY_ID = 'legacy'
+_KEY_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+# Fernet tokens start with version byte 0x80 -> "gAAAAA" in urlsafe base64
+_FERNET_PREFIX = 'gAAAAA'
 
-def _load_key_from_env() -> Optional[bytes]:
-    key_b64 = os.environ.get('CREDENTIALS_KEY') or ''
-    if not key_b64:
-        return None
+_RING: Optional['KeyRing'] = None
+_RING_LOCK = threading.Lock()
+
+
+class KeyRing:
+    def __init__(self, keys: List[Tuple[Optional[str], bytes]]):
+        if not keys:
+            raise ValueError('empty key ring')
+        self.keys: Dict[Optional[str], Fernet] = {}
+        for key_id, key in keys:
+            if key_id is not None and not _KEY_ID_RE.match(key_id):
+                raise ValueError(f'invalid key id: {key_id!r}')
+            self.keys.setdefault(key_id, Fernet(key))
+        self.primary_id = keys[0][0]
+        self._primary = self.keys[self.primary_id]
+        self._all = MultiFernet(list(self.keys.values()))
+
+    @staticmethod
+    def split(token: str) -> Tuple[Optional[str], str]:
+        key_id, sep, rest = token.partition(KEY_ID_SEPARATOR)
+        if sep and _KEY_ID_RE.match(key_id) and rest.startswith(_FERNET_PREFIX):
+            return key_id, rest
+        return None, token
+
+    def key_id(self, token: str) -> Optional[str]:
+        return self.split(token)[0]
+
+    def needs_rotation(self, token: str) -> bool:
+        return self.key_id(token) != self.primary_id
+
+    def encrypt(self, data: bytes) -> str:
+        token = self._primary.encrypt(data).decode('utf-8')
+        return token if self.primary_id is None else f'{self.primary_id}{KEY_ID_SEPARATOR}{token}'
+
+    def decrypt(self, token: str) -> bytes:
+        key_id, raw = self.split(token)
+        fernet = self.keys.get(key_id) if key_id is not None else None
+        if fernet is not None:
+            return fernet.decrypt(raw.encode('utf-8'))
+        # unknown/legacy id: try every key (primary first)
+        return self._all.decrypt(raw.encode('utf-8'))
+
+    def rotate(self, token: str) -> str:
+        return self.encrypt(self.decrypt(token))
+
+
+def _valid_key(key_b64: str) -> Optional[bytes]:
     try:
         # Expect URL-safe base64-encoded 32-byte key for Fernet
-        key = key_b64.encode('utf-8')
+        key = key_b64.strip().encode('utf-8')
         # Validate by constructing Fernet
         Fernet(key)
         return key
     except Exception:
         return None
 
-def _get_fernet() -> Optional[Fernet]:
-    global _FERNET
-    if _FERNET is not None:
-        return _FERNET
-    key = _load_key_from_env()
-    if key is None:
+
+def parse_key_ring(spec: str) -> List[Tuple[str, bytes]]:
+    keys = []
+    for part in (spec or '').split(','):
+        key_id, sep, key_b64 = part.strip().partition(':')
+        if not sep:
+            continue
+        key = _valid_key(key_b64)
+        if key is not None and _KEY_ID_RE.match(key_id.strip()):
+            keys.append((key_id.strip(), key))
+    return keys
+
+
+def _load_key_from_env() -> Optional[bytes]:
+    key_b64 = os.environ.get('CREDENTIALS_KEY') or ''
+    if not key_b64:
+        return None
+    return _valid_key(key_b64)
+
+
+def _load_ring_from_env() -> Optional[KeyRing]:
+    keys: List[Tuple[Optional[str], bytes]] = list(parse_key_ring(os.environ.get('CREDENTIALS_KEYS') or ''))
+    legacy = _load_key_from_env()
+    if legacy is not None and legacy not in [k for _, k in keys]:
+        # single-key setup keeps writing plain tokens; with a ring it is decrypt-only
+        keys.append((LEGACY_KEY_ID if keys else None, legacy))
+    if not keys:
         return None
     try:
-        _FERNET = Fernet(key)
-        return _FERNET
+        return KeyRing(keys)
     except Exception:
         return None
 
+
+def get_key_ring() -> Optional[KeyRing]:
+    global _RING
+    if _RING is not None:
+        return _RING
+    with _RING_LOCK:
+        if _RING is None:
+            _RING = _load_ring_from_env()
+    return _RING
+
+
+def reload_keys() -> Optional[KeyRing]:
+    global _RING
+    with _RING_LOCK:
+        _RING = _load_ring_from_env()
+    return _RING
+
+
+def generate_key() -> str:
+    return Fernet.generate_key().decode('utf-8')
+
+
+def is_encrypted_token(value: Optional[str]) -> bool:
+    if not value:
+        return False
+    return KeyRing.split(value)[1].startswith(_FERNET_PREFIX)
+
+
 def is_crypto_ready() -> bool:
-    return _get_fernet() is not None
+    return get_key_ring() is not None
 
 def encrypt_text(plaintext: str) -> Optional[str]:
     if plaintext is None:
         return None
-    f = _get_fernet()
-    if f is None:
+    ring = get_key_ring()
+    if ring is None:
         return None
-    token = f.encrypt(plaintext.encode('utf-8'))
-    return token.decode('utf-8')
+    return ring.encrypt(plaintext.encode('utf-8'))
 
 def decrypt_text(ciphertext: str) -> Optional[str]:
     if not ciphertext:
         return None
-    f = _get_fernet()
-    if f is None:
+    ring = get_key_ring()
+    if ring is None:
         return None
     try:
-        data = f.decrypt(ciphertext.encode('utf-8'))
+        data = ring.decrypt(ciphertext)
         return data.decode('utf-8')
     except InvalidToken:
         return None
-
@@ -0,0 +1,48 @@
+import ipaddress
+from typing import Optional, Tuple
+
+# طول ثابت hex برای هر نسخه تا ترتیب رشته‌ای با ترتیب عددی یکسان باشد
+HEX_WIDTH = {4: 8, 6: 32}
+MAX_PREFIX = {4: 32, 6: 128}
+
+
+def parse_ip(value: Optional[str]):
+    """تبدیل رشته آزاد (مثلاً '10.0.0.5' یا '10.0.0.5/24') به ip_address یا None"""
+    if not value:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return ipaddress.ip_interface(text).ip
+    except ValueError:
+        return None
+
+
+def to_hex(version: int, number: int) -> str:
+    return format(number, '0{}x'.format(HEX_WIDTH[version]))
+
+
+def ip_sort_key(value: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+    """(ip_version, ip_value) برای ذخیره در Server؛ برای مقدار نامعتبر (None, None)"""
+    ip = parse_ip(value)
+    if ip is None:
+        return None, None
+    return ip.version, to_hex(ip.version, int(ip))
+
+
+def cidr_bounds(cidr: str) -> Tuple[int, str, str]:
+    """(version, low_hex, high_hex) برای یک بازه CIDR؛ ValueError در صورت نامعتبر بودن"""
+    net = ipaddress.ip_network(str(cidr).strip(), strict=False)
+    return (net.version,
+            to_hex(net.version, int(net.network_address)),
+            to_hex(net.version, int(net.broadcast_address)))
+
+
+def subnet_for(version: int, ip_value: str, prefix: int) -> str:
+    """زیرشبکه /prefix شامل آدرس ذخیره‌شده (prefix بزرگ‌تر از طول آدرس محدود می‌شود)"""
+    bits = MAX_PREFIX[version]
+    prefix = max(0, min(int(prefix), bits))
+    number = int(ip_value, 16) >> (bits - prefix) << (bits - prefix)
+    address = ipaddress.IPv4Address(number) if version == 4 else ipaddress.IPv6Address(number)
+    return f'{address}/{prefix}'